@@ -18,11 +18,12 @@ from modbuildcore.jobs import *
 # We don't need to declare the jobs here. We'll just create the dicts and populate them as we go.
 downloads: dict[str, DownloadJob] = {}
 archive_extractions: dict[str, ArchiveExtractJob] = {}
-makefiles: dict[str, MakefileJob] = {}
+makefiles: dict[str, MakefileJob | MipsCompileJob] = {}
 mod_tomls: dict[str, ModTomlJob] = {}
 cmake_build_groups: dict[str, dict[str, CMakeBuildJob]] = {}
 build_outputs: dict[str, BuildOutputJob] = {}
 thunderstore_packages: dict[str, ThunderstorePackageJob] = {}
+symbol_indexes: dict[str, SymbolIndexJob] = {}
 
 # Every job has a dict member called `mod_output_files`, which specifies what files (if any) the job generates that are required for the mod
 # to run (such as the .nrm file or an extlib), i.e. files that should go in Zelda64Recompiled's 'mods' folder or a Thunderstore package.
@@ -56,6 +57,31 @@ root_dir: Path = Path(__file__).parent
 archive_downloads_dir: Path = root_dir.joinpath("downloads")
 build_dir: Path = root_dir.joinpath("build")
 binaries_dir: Path = root_dir.joinpath("binaries")
+state_dir: Path = root_dir.joinpath(".modbuild")
+
+# MakefileJobs, CMakeBuildJobs and ModTomlJobs can tell when they're up to date. After they run, they record fingerprints
+# of their inputs and outputs in this store. On the next invokation, they're skipped if none of those have changed.
+# Set this to None if you'd rather those jobs always run.
+JobBase.state_store = JobStateStore(state_dir.joinpath("state"))
+
+# CMakeBuildJobs and ModTomlJobs can also restore their outputs from a content-addressed cache, keyed by their inputs.
+# This means switching back to a branch you've built before doesn't need to rebuild anything that was built there.
+# Set MODBUILD_ARTIFACT_URL to share the cache over HTTP (any server that supports GET and PUT), or set this to None to disable it.
+artifact_backends = [LocalArtifactBackend(state_dir.joinpath("artifacts"))]
+if os.environ.get("MODBUILD_ARTIFACT_URL"):
+    artifact_backends.append(HttpArtifactBackend(os.environ["MODBUILD_ARTIFACT_URL"]))
+JobBase.artifact_cache = ArtifactCache(artifact_backends, state_dir.joinpath("tmp"))
+# Cache keys use paths relative to this folder, so every clone of the project shares the same keys.
+JobBase.project_root = root_dir
+
+# DownloadJobs pinned to a sha256 are kept in a cache shared by every project on this machine (~/.cache/modbuild/blobs
+# on Linux, or MODBUILD_CACHE_DIR if set), so other clones, and this one after a distclean, don't download them again.
+DownloadJob.blob_cache = BlobCache.get_default()
+# Extracted toolchains are kept in a similar store (~/.cache/modbuild/trees), and placed in binaries/ as reflinks or hardlinks
+# (or copies, if the filesystem supports neither). Set `ArchiveExtractJob.materialize_mode = "symlink"` to symlink them instead.
+ArchiveExtractJob.tree_store = TreeStore.get_default()
+# A machine's local mirror is picked up from MODBUILD_MIRROR_DIR (directories holding the downloads by filename or sha256)
+# and MODBUILD_MIRRORS (base URLs to try alongside each download's own URL). Run with --offline to never use the network.
 
 make_mips_compiler_path: Path = None
 make_mips_linker_path: Path = None
@@ -64,13 +90,23 @@ mod_tool_path: Path = None
 # ============== Artifact Downloads and Extractions ==============
 
 # Convienience function to create DownloadJobs and ArchiveExtractJobs for the compiler artifacts.
-def add_archive_download_and_extract(name: str, url: str, extract_dir: Path) -> tuple[DownloadJob, ArchiveExtractJob]:
+# Pass the archive's `sha256` to verify it and share it through `DownloadJob.blob_cache`. The hash of an unpinned
+# download is printed after it finishes.
+# With `stream` set, the extraction job does the download itself, and tarballs are extracted while they download rather than
+# after. The archive is still saved to `downloads/` (and the blob cache) for next time.
+# Pass `include` and/or `exclude` glob patterns (such as `["*/bin", "*/lib/clang"]`) to only extract part of the archive.
+def add_archive_download_and_extract(name: str, url: str, extract_dir: Path, sha256: str = None, stream: bool = True,
+        include: list[str] = None, exclude: list[str] = None) -> tuple[DownloadJob, ArchiveExtractJob]:
     global archive_extractions, downloads, archive_downloads_dir
     
-    new_download = DownloadJob(url, archive_downloads_dir)
-    new_extraction = ArchiveExtractJob(new_download.download_path, extract_dir)
-    # This new extraction job depends on the download being completed.
-    new_extraction.depends_on([new_download])
+    # The toolchain archives are large, so they're fetched over several connections (if the server allows it).
+    new_download = DownloadJob(url, archive_downloads_dir, connections=4, sha256=sha256)
+    if stream:
+        new_extraction = ArchiveExtractJob(new_download.download_path, extract_dir, download=new_download, include=include, exclude=exclude)
+    else:
+        new_extraction = ArchiveExtractJob(new_download.download_path, extract_dir, include=include, exclude=exclude)
+        # This new extraction job depends on the download being completed.
+        new_extraction.depends_on([new_download])
     downloads[name] = new_download
     archive_extractions[name] = new_extraction
     
@@ -130,28 +166,81 @@ archive_extractions['assets'] = assets_archive_job
 # ModTomlJob instances automatically register the resultant .nrm file as a mod_output_file. Therefore the .nrm will 
 # automatically be added to any build output folders or thunderstore packages that depend on this job.
 main_toml = ModTomlJob(mod_tool_path, root_dir.joinpath("mod.toml"))
-# The mod toml file is read when the job is first created. We now have access to all the information in the toml.
-
-# Declaring the makefile that will build our mod's elf binary. In this template, we've declared it second so that we can pass information
-# from the mod toml to the makefile job.
-main_makefile = MakefileJob(
-    root_dir.joinpath("mod_elf.mk"),
-    # We can pass information to the makefile here, by declaring additional environmental variables for make to use.
-    # Environmental variables are automatically added to the variable namespace in a makefile.
-    # This template uses a generalized makefile that could be configured to compile multiple mods by passing
-    # different environmental variables here. It's also set up to let us pass in the compiler and linker we want to use.
-    {
-        "_ELF_PATH": str(main_toml.get_elf_path()),
-        "_BUILD_DIR": str(main_toml.build_dir),
-        "_MIPS_CC": str(make_mips_compiler_path),
-        "_MIPS_LD": str(make_mips_linker_path),
-        "_SRC_DIR": "src/mod"
-    }
-)
+# The mod toml file is read the first time we use information from it, such as `main_toml.data`.
+
+# Declaring the job that will build our mod's elf binary. In this template, we've declared it second so that we can pass information
+# from the mod toml to it.
+# By default, the mod's elf is compiled with `mod_elf.mk` through Make. Set this to True to use a MipsCompileJob instead,
+# which does the same thing without Make: it compiles the files in src/mod in parallel, and only recompiles the files
+# whose source, included headers or flags changed (tracked with clang depfiles). Its flags are read from the plain
+# variable assignments in common.mk, so Make functions and conditionals there aren't picked up.
+# Either way, the job is registered as the 'mod' makefile, so `./modbuild.py makefile` runs it.
+use_mips_compile_job = False
+
+if use_mips_compile_job:
+    main_makefile = MipsCompileJob(
+        root_dir.joinpath("src/mod"),
+        # The elf path and build directory come from the mod toml. As LazyValues, they're only read once the job needs them,
+        # so that commands like `--list` don't read the toml.
+        LazyValue(main_toml.get_elf_path),
+        make_mips_compiler_path,
+        make_mips_linker_path,
+        build_dir=LazyValue(lambda: main_toml.build_dir),
+        flags_makefile=root_dir.joinpath("common.mk"),
+        # Headers to parse once into a precompiled header, instead of once per file, such as ["modding.h", "global.h"]
+        # (`global.h` is most of the decomp, so this is where most of the parsing time goes). They're included at the very
+        # top of every file, ahead of anything the file defines or includes first, so only list headers that your files
+        # already start with. Run `python3 benchmarks/pch_bench.py` to see how much it would save per file.
+        pch_headers=None,
+        # Set this to True to compile src/mod in batches of `unity_batch_size` files (a unity build), so that the headers are
+        # parsed once per batch instead of once per file. This speeds up clean and release builds of larger mods. Files
+        # in a batch share one scope, so list any that clash with others (such as by defining the same static names) in
+        # `unity_exclude`, relative to src/mod, to compile them on their own.
+        unity_build=False,
+        unity_batch_size=8,
+        unity_exclude=[],
+        # The other files and directories the compile reads. If none of these, the sources, the flags or the toolchain
+        # have changed since the last build, and the .elf is still intact, nothing is checked file by file.
+        input_paths=[
+            root_dir.joinpath("mod.ld"),
+            root_dir.joinpath("include"),
+            root_dir.joinpath("mm-decomp/include"),
+            assets_extracted_path,
+        ]
+    )
+else:
+    main_makefile = MakefileJob(
+        root_dir.joinpath("mod_elf.mk"),
+        # We can pass information to the makefile here, by declaring additional environmental variables for make to use.
+        # Environmental variables are automatically added to the variable namespace in a makefile.
+        # This template uses a generalized makefile that could be configured to compile multiple mods by passing
+        # different environmental variables here. It's also set up to let us pass in the compiler and linker we want to use.
+        {
+            # These come from the mod toml, which is only read once the job needs them.
+            "_ELF_PATH": LazyValue(main_toml.get_elf_path),
+            "_BUILD_DIR": LazyValue(lambda: main_toml.build_dir),
+            "_MIPS_CC": str(make_mips_compiler_path),
+            "_MIPS_LD": str(make_mips_linker_path),
+            "_SRC_DIR": "src/mod"
+        },
+        # The files and directories the makefile reads. If none of these (or the environmental variables above) have changed
+        # since the last build, and the .elf is still intact, make won't be invoked at all.
+        input_paths=[
+            root_dir.joinpath("common.mk"),
+            root_dir.joinpath("mod.ld"),
+            root_dir.joinpath("src/mod"),
+            root_dir.joinpath("include"),
+            root_dir.joinpath("mm-decomp/include"),
+            assets_extracted_path,
+            make_mips_compiler_path,
+            make_mips_linker_path,
+        ],
+        output_paths=[LazyValue(main_toml.get_elf_path)]
+    )
 
-# We've set the makefile to use the MIPS-only clang and ld.lld that we downloaded and extracted (The 'llvmmips' DownloadJob and ArchiveExtractJob).
-# So, we'll mark this MakefileJob as depending on that ArchiveExtractJob. We don't need to mark it as depending on the DownloadJob,
-# since the ArchiveExtractJob already depends on the DownloadJob.
+# We've set the compile job to use the MIPS-only clang and ld.lld that we downloaded and extracted (The 'llvmmips' DownloadJob and ArchiveExtractJob).
+# So, we'll mark this job as depending on that ArchiveExtractJob. We don't need to mark it as depending on the DownloadJob,
+# since the ArchiveExtractJob already downloads the archive (or depends on the DownloadJob, if it isn't streamed).
 # Also declaring dependency on the asset archive extraction job.
 main_makefile.depends_on([archive_extractions["llvmmips"], assets_archive_job])
 
@@ -163,6 +252,16 @@ main_toml.depends_on([main_makefile, archive_extractions["llvmmips"]])
 mod_tomls['mod'] = main_toml
 makefiles['mod'] = main_makefile
 
+# An index of the reference symbol files the mod toml uses (Zelda64RecompSyms), for fast symbol and address lookups with
+# `./modbuild.py syms lookup <name or address>`, or from Python with `symbol_indexes['mm'].open()`.
+# Since the symbol files are listed in the mod toml, we pass them lazily so that the toml is only read when the index is needed.
+# The index is only rebuilt when the symbol files or the overlay list change.
+symbol_indexes['mm'] = SymbolIndexJob(
+    LazyValue(main_toml.get_reference_syms_paths),
+    state_dir.joinpath("syms/mm.us.rev1.symidx"),
+    root_dir.joinpath("overlays.us.rev1.txt")
+)
+
 # ============== Build Output and Packaging ==============
 
 # BuildOutputJobs are used to copy the mod_output_files from other jobs into a single, convenient directory. 
@@ -208,20 +307,21 @@ def package_url_from_git() -> str:
 # Here we define the main Thunderstore package we want to produce.
 # The ThunderstorePackageJob collects all the mod_output_files and stores them in a zip archive, along with
 # the required metadata for a Thunderstore package.
-thunderstore_package_name = main_toml.data["manifest"]["id"]
+thunderstore_package_name = LazyValue(lambda: main_toml.data["manifest"]["id"])
 main_package = ThunderstorePackageJob(
     # The GitHub Actions CI Workflows assume the uploaded package will have the following naming scheme:
     #  name_in_package_manifest.thunderstore.zip
-    root_dir.joinpath(f"{thunderstore_package_name}.thunderstore.zip"),
+    LazyValue(lambda: root_dir.joinpath(f"{thunderstore_package_name.get()}.thunderstore.zip")),
     {
         "name": thunderstore_package_name,
-        "version_number": main_toml.data["manifest"]["version"], # We'll read the version number from the mod toml.
-        "website_url": package_url_from_git(),
-        "description": main_toml.data["manifest"]["short_description"],
+        # Wrapped in LazyValues so that the mod toml and .md files are only read, and git only run, when a package is actually built.
+        "version_number": LazyValue(lambda: main_toml.data["manifest"]["version"]), # We'll read the version number from the mod toml.
+        "website_url": LazyValue(package_url_from_git),
+        "description": LazyValue(lambda: main_toml.data["manifest"]["short_description"]),
         "dependencies": []
     },
-    root_dir.joinpath("thunderstore_info/README.md").read_text(),
-    root_dir.joinpath("thunderstore_info/CHANGELOG.md").read_text(),
+    LazyValue(root_dir.joinpath("thunderstore_info/README.md").read_text),
+    LazyValue(root_dir.joinpath("thunderstore_info/CHANGELOG.md").read_text),
     root_dir.joinpath("thumb.png")
 )
 
@@ -244,6 +344,7 @@ clean_paths: list[Path] = [
 ]
 
 distclean_paths: list[Path] = [
+    state_dir,
     binaries_dir,
     archive_downloads_dir,
     assets_extracted_path.parent
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Compares `modbuildcore.extraction.extract_archive` with shutil.unpack_archive (what ArchiveExtractJob used before).
+#
+# Usage: python3 benchmarks/extract_bench.py [archive ...] [--repeat N]
+#
+# With no archives given, the project's 'llvm' and 'zig' downloads are used (`./modbuild.py download --name llvm,zig`
+# fetches them, using a project.py with an 'llvm' download such as EXAMPLES/nrm_and_zig+llvm_extlib).
+import sys, os, time, shutil, argparse, tempfile, importlib
+from pathlib import Path
+prog_root = Path(__file__).parent.parent
+sys.path.append(str(prog_root.joinpath("py")))
+sys.path.insert(0, str(prog_root))
+
+from modbuildcore.extraction import extract_archive, get_external_decompressor
+
+def get_project_archives() -> list[Path]:
+    p = importlib.import_module("user_project" if prog_root.joinpath("user_project.py").exists() else "project")
+    retVal = []
+    for name in ("llvm", "zig"):
+        if name not in p.downloads:
+            print(f"project.py has no '{name}' download. Skipping it.")
+        elif not p.downloads[name].download_path.exists():
+            print(f"'{p.downloads[name].download_path}' hasn't been downloaded. Skipping it.")
+        else:
+            retVal.append(p.downloads[name].download_path)
+    return retVal
+
+def measure(func, archive: Path, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(dir=archive.parent) as temp_dir:
+            start = time.perf_counter()
+            func(archive, Path(temp_dir).joinpath("out"))
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark archive extraction.")
+    parser.add_argument("archives", nargs="*", type=Path)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method. The fastest is reported.")
+    args = parser.parse_args()
+
+    archives = args.archives or get_project_archives()
+    if len(archives) == 0:
+        print("No archives to benchmark.")
+        return 1
+
+    for archive in archives:
+        size = archive.stat().st_size / (1024 * 1024)
+        decompressor = get_external_decompressor(archive)
+        print(f"{archive.name} ({size:.1f} MiB, decompressor: {'python' if decompressor is None else ' '.join(decompressor)})")
+        before = measure(shutil.unpack_archive, archive, args.repeat)
+        after = measure(extract_archive, archive, args.repeat)
+        print(f"  shutil.unpack_archive: {before:8.2f}s")
+        print(f"  extract_archive:       {after:8.2f}s  ({before / after:.2f}x)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
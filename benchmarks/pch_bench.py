@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Measures how long the MIPS clang takes to parse each translation unit of the mod, with and without a precompiled header
+# (see `MipsCompileJob.pch_headers`). Each file is only parsed and type-checked (`-fsyntax-only`), so code generation,
+# which the PCH doesn't help with, isn't counted.
+#
+# Usage: python3 benchmarks/pch_bench.py [source.c ...] [--headers global.h,...] [--repeat N]
+#
+# The compiler, flags, sources and headers come from the project's 'mod' makefile if it's a MipsCompileJob (run
+# `./modbuild.py extract` first, for the compiler). Without `pch_headers` there, `modding.h` and `global.h` are precompiled.
+import sys, os, time, argparse, tempfile, subprocess, importlib
+from pathlib import Path
+prog_root = Path(__file__).parent.parent
+sys.path.append(str(prog_root.joinpath("py")))
+sys.path.insert(0, str(prog_root))
+
+from modbuildcore.mips import MipsCompileJob
+
+DEFAULT_HEADERS = ["modding.h", "global.h"]
+
+def get_project_job() -> MipsCompileJob:
+    p = importlib.import_module("user_project" if prog_root.joinpath("user_project.py").exists() else "project")
+    job = p.makefiles.get("mod")
+    if not isinstance(job, MipsCompileJob):
+        print("The project's 'mod' makefile isn't a MipsCompileJob. Set `use_mips_compile_job` in project.py.")
+        return None
+    return job
+
+def measure(command: list[str], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=prog_root, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"'{command[0]}' failed:\n{result.stdout.decode(errors='replace')}")
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-file parse time with and without a precompiled header.")
+    parser.add_argument("sources", nargs="*", type=Path)
+    parser.add_argument("--headers", help="Headers to precompile, separated by ','. Defaults to the project's `pch_headers`.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per file and mode. The fastest is reported.")
+    args = parser.parse_args()
+
+    project_job = get_project_job()
+    if project_job is None:
+        return 1
+    if not Path(project_job.cc_path).exists():
+        print(f"'{project_job.cc_path}' doesn't exist. Run `./modbuild.py extract` first.")
+        return 1
+    headers = args.headers.split(",") if args.headers else (project_job.pch_headers or DEFAULT_HEADERS)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # A copy of the project's job, building into the temporary folder.
+        job = MipsCompileJob(project_job.src_dir, Path(temp_dir).joinpath("bench.elf"), project_job.cc_path, project_job.ld_path,
+            flags_makefile=project_job.flags_makefile, extra_cflags=project_job.extra_cflags, pch_headers=headers)
+        sources = args.sources or job.find_sources()
+        if len(sources) == 0:
+            print("No sources to benchmark.")
+            return 1
+
+        job.write_pch_prefix()
+        pch_time = measure(job.get_pch_command(), 1)
+        print(f"Precompiling {', '.join(headers)}: {pch_time:.3f}s")
+
+        base = [str(job.cc_path)] + job.cflags + ["-fsyntax-only"]
+        pch_flags = ["-include-pch", str(job.get_pch_path())]
+        total_before = 0.0
+        total_after = 0.0
+        print(f"{'File':<40} {'Without PCH':>12} {'With PCH':>12} {'Speedup':>8}")
+        for source in sources:
+            before = measure(base + [str(source)], args.repeat)
+            after = measure(base + pch_flags + [str(source)], args.repeat)
+            total_before += before
+            total_after += after
+            print(f"{os.path.relpath(source, prog_root):<40} {before:11.3f}s {after:11.3f}s {before / after:7.2f}x")
+        print(f"{'Total':<40} {total_before:11.3f}s {total_after:11.3f}s {total_before / total_after:7.2f}x")
+        saved_per_file = (total_before - total_after) / len(sources)
+        if saved_per_file > 0:
+            print(f"Building the PCH pays for itself after {pch_time / saved_per_file:.1f} file(s).")
+        else:
+            print("The PCH doesn't make parsing faster for these files.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
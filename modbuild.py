@@ -1,16 +1,65 @@
 #!/usr/bin/env python3
 
 # Loading 'py' folder into the module search path.
-import sys
+import sys, os
 from pathlib import Path
 prog_root = Path(__file__).parent
 sys.path.append(str(prog_root.joinpath("py")))
 
+SERVER_SOCKET_PATH = prog_root.joinpath(".modbuild/server.sock")
+
+# Forwards an invokation to a running `modbuild.py --server`, and streams back its output. Returns the exit code,
+# or None if no server is running. This is the client side of the protocol in `modbuildcore.server`. It's kept here, 
+# and only imports from the standard library, so that the client doesn't pay for loading the project.
+def run_client(argv: list[str]):
+    import socket, json, struct
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(SERVER_SOCKET_PATH))
+    except OSError:
+        sock.close()
+        return None
+    
+    def recv_exact(size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if len(chunk) == 0:
+                raise ConnectionError("The modbuild server closed the connection unexpectedly.")
+            data += chunk
+        return data
+    
+    request = json.dumps({"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}).encode("utf-8")
+    sock.sendall(struct.pack("!cI", b"r", len(request)) + request)
+    
+    with sock:
+        while True:
+            kind, size = struct.unpack("!cI", recv_exact(5))
+            payload = recv_exact(size)
+            if kind == b"o":
+                sys.stdout.buffer.write(payload)
+                sys.stdout.buffer.flush()
+            elif kind == b"x":
+                return struct.unpack("!i", payload)[0]
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == "--client":
+    exit_code = run_client(["modbuild.py"] + sys.argv[2:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+    print(f"No modbuild server is listening on '{SERVER_SOCKET_PATH}'. Running locally...", file=sys.stderr, flush=True)
+    del sys.argv[1]
+
 # Program startup:
+import importlib
 from invoke import Collection, __version__, Program, Argument
 from invoke.config import Config, merge_dicts
 
 import tasks
+from modbuildcore.job_base import JobBase
+from modbuildcore.server import ModBuildServer
 
 class Z64rModBuildConfig(Config):
     prefix = 'z64r_modbuild'
@@ -18,17 +67,74 @@ class Z64rModBuildConfig(Config):
     @staticmethod
     def global_defaults():
         their_defaults = Config.global_defaults()
-        my_defaults = {}
+        my_defaults = {
+            'modbuild': {
+                'jobs': 1,
+                'network_jobs': 4,
+                'offline': False,
+                'trace': None,
+            },
+        }
         return merge_dicts(their_defaults, my_defaults)
 
 class ModBuildProgram(Program):
     def core_args(self):
         core_args = super().core_args()
-        extra_args = []
+        extra_args = [
+            Argument(
+                names=("jobs", "j"),
+                kind=int,
+                default=1,
+                help="Number of independent jobs to run concurrently. 0 uses one per CPU.",
+            ),
+            Argument(
+                names=("offline",),
+                kind=bool,
+                default=False,
+                help="Don't use the network. Downloads are only taken from the blob cache and local mirrors.",
+            ),
+            Argument(
+                names=("trace",),
+                help="Write a Chrome/Perfetto trace of job timings to this file.",
+            ),
+            Argument(
+                names=("server",),
+                kind=bool,
+                default=False,
+                help="Run a resident server that keeps the project loaded, for use with --client. Unix only.",
+            ),
+            Argument(
+                names=("client",),
+                kind=bool,
+                default=False,
+                help="Forward this invokation to a running --server. Must be the first argument. Runs locally if no server is running.",
+            ),
+        ]
         return core_args + extra_args
+    
+    def update_config(self, merge: bool = True):
+        super().update_config(merge)
+        self.config.modbuild.jobs = self.args.jobs.value
+        if self.args.offline.value:
+            self.config.modbuild.offline = True
+        if self.args.trace.value:
+            self.config.modbuild.trace = self.args.trace.value
+    
+    def execute(self):
+        if self.args.server.value:
+            sys.exit(run_server())
+        
+        try:
+            super().execute()
+        finally:
+            JobBase.timer.print_summary()
+            if JobBase.state_store is not None:
+                JobBase.state_store.record_timings(JobBase.timer.get_timings("run"))
+            if self.config.modbuild.trace:
+                JobBase.timer.write_chrome_trace(Path(self.config.modbuild.trace))
 
-if __name__ == '__main__':
-    program = ModBuildProgram(
+def create_program() -> ModBuildProgram:
+    return ModBuildProgram(
         name="Mod Builder",
         binary="modbuild.py",
         binary_names=["modbuild.py"],
@@ -37,4 +143,32 @@ if __name__ == '__main__':
         config_class=Z64rModBuildConfig,
     )
 
-    program.run()
+def run_server() -> int:
+    def run_argv(argv: list[str]) -> int:
+        try:
+            create_program().run(argv)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        return 0
+    
+    def get_watched_files() -> list[Path]:
+        retVal = [Path(tasks.__file__), Path(tasks.p.__file__)]
+        retVal.extend(i.toml_path for i in tasks.p.mod_tomls.values())
+        return retVal
+    
+    def reload():
+        tasks.p.reload()
+        importlib.reload(tasks)
+    
+    def prepare():
+        if JobBase.state_store is not None:
+            JobBase.state_store.refresh()
+    
+    server = ModBuildServer(SERVER_SOCKET_PATH, run_argv, get_watched_files=get_watched_files, reload=reload, prepare=prepare)
+    return server.serve_forever()
+
+if __name__ == '__main__':
+    create_program().run()
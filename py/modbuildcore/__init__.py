@@ -2,20 +2,48 @@ import enum, shutil
 from pathlib import Path
 
 from . import archives
+from . import artifacts
+from . import blobs
 from . import cmake
 from . import downloads
+from . import extraction
+from . import fetch
+from . import graph
+from . import jobserver
 from . import makefiles
+from . import mips
+from . import scheduler
+from . import server
+from . import state
+from . import symbols
+from . import timing
 from . import tomls
+from . import trees
 from . import utils
+from . import watch
 
     
 __all__ = [
     'archives',
+    'artifacts',
+    'blobs',
     'cmake',
     'downloads',
+    'extraction',
+    'fetch',
+    'graph',
+    'jobserver',
     'makefiles',
+    'mips',
+    'scheduler',
+    'server',
+    'state',
+    'symbols',
+    'timing',
     'tomls',
+    'trees',
     'utils',
+    'watch',
 ]
 
 
@@ -1,39 +1,395 @@
-import pathlib, os, shutil
+import pathlib, os, json, shutil, queue, hashlib, tarfile, threading
 from pathlib import Path
 
 from invoke import Context
 from .job_base import JobBase
-from .utils import print_job_header
-        
+from .downloads import DownloadJob
+from .extraction import extract_archive, extract_tar, find_damaged_members
+from .fetch import hash_file
+from .jobserver import RESOURCE_NETWORK, Jobserver, get_job_resources
+from .trees import TreeStore, remove_tree
+from .utils import FileLock, print_job_header, print_fl
+
+# Archive types that can be extracted front to back while they're read, without seeking.
+STREAMABLE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz", ".tar.bz2", ".tbz2")
+# How many downloaded chunks can wait for the extractor before the download is paused.
+STREAM_QUEUE_SIZE = 16
+
+def is_streamable(path: Path) -> bool:
+    """Returns whether an archive can be extracted as it's downloaded, judging by its file extension."""
+    return Path(path).name.lower().endswith(STREAMABLE_SUFFIXES)
+
+
+class StreamingExtractor:
+    """Extracts a tar archive (optionally gzip, bzip2 or xz compressed) on a background thread, from chunks passed to `feed`.
+
+    Pass `feed` as the `on_chunk` of `DownloadJob.fetch` to decompress and untar an archive while it downloads.
+    Chunks are handed to the extractor through a bounded queue, so a download is paused while extraction catches up,
+    instead of buffering the whole archive in memory. The archive is hashed as it's fed, and the extracted files are
+    listed in `manifest` once it's finished.
+    """
+    extract_dir: Path
+    include: list[str]
+    exclude: list[str]
+    manifest: dict[str, int]
+    _hasher: "hashlib._Hash"
+    _queue: queue.Queue
+    _buffer: bytes
+    _offset: int
+    _thread: threading.Thread
+    _error: BaseException
+    _finished: threading.Event
+    _aborted: bool
+
+    def __init__(self, extract_dir: Path, include: list[str] = None, exclude: list[str] = None):
+        """Initializes the StreamingExtractor, and starts its extraction thread.
+
+        Args:
+            extract_dir (Path): The folder to extract to.
+            include (list[str], optional): Only extract members matching one of these glob patterns. Defaults to None.
+            exclude (list[str], optional): Don't extract members matching any of these glob patterns. Defaults to None.
+        """
+        self.extract_dir = extract_dir
+        self.include = include
+        self.exclude = exclude
+        self.manifest = None
+        self._hasher = hashlib.sha256()
+        self._queue = queue.Queue(STREAM_QUEUE_SIZE)
+        self._buffer = b""
+        self._offset = 0
+        self._error = None
+        self._finished = threading.Event()
+        self._aborted = False
+        self._thread = threading.Thread(target=self._extract, name=f"extract {extract_dir.name}", daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk: bytes):
+        """Pass the next part of the archive to the extractor. Blocks while the extractor is behind.
+
+        Raises:
+            Exception: Whatever stopped the extractor, if it failed.
+        """
+        self._hasher.update(chunk)
+        while not self._finished.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        # Anything after the end of the tar archive (such as padding) isn't needed.
+        if self._error is not None:
+            raise self._error
+
+    def finish(self) -> str:
+        """Signal the end of the archive, and wait for the rest of it to be extracted.
+
+        Raises:
+            Exception: Whatever stopped the extractor, if it failed.
+
+        Returns:
+            str: The sha256 hex digest of the archive.
+        """
+        self._put_end()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._hasher.hexdigest()
+
+    def abort(self):
+        """Stop extracting, and wait for the extraction thread to exit. Whatever was already extracted is left in place."""
+        self._aborted = True
+        self._put_end()
+        self._thread.join()
+
+    def _put_end(self):
+        while not self._finished.is_set():
+            try:
+                self._queue.put(None, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    # Called by tarfile, on the extraction thread.
+    def read(self, size: int = -1) -> bytes:
+        # tarfile reads in small blocks, so the buffer is only copied when a read spans two chunks.
+        while (size < 0 or len(self._buffer) - self._offset < size) and not self._aborted:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            self._buffer = self._buffer[self._offset:] + chunk
+            self._offset = 0
+        if self._aborted:
+            raise EOFError("Extraction was aborted.")
+        end = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+        retVal = self._buffer[self._offset:end]
+        self._offset = end
+        return retVal
+
+    def _extract(self):
+        try:
+            with tarfile.open(fileobj=self, mode="r|*") as archive:
+                self.manifest = extract_tar(archive, self.extract_dir, include=self.include, exclude=self.exclude)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._finished.set()
+
+
 class ArchiveExtractJob(JobBase):
-    """This job extracts a specified archive to a location. Does not need to run if the output directory already exists.
-    
+    """This job extracts a specified archive to a location. Does not need to run if the archive was already fully extracted there.
+
     The extracted files/directories are not counted as mod_output_files by default.
+
+    After a complete extraction, a stamp is written next to `extract_dir` (`<extract_dir>.stamp.json`), recording the
+    archive's sha256 and the size of every extracted file. On later runs, the job is only skipped if the stamp matches
+    the archive and every file is still there with the right size. If only some files are missing or damaged, just those
+    are extracted again. A changed archive is extracted again from scratch. The archive's digest is only recomputed if its
+    size or modification time changed.
+
+    Full extractions go to a temporary directory that's only renamed to `extract_dir` once it's complete, so an interrupted
+    extraction never leaves a partial tree behind. Extractions are serialized by a lock file (`<extract_dir>.lock`), so that
+    several modbuild processes sharing a `binaries/` folder don't extract over each other.
+
+    If the job is given the `download` that produces its archive, and that archive is a tarball, it's extracted while it
+    downloads instead of after, so the job takes about as long as the slower of the two. The download is still saved to
+    its `download_path` (and the blob cache) unless `keep_archive` is False.
+
+    Archives on disk are extracted with `extraction.extract_archive`, which decompresses zip members on `threads` threads
+    and hands `.tar.xz` decompression to a multithreaded `xz` process when one is installed. When jobs run concurrently,
+    zip extraction takes its threads from the jobserver instead, so that it doesn't compete with other jobs for the CPU.
+
+    If `ArchiveExtractJob.tree_store` is set, every extracted tree is kept there, keyed by the archive's sha256 and the
+    filters. Whenever the same archive needs extracting again (in another checkout, or after a distclean), the tree is
+    materialized from the store instead, using `materialize_mode` (see `TreeStore.materialize`). For a pinned download,
+    this skips the download too. Damaged files are repaired from the store when possible.
+
+    Set `include` and/or `exclude` to only extract part of an archive. They're lists of glob patterns matched against
+    member paths (where `*` also matches `/`, and matching a directory selects everything in it), such as
+    `["*/bin", "*/lib/clang"]`. Unselected zip members are never decompressed, and unselected tar members are never
+    written to disk. Keep in mind that a selected symlink or script may need files that weren't selected. Changing the
+    filters causes the archive to be extracted again.
     """
+    # Shared by all ArchiveExtractJobs.
+    tree_store: TreeStore = None
+    materialize_mode: str = "auto"
+
     archive_path: str
     extract_dir: Path
     force: bool
-    
-    def __init__(self, archive_path: Path, extract_dir: Path):
+    download: DownloadJob
+    keep_archive: bool
+    threads: int
+    include: list[str]
+    exclude: list[str]
+
+    def __init__(self, archive_path: Path, extract_dir: Path, *, download: DownloadJob = None, keep_archive: bool = True, threads: int = 0,
+            include: list[str] = None, exclude: list[str] = None):
         """Initializes the Archive extraction job
         Args:
             archive_path (Path): The file location of the archive to extract.
             extract_dir (Path): The output folder to extract to.
+            download (DownloadJob, optional): The DownloadJob that downloads `archive_path`. If set, the archive is downloaded
+                by this job, and streamed into the extraction if possible. It shouldn't also be a dependency of this job. Defaults to None.
+            keep_archive (bool, optional): If False, a streamed archive isn't saved to disk. Defaults to True.
+            threads (int, optional): How many zip members to extract at once, when jobs run one at a time. 0 means one per CPU. Defaults to 0.
+            include (list[str], optional): Only extract members matching one of these glob patterns. Defaults to None.
+            exclude (list[str], optional): Don't extract members matching any of these glob patterns. Defaults to None.
         """
         super().__init__()
         self.archive_path = archive_path
         self.extract_dir = extract_dir
         self.force = False
-        
+        self.download = download
+        self.keep_archive = keep_archive
+        self.threads = threads
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+
+        if self.download is not None:
+            self.resource_class = RESOURCE_NETWORK
+
+    def get_name(self) -> str:
+        return f"Archive Extraction: {self.extract_dir.name}"
+
+    def get_temp_extract_dir(self) -> Path:
+        return self.extract_dir.with_name(f"{self.extract_dir.name}.partial")
+
+    def get_stamp_path(self) -> Path:
+        return self.extract_dir.with_name(f"{self.extract_dir.name}.stamp.json")
+
+    def get_lock(self) -> FileLock:
+        return FileLock(self.extract_dir.with_name(f"{self.extract_dir.name}.lock"))
+
+    def load_stamp(self) -> dict:
+        try:
+            return json.loads(self.get_stamp_path().read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save_stamp(self, sha256: str, manifest: dict[str, int]):
+        stamp = {"sha256": sha256, "include": self.include, "exclude": self.exclude, "members": manifest}
+        archive_path = Path(self.archive_path)
+        if archive_path.is_file():
+            st = archive_path.stat()
+            stamp["archive_size"] = st.st_size
+            stamp["archive_mtime_ns"] = st.st_mtime_ns
+        temp_path = self.get_stamp_path().with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps(stamp))
+        os.replace(temp_path, self.get_stamp_path())
+
+    def get_archive_digest(self, stamp: dict = None) -> str:
+        """Get the sha256 of the archive, without reading it if its size and modification time match `stamp`.
+
+        Returns:
+            str: The archive's sha256 hex digest, or None if it isn't available (no archive on disk and no pinned digest).
+        """
+        archive_path = Path(self.archive_path)
+        if not archive_path.is_file():
+            if self.download is not None and self.download.sha256 is not None:
+                return self.download.sha256
+            return None
+        st = archive_path.stat()
+        if stamp is not None and stamp.get("archive_size") == st.st_size and stamp.get("archive_mtime_ns") == st.st_mtime_ns:
+            return stamp["sha256"]
+        # The state store caches digests by size and mtime, so an archive that a DownloadJob already hashed isn't read again.
+        if self.state_store is not None:
+            return self.state_store.hash_file(archive_path)
+        return hash_file(archive_path)
+
+    def get_tree_key(self, sha256: str) -> str:
+        if self.tree_store is None or sha256 is None:
+            return None
+        return self.tree_store.get_key(sha256, self.include, self.exclude)
+
+    def check_extraction(self) -> tuple[dict, set[str]]:
+        """Compare the extracted tree with its stamp and the archive.
+
+        Returns:
+            tuple[dict, set[str]]: The stamp (None if the tree has to be extracted from scratch) and the names of the members
+            that are missing or damaged.
+        """
+        stamp = self.load_stamp()
+        if stamp is None or not self.extract_dir.is_dir():
+            return None, set()
+        if stamp.get("include", []) != self.include or stamp.get("exclude", []) != self.exclude:
+            return None, set()
+
+        digest = self.get_archive_digest(stamp)
+        # Without an archive to compare against, the tree is trusted to match the stamp.
+        if digest is not None and digest != stamp["sha256"]:
+            return None, set()
+
+        return stamp, find_damaged_members(self.extract_dir, stamp["members"])
+
     def needs_to_run(self, c: Context) -> bool:
-        retVal = self.force or not self.extract_dir.exists()
-        if not retVal:
-            print_job_header(f"Archive Extraction Job: {self.extract_dir} already exists.")
-        return retVal
-    
+        if self.force:
+            return True
+
+        stamp, damaged = self.check_extraction()
+        if stamp is None:
+            return True
+        if len(damaged) > 0:
+            print_job_header(f"Archive Extraction Job: {len(damaged)} file(s) in {self.extract_dir} are missing or damaged.")
+            return True
+
+        print_job_header(f"Archive Extraction Job: {self.extract_dir} already extracted.")
+        return False
+
     def run(self, c: Context):
-        print_job_header(f"Archive Extraction Job: {self.archive_path} to {self.extract_dir}")
-        if not self.extract_dir.parent.exists():
-            os.makedirs(self.extract_dir.parent)
-            
-        shutil.unpack_archive(self.archive_path, self.extract_dir)
\ No newline at end of file
+        if c.config['run']['dry']:
+            print_job_header(f"Archive Extraction Job: {self.archive_path} to {self.extract_dir}")
+            if self.download is not None and self.download.needs_to_run(c):
+                self.download.fetch(c)
+            return
+
+        with self.get_lock():
+            # Another process may have finished the extraction while this one waited for the lock.
+            stamp, damaged = (None, set()) if self.force else self.check_extraction()
+            if stamp is not None and len(damaged) == 0:
+                print_job_header(f"Archive Extraction Job: {self.extract_dir} was extracted by another process.")
+                return
+
+            # A symlinked tree is the store entry itself, which is replaced rather than repaired.
+            if stamp is not None and not self.extract_dir.is_symlink():
+                key = self.get_tree_key(stamp["sha256"])
+                if key is not None and self.tree_store.materialize(key, self.extract_dir, self.materialize_mode, damaged) is not None:
+                    print_job_header(f"Archive Extraction Job: Repaired {len(damaged)} file(s) in {self.extract_dir} from '{self.tree_store.root_dir}'")
+                    return
+                if Path(self.archive_path).is_file():
+                    print_job_header(f"Archive Extraction Job: Repairing {len(damaged)} file(s) in {self.extract_dir} from {self.archive_path}")
+                    extract_archive(self.archive_path, self.extract_dir, self.threads, damaged, self.include, self.exclude, self.get_jobserver(c))
+                    return
+
+            self.get_stamp_path().unlink(missing_ok=True)
+            temp_dir = self.get_temp_extract_dir()
+            remove_tree(temp_dir)
+
+            sha256 = self.get_archive_digest()
+            key = self.get_tree_key(sha256)
+            manifest = None
+            if key is not None:
+                manifest = self.tree_store.materialize(key, temp_dir, self.materialize_mode)
+                if manifest is not None:
+                    print_job_header(f"Archive Extraction Job: {self.extract_dir} materialized from '{self.tree_store.root_dir}'")
+                else:
+                    remove_tree(temp_dir)
+
+            if manifest is None:
+                if self.download is not None and self.download.needs_to_run(c):
+                    sha256, manifest = self.extract_streaming(c)
+                else:
+                    print_job_header(f"Archive Extraction Job: {self.archive_path} to {self.extract_dir}")
+                    sha256, manifest = self.extract_to_temp(self.get_jobserver(c))
+
+                key = self.get_tree_key(sha256)
+                if key is not None and self.tree_store.add(temp_dir, key, manifest):
+                    self.tree_store.materialize(key, temp_dir, self.materialize_mode)
+
+            remove_tree(self.extract_dir)
+            os.replace(temp_dir, self.extract_dir)
+            # The stamp is written last, so that it only ever describes a complete extraction.
+            self.save_stamp(sha256, manifest)
+
+    @staticmethod
+    def get_jobserver(c: Context) -> Jobserver:
+        resources = get_job_resources(c)
+        return None if resources is None else resources.jobserver
+
+    def extract_to_temp(self, jobserver: Jobserver = None) -> tuple[str, dict[str, int]]:
+        temp_dir = self.get_temp_extract_dir()
+        remove_tree(temp_dir)
+        manifest = extract_archive(self.archive_path, temp_dir, self.threads, include=self.include, exclude=self.exclude, jobserver=jobserver)
+        return self.get_archive_digest(), manifest
+
+    def extract_streaming(self, c: Context) -> tuple[str, dict[str, int]]:
+        """Download the archive and extract it to the temporary directory at the same time, falling back to extracting it
+        afterwards if it can't be streamed.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+
+        Returns:
+            tuple[str, dict[str, int]]: The archive's sha256 and the extracted files, as a map of names to sizes.
+        """
+        if not is_streamable(self.archive_path):
+            self.download.fetch(c)
+            print_fl(f"Extracting '{self.archive_path}'...")
+            return self.extract_to_temp(self.get_jobserver(c))
+
+        temp_dir = self.get_temp_extract_dir()
+        remove_tree(temp_dir)
+        os.makedirs(temp_dir)
+        extractor = StreamingExtractor(temp_dir, self.include, self.exclude)
+        try:
+            streamed = self.download.fetch(c, on_chunk=extractor.feed, save=self.keep_archive)
+        except BaseException:
+            extractor.abort()
+            raise
+
+        if streamed:
+            return extractor.finish(), extractor.manifest
+
+        # The archive came from a cache or mirror, or the download was retried from another URL.
+        extractor.abort()
+        print_fl(f"Extracting '{self.archive_path}'...")
+        return self.extract_to_temp(self.get_jobserver(c))
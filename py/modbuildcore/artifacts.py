@@ -0,0 +1,224 @@
+import os, json, shutil, zipfile, threading, urllib.request, urllib.error
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from .utils import print_warning
+
+class ArtifactBackend(ABC):
+    """Base class for places that artifact archives can be stored. Archives are opaque files, identified by a key.
+    
+    Subclasses implement `fetch` and `store`.
+    """
+
+    @abstractmethod
+    def fetch(self, key: str, dest: Path) -> bool:
+        """Copy the archive for a key to `dest`.
+
+        Args:
+            key (str): The artifact key.
+            dest (Path): Where to write the archive.
+
+        Returns:
+            bool: True if the archive was found and copied. False if otherwise.
+        """
+
+    @abstractmethod
+    def store(self, key: str, src: Path):
+        """Store an archive under a key.
+
+        Args:
+            key (str): The artifact key.
+            src (Path): The archive to store.
+        """
+
+    def get_name(self) -> str:
+        return type(self).__name__
+
+
+class LocalArtifactBackend(ArtifactBackend):
+    """Stores artifact archives in a local directory, sharded by the first two characters of the key."""
+    root_dir: Path
+
+    def __init__(self, root_dir: Path):
+        """Initializes the LocalArtifactBackend.
+
+        Args:
+            root_dir (Path): The directory to store archives in. Created when first written to.
+        """
+        self.root_dir = root_dir
+
+    def get_archive_path(self, key: str) -> Path:
+        return self.root_dir.joinpath(key[:2], f"{key}.zip")
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        archive_path = self.get_archive_path(key)
+        if not archive_path.is_file():
+            return False
+        shutil.copyfile(archive_path, dest)
+        return True
+
+    def store(self, key: str, src: Path):
+        archive_path = self.get_archive_path(key)
+        os.makedirs(archive_path.parent, exist_ok=True)
+        temp_path = archive_path.with_name(f"{archive_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, archive_path)
+
+    def get_name(self) -> str:
+        return f"local cache '{self.root_dir}'"
+
+
+class HttpArtifactBackend(ArtifactBackend):
+    """Stores artifact archives on an HTTP server, as `<base_url>/<key>.zip`. Archives are fetched with GET and uploaded with PUT.
+
+    Any server that supports those two methods will work, such as a WebDAV share, or an nginx/S3 style artifact store.
+    Network errors are reported as warnings and treated as cache misses, so an unreachable server never fails the build.
+    """
+    base_url: str
+    headers: dict[str, str]
+    timeout: float
+    read_only: bool
+
+    def __init__(self, base_url: str, *, headers: dict[str, str] = None, timeout: float = 30.0, read_only: bool = False):
+        """Initializes the HttpArtifactBackend.
+
+        Args:
+            base_url (str): The URL that archive names are appended to.
+            headers (dict[str, str], optional): Extra headers to send with every request, such as authorization. Defaults to None.
+            timeout (float, optional): Timeout for each request, in seconds. Defaults to 30.0.
+            read_only (bool, optional): If True, never upload archives. Defaults to False.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.read_only = read_only
+
+    def get_archive_url(self, key: str) -> str:
+        return f"{self.base_url}/{key}.zip"
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        request = urllib.request.Request(self.get_archive_url(key), headers=self.headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response, open(dest, "wb") as f:
+                shutil.copyfileobj(response, f)
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                print_warning(f"WARNING! Fetching '{request.full_url}' failed with HTTP {e.code}.")
+        except (urllib.error.URLError, OSError) as e:
+            print_warning(f"WARNING! Fetching '{request.full_url}' failed: {e}")
+        return False
+
+    def store(self, key: str, src: Path):
+        if self.read_only:
+            return
+        request = urllib.request.Request(
+            self.get_archive_url(key),
+            data=src.read_bytes(),
+            headers={"Content-Type": "application/zip", **self.headers},
+            method="PUT",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except (urllib.error.URLError, OSError) as e:
+            print_warning(f"WARNING! Uploading '{request.full_url}' failed: {e}")
+
+    def get_name(self) -> str:
+        return f"remote cache '{self.base_url}'"
+
+
+class ArtifactCache:
+    """A content-addressed cache of job outputs.
+
+    Jobs that support caching (see `JobBase.cacheable`) look up a key computed from their input fingerprint before running.
+    If an archive for that key exists, the job's output files are restored from it instead of running the job. Otherwise,
+    the job runs and its outputs are archived under that key.
+
+    Backends are checked in order. When an archive is found in a later backend, it's copied into the earlier ones,
+    so a local backend should usually come first.
+
+    To enable the cache for a project, assign an instance to `JobBase.artifact_cache` in `project.py`.
+    """
+    backends: list[ArtifactBackend]
+    temp_dir: Path
+
+    def __init__(self, backends: list[ArtifactBackend], temp_dir: Path):
+        """Initializes the ArtifactCache.
+
+        Args:
+            backends (list[ArtifactBackend]): Where to look for and store archives, in order of preference.
+            temp_dir (Path): A directory for archives in transit.
+        """
+        self.backends = backends
+        self.temp_dir = temp_dir
+
+    def _get_temp_path(self, key: str) -> Path:
+        os.makedirs(self.temp_dir, exist_ok=True)
+        return self.temp_dir.joinpath(f"{key}.{os.getpid()}.{threading.get_ident()}.zip")
+
+    def restore(self, key: str, paths: list[Path]) -> bool:
+        """Restore output files from the archive for a key.
+
+        Args:
+            key (str): The artifact key.
+            paths (list[Path]): Where to write the output files. Must be in the same order as when the archive was saved.
+
+        Returns:
+            bool: True if the outputs were restored. False if no backend has the archive.
+        """
+        temp_path = self._get_temp_path(key)
+        try:
+            for index, backend in enumerate(self.backends):
+                if not backend.fetch(key, temp_path):
+                    continue
+
+                if not self._extract(temp_path, paths):
+                    print_warning(f"WARNING! Cached artifact '{key}' from {backend.get_name()} is invalid. Ignoring it.")
+                    continue
+
+                for earlier in self.backends[:index]:
+                    earlier.store(key, temp_path)
+                return True
+            return False
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def save(self, key: str, paths: list[Path]) -> bool:
+        """Archive output files under a key, in every backend.
+
+        Args:
+            key (str): The artifact key.
+            paths (list[Path]): The output files to archive. If any of them is missing, nothing is saved.
+
+        Returns:
+            bool: True if the outputs were saved. False if otherwise.
+        """
+        if not all(Path(i).is_file() for i in paths):
+            return False
+
+        temp_path = self._get_temp_path(key)
+        try:
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("manifest.json", json.dumps([str(i) for i in paths]))
+                for index, path in enumerate(paths):
+                    archive.write(path, str(index))
+            for backend in self.backends:
+                backend.store(key, temp_path)
+            return True
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _extract(self, archive_path: Path, paths: list[Path]) -> bool:
+        try:
+            with zipfile.ZipFile(archive_path, "r") as archive:
+                if len(json.loads(archive.read("manifest.json"))) != len(paths):
+                    return False
+                for index, path in enumerate(paths):
+                    path = Path(path)
+                    os.makedirs(path.parent, exist_ok=True)
+                    with archive.open(str(index)) as src, open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+            return True
+        except (zipfile.BadZipFile, KeyError, ValueError):
+            return False
@@ -0,0 +1,126 @@
+import os, re, sys, stat, shutil, threading
+from pathlib import Path
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Files shared with a cache are kept read-only. Windows won't delete a read-only file until its read-only attribute is
+# cleared, which would also clear it for the cache's copy (it belongs to the file, not the link), so files are copied
+# rather than hardlinked into and out of caches there.
+CAN_SHARE_HARDLINKS = sys.platform != "win32"
+
+def get_default_cache_dir() -> Path:
+    """Get the user-level directory that modbuild caches are stored in, shared by every project on this machine.
+
+    Uses `MODBUILD_CACHE_DIR` if it's set. Otherwise, `%LOCALAPPDATA%/modbuild` on Windows, `~/Library/Caches/modbuild`
+    on macOS, and `$XDG_CACHE_HOME/modbuild` (or `~/.cache/modbuild`) everywhere else.
+
+    Returns:
+        Path: The cache directory. It may not exist yet.
+    """
+    if os.environ.get("MODBUILD_CACHE_DIR"):
+        return Path(os.environ["MODBUILD_CACHE_DIR"])
+    if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]).joinpath("modbuild")
+    if sys.platform == "darwin":
+        return Path.home().joinpath("Library/Caches/modbuild")
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")).joinpath("modbuild")
+
+
+def try_hardlink(src: Path, dest: Path) -> bool:
+    """Hardlink `src` to `dest`, unless hardlinks can't be shared on this platform (see `CAN_SHARE_HARDLINKS`).
+
+    Returns:
+        bool: True if `dest` was created. False if `dest` doesn't exist, and should be copied instead.
+    """
+    if not CAN_SHARE_HARDLINKS:
+        return False
+    try:
+        os.link(src, dest)
+        return True
+    except OSError:
+        # Different filesystem, or one without hardlinks.
+        return False
+
+def link_or_copy(src: Path, dest: Path):
+    """Place a file at `dest`, replacing anything already there, by hardlinking `src` if possible (see `CAN_SHARE_HARDLINKS`)
+    and copying it otherwise.
+
+    Args:
+        src (Path): The file to place.
+        dest (Path): Where to place it. Its parent directory is created if needed.
+    """
+    dest = Path(dest)
+    os.makedirs(dest.parent, exist_ok=True)
+    temp_path = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if not try_hardlink(src, temp_path):
+        shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dest)
+
+
+class BlobCache:
+    """A content-addressed store of files, named by their sha256 digest.
+
+    Downloads pinned to a checksum are stored here once, and every later download of the same file (from any project,
+    worktree or example, and after a distclean) is materialized from the cache instead of the network. Files are hardlinked
+    out of the cache when possible, and copied otherwise (always, on Windows). Cached files are made read-only, so that a
+    hardlinked copy can't be modified in place without it being noticed.
+    """
+    root_dir: Path
+
+    def __init__(self, root_dir: Path):
+        """Initializes the BlobCache.
+
+        Args:
+            root_dir (Path): The directory to store blobs in. Created when first written to.
+        """
+        self.root_dir = Path(root_dir)
+
+    @classmethod
+    def get_default(cls) -> "BlobCache":
+        return cls(get_default_cache_dir().joinpath("blobs"))
+
+    def get_path(self, sha256: str) -> Path:
+        sha256 = sha256.lower()
+        if not SHA256_PATTERN.match(sha256):
+            raise ValueError(f"'{sha256}' isn't a sha256 hex digest.")
+        return self.root_dir.joinpath(sha256)
+
+    def contains(self, sha256: str) -> bool:
+        return self.get_path(sha256).is_file()
+
+    def _get_temp_path(self, path: Path) -> Path:
+        return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def add(self, src: Path, sha256: str):
+        """Store a file in the cache. The file must already have been verified to match `sha256`.
+
+        Args:
+            src (Path): The file to store. It's hardlinked into the cache if possible (except on Windows), in which case it also becomes read-only.
+            sha256 (str): The sha256 hex digest of the file.
+        """
+        blob_path = self.get_path(sha256)
+        if blob_path.is_file():
+            return
+
+        os.makedirs(self.root_dir, exist_ok=True)
+        temp_path = self._get_temp_path(blob_path)
+        if not try_hardlink(src, temp_path):
+            shutil.copyfile(src, temp_path)
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, blob_path)
+
+    def materialize(self, sha256: str, dest: Path) -> bool:
+        """Place a cached file at `dest`, replacing anything already there.
+
+        Args:
+            sha256 (str): The sha256 hex digest of the file.
+            dest (Path): Where to place the file.
+
+        Returns:
+            bool: True if the file was in the cache. False if otherwise.
+        """
+        blob_path = self.get_path(sha256)
+        if not blob_path.is_file():
+            return False
+
+        link_or_copy(blob_path, dest)
+        return True
@@ -25,6 +25,9 @@ class BuildOutputJob(JobBase):
         self.include_unresolved_jobs = False
         self.include_all_resolved_jobs = False
         
+    def get_name(self) -> str:
+        return f"Build Output: {self.output_path.name}"
+        
     def run(self, c: Context):
         print_job_header(f"Build Output Job: {self.output_path}")
         
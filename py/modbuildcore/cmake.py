@@ -1,9 +1,11 @@
-import shutil, os
+import shutil, os, json
 from pathlib import Path
 
 from invoke import Context
 from .job_base import JobBase
-from .utils import invoke_subprocess_run, print_job_header
+from .jobserver import get_subprocess_jobserver_args
+from .state import hash_string
+from .utils import LazyValue, invoke_subprocess_run, print_job_header, resolve_lazy
 
 # Class declaration before definition:
 class CMakeProjectConfig:
@@ -11,15 +13,22 @@ class CMakeProjectConfig:
     """
     cmake_binary_path: Path
     project_working_dir: Path
-    extended_env: dict[str, str]
+    extended_env: dict[str, str | LazyValue]
+    input_paths: list[Path]
+    tool_names: list[str]
     
-    def __init__(self, project_working_dir: Path, expanded_env: dict[str, str], *, cmake_binary_path: Path = None):
+    def __init__(self, project_working_dir: Path, expanded_env: dict[str, str | LazyValue], *, cmake_binary_path: Path = None, input_paths: list[Path] = None,
+            tool_names: list[str] = None):
         """Initializes the CMakeProjectConfig.
 
         Args:
             project_working_dir (Path): The working directory for this CMake project.
-            expanded_env (dict[str, str]): Additional/overiding environmental variables to use when invoking CMake.
+            expanded_env (dict[str, str | LazyValue]): Additional/overiding environmental variables to use when invoking CMake. Values may be LazyValues.
             cmake_binary_path (Path, optional): The location of the CMake binary. If None, defaults the `cmake` command on your system path. Defaults to None.
+            input_paths (list[Path], optional): Source files/directories and CMake scripts shared by every build of this project. Used for up-to-date checks. Defaults to None.
+            tool_names (list[str], optional): Programs the build finds on the PATH, such as compilers. For up-to-date checks and
+                cache keys, they're looked up on the PATH the build gets and their binaries are fingerprinted, instead of the PATH
+                itself, which differs between machines and shells. Defaults to None.
         """
         if cmake_binary_path is None:
             self.cmake_binary_path = shutil.which("cmake")
@@ -27,6 +36,11 @@ class CMakeProjectConfig:
             self.cmake_binary_path = cmake_binary_path
         self.project_working_dir = project_working_dir
         self.extended_env = expanded_env
+        self.input_paths = input_paths or []
+        self.tool_names = tool_names or []
+    
+    def get_env(self) -> dict[str, str]:
+        return {key: str(value) for key, value in resolve_lazy(self.extended_env).items()}
 
 
 class CMakeBuildJob:
@@ -34,16 +48,24 @@ class CMakeBuildJob:
     
 class CMakeBuildJob(JobBase):
     """This job configures and builds a CMake project. The mod_output_files must be manually specified on initialization.
+    
+    If `JobBase.state_store` is set, the job is skipped when the project's input paths, environmental variables, tools, CMake binary,
+    arguments, and mod_output_files are all unchanged since it last ran. If `JobBase.artifact_cache` is also set, the
+    mod_output_files are restored from the cache when a build with identical inputs has been cached before.
+    
+    When jobs run concurrently (`modbuild.py -j N`), the build step joins modbuild's jobserver through MAKEFLAGS, referring
+    to it by path. Ninja 1.13+ and GNU Make 4.4+ generators support this. Older ones build with their usual parallelism.
     """
+    cacheable = True
     config_args: list[str]
     build_args: list[str]
     
-    def __init__(self, cmake_project: CMakeProjectConfig, mod_output_files: dict[Path, Path], config_args: list[str], build_args: list[str]):
+    def __init__(self, cmake_project: CMakeProjectConfig, mod_output_files: dict[Path, Path] | LazyValue, config_args: list[str], build_args: list[str]):
         """Initializes the CMakeBuildJob.
 
         Args:
             cmake_project (CMakeProjectConfig): Common project information object for this build.
-            mod_output_files (dict[Path, Path]): The mod_output_files to this job produces. The key will be the desired file location in the output, the value will be the path in the project.
+            mod_output_files (dict[Path, Path] | LazyValue): The mod_output_files to this job produces. The key will be the desired file location in the output, the value will be the path in the project.
             config_args (list[str]): Arguments to pass to CMake when configuring.
             build_args (list[str]): Arguments to pass to CMake when building.
         """
@@ -52,15 +74,16 @@ class CMakeBuildJob(JobBase):
         self.mod_output_files = mod_output_files
         self.config_args = config_args
         self.build_args = build_args
+        self.add_input_paths(cmake_project.input_paths)
         
         
     @classmethod
-    def from_preset_pair(cls, cmake_project: CMakeProjectConfig, output_files: dict[Path, Path], config_preset_name: str, build_preset_name: str = None) -> CMakeBuildJob:
+    def from_preset_pair(cls, cmake_project: CMakeProjectConfig, output_files: dict[Path, Path] | LazyValue, config_preset_name: str, build_preset_name: str = None) -> CMakeBuildJob:
         """An alternate constructor for a CMakeBuildJob that uses CMakePresets.json for configuring and building.
 
         Args:
             cmake_project (CMakeProjectConfig): Common project information object for this build.
-            output_files (dict[Path, Path]): The mod_output_files to this job produces. The key will be the desired file location in the output, the value will be the path in the project.
+            output_files (dict[Path, Path] | LazyValue): The mod_output_files to this job produces. The key will be the desired file location in the output, the value will be the path in the project.
             config_preset_name (str): The name of the CMake configure preset.
             build_preset_name (str, optional): The name of the CMake configure preset. If None, uses the same preset name as `config_preset_name`. Defaults to None.
 
@@ -77,28 +100,57 @@ class CMakeBuildJob(JobBase):
             ["--build", "--preset", build_preset_name]
         )
         
-    def run_configure(self, c: Context):
+    def get_name(self) -> str:
+        return f"CMake Build: {' '.join(str(i) for i in self.build_args)}"
+    
+    def get_state_key(self) -> str:
+        identity = json.dumps([str(self.cmake_project.project_working_dir)] + [str(i) for i in self.config_args + self.build_args])
+        return f"cmake_{hash_string(identity)[:16]}"
+    
+    def get_input_fingerprint(self) -> dict[str, str]:
+        retVal = super().get_input_fingerprint()
+        retVal["cmake_binary"] = self.state_store.fingerprint_path(self.cmake_project.cmake_binary_path)
+        for key, value in self.cmake_project.get_env().items():
+            if key.upper() == "PATH":
+                for name in self.cmake_project.tool_names:
+                    retVal[f"tool:{name}"] = self.state_store.fingerprint_path(shutil.which(name, path=str(value)))
+            else:
+                retVal[f"env:{key}"] = hash_string(str(value))
+        return retVal
+    
+    # Override:
+    def needs_to_run(self, c: Context) -> bool:
+        if self.is_up_to_date():
+            print_job_header(f"CMake Build Job: {self.build_args} is up to date.")
+            return False
+        return True
+        
+    def run_configure(self, c: Context) -> bool:
         print_job_header(f"CMake Configure: {self.config_args}:")
         cmake_env = os.environ.copy()
-        cmake_env.update(self.cmake_project.extended_env)
+        cmake_env.update(self.cmake_project.get_env())
         
-        invoke_subprocess_run(c, True,
+        result = invoke_subprocess_run(c, True,
             [self.cmake_project.cmake_binary_path] + self.config_args,
             env=cmake_env,
             cwd=self.cmake_project.project_working_dir
         )
+        return result is None or result.returncode == 0
     
-    def run_build(self, c: Context):
+    def run_build(self, c: Context) -> bool:
         print_job_header(f"CMake Build: {self.build_args}:")
         cmake_env = os.environ.copy()
-        cmake_env.update(self.cmake_project.extended_env)
+        cmake_env.update(self.cmake_project.get_env())
         
-        invoke_subprocess_run(c, True,
+        result = invoke_subprocess_run(c, True,
             [self.cmake_project.cmake_binary_path] + self.build_args,
             env=cmake_env,
-            cwd=self.cmake_project.project_working_dir
+            cwd=self.cmake_project.project_working_dir,
+            **get_subprocess_jobserver_args(c, cmake_env, fifo=True)
         )
+        return result is None or result.returncode == 0
 
-    def run(self, c: Context):
-        self.run_configure(c)
-        self.run_build(c)
+    def run(self, c: Context) -> bool:
+        configured = self.run_configure(c)
+        built = self.run_build(c)
+        return configured and built
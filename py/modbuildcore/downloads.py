@@ -1,31 +1,92 @@
-import pathlib, os, shutil, urllib.request, urllib.parse
+import pathlib, os, sys, math, shutil, urllib.request, urllib.parse
 from pathlib import Path
+from typing import Callable
 
 from invoke import Context
 from .job_base import JobBase
-from .utils import print_job_header
+from .blobs import BlobCache, link_or_copy
+from .fetch import Downloader, DownloadError, hash_file, probe_latency, rank_by_latency
+from .jobserver import RESOURCE_NETWORK
+from .utils import LazyValue, resolve_lazy, print_job_header, print_error, print_warning, print_fl
+
+def is_offline(c: Context) -> bool:
+    """Reads whether the network may be used from the invoke config (set by `modbuild.py --offline`).
+
+    Args:
+        c (Context): The pyinvoke Context from the current task invokation.
+
+    Returns:
+        bool: True if downloads must only be taken from local sources.
+    """
+    try:
+        return bool(c.config.modbuild.offline)
+    except (AttributeError, KeyError):
+        return False
+
+def _split_env_list(name: str) -> list[str]:
+    return [i for i in os.environ.get(name, "").split(os.pathsep if name.endswith("_DIR") else None) if len(i) > 0]
+
 
 class DownloadJob(JobBase):
     """This job downloads a file from the internet to a location. Does not need to run if the downloaded file already exists.
     
     The downloaded file is not counted as mod_output_file by default.
+    
+    The file is downloaded to `<download_path>.part` and only renamed into place once it's complete. If a download is
+    interrupted, the next run resumes it from where it stopped, as long as the server supports range requests.
+    
+    If the job is pinned to a `sha256`, the download is verified as it streams in, and an existing file that doesn't
+    match is downloaded again. Pinned downloads are also stored in `DownloadJob.blob_cache` (if set), and materialized
+    from there instead of the network whenever the same file is needed again.
+    
+    When `force` is set, the server is asked whether the file changed since it was downloaded (using the ETag and
+    Last-Modified saved next to the file), and the body is only downloaded again if it did.
+    
+    Before using the network, the file is looked for in the local mirror directories: the job's own `mirror_dir`, then
+    `DownloadJob.mirror_dirs`, each checked for a file with the same name or named by its sha256. Otherwise, it's
+    downloaded from whichever of `DownloadJob.mirror_urls`, the job's `url` and its `mirrors` answers fastest, falling
+    back to the others if that fails. Unless they're set, `mirror_dirs` and `mirror_urls` are read from the
+    `MODBUILD_MIRROR_DIR` (a path list) and `MODBUILD_MIRRORS` (space separated base URLs, which the filename is appended
+    to) environment variables when the job runs, so that a machine's local mirror is used without editing project.py.
+    With `modbuild.py --offline`, only the blob cache and mirror directories are used.
     """
+    # Shared by all DownloadJobs, so that connections to the same host are reused. Created on first use, since setting up
+    # its TLS context is too slow to do on every invokation.
+    downloader: Downloader | LazyValue = LazyValue(Downloader)
+    blob_cache: BlobCache = None
+    mirror_dirs: list[Path] = None
+    mirror_urls: list[str] = None
+    
+    resource_class = RESOURCE_NETWORK
     url: str
     download_path: Path
     force: bool
+    connections: int
+    sha256: str
+    mirrors: list[str]
+    mirror_dir: Path
     
-    def __init__(self, url: str, download_path: Path, *, append_url_filename: bool=True):
+    def __init__(self, url: str, download_path: Path, *, append_url_filename: bool=True, connections: int = 1, sha256: str = None,
+            mirrors: list[str] = None, mirror_dir: Path = None):
         """Initializes the DownloadJob.
 
         Args:
             url (str): The URL to download from.
             download_path (Path): The destination for the download.
             append_url_filename (bool, optional): If true, `download_path` is treated as a directory, and the filename from the URL is appended. Defaults to True.
+            connections (int, optional): The number of concurrent connections to download large files with, if the server supports range requests. Defaults to 1.
+            sha256 (str, optional): The expected sha256 hex digest of the file. Defaults to None.
+            mirrors (list[str], optional): Other URLs the same file can be downloaded from, in order of preference. Defaults to None.
+            mirror_dir (Path, optional): A local directory to look for the file in before downloading it. Defaults to None.
         """
         super().__init__()
         self.url = url
         self.download_path = download_path
         self.force = False
+        self.connections = connections
+        self.sha256 = None if sha256 is None else sha256.lower()
+        self.mirrors = list(mirrors or [])
+        self.mirror_dir = None if mirror_dir is None else Path(mirror_dir)
         
         if (append_url_filename):
             self.download_path = self.download_path.joinpath(self.get_filename_from_url())
@@ -35,20 +96,136 @@ class DownloadJob(JobBase):
         parsed_url = urllib.parse.urlparse(self.url)
         return Path(os.path.basename(parsed_url.path))
     
+    def get_candidate_urls(self) -> list[str]:
+        """Get every URL the file can be downloaded from, in order of preference, without duplicates."""
+        filename = self.get_filename_from_url().name
+        mirror_urls = _split_env_list("MODBUILD_MIRRORS") if self.mirror_urls is None else self.mirror_urls
+        retVal = [f"{i.rstrip('/')}/{filename}" for i in mirror_urls]
+        retVal += [self.url] + self.mirrors
+        return list(dict.fromkeys(retVal))
+    
+    def get_local_mirror_paths(self) -> list[Path]:
+        mirror_dirs = _split_env_list("MODBUILD_MIRROR_DIR") if self.mirror_dirs is None else self.mirror_dirs
+        mirror_dirs = ([] if self.mirror_dir is None else [self.mirror_dir]) + list(mirror_dirs)
+        names = [self.get_filename_from_url().name] + ([] if self.sha256 is None else [self.sha256])
+        return [Path(i).joinpath(name) for i in mirror_dirs for name in names]
+    
+    def copy_from_local_mirror(self) -> Path:
+        """Place the file at `download_path` from a local mirror directory, if one has it.
+
+        Returns:
+            Path: The file that was used, or None if no local mirror has the file.
+        """
+        for path in self.get_local_mirror_paths():
+            if not path.is_file():
+                continue
+            if self.sha256 is not None and hash_file(path) != self.sha256:
+                print_warning(f"WARNING! Ignoring '{path}', because it doesn't match the pinned sha256.")
+                continue
+            link_or_copy(path, self.download_path)
+            return path
+        return None
+    
+    def get_downloader(self) -> Downloader:
+        return resolve_lazy(self.downloader)
+    
+    def get_file_digest(self) -> str:
+        # The state store caches digests by size and mtime, so this only reads the file the first time.
+        if self.state_store is not None:
+            return self.state_store.hash_file(self.download_path)
+        return hash_file(self.download_path)
+    
     # Override:
+    def get_name(self) -> str:
+        return f"Download: {self.download_path.name}"
+    
     def needs_to_run(self, c: Context):
         retVal = self.force or not self.download_path.exists()
+        if not retVal and self.sha256 is not None and self.get_file_digest() != self.sha256:
+            print_warning(f"WARNING! {self.download_path} doesn't match its pinned sha256. Downloading it again.")
+            retVal = True
         if not retVal:
             print_job_header(f"Download Job: {self.download_path} already downloaded.")
         return retVal
         
     
     def run(self, c):
+        self.fetch(c)
+    
+    def fetch(self, c: Context, on_chunk: Callable[[bytes], None] = None, save: bool = True) -> bool:
+        """Does the work of `run`, optionally handing the file's contents to a consumer as they're downloaded.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+            on_chunk (Callable[[bytes], None], optional): Called with the file's contents, in order, while they're
+                downloaded from the network. Only the first URL tried is streamed. Defaults to None.
+            save (bool, optional): If False, a streamed download is only passed to `on_chunk`, and never written to
+                `download_path`. Defaults to True.
+
+        Returns:
+            bool: True if the whole file was passed to `on_chunk`. If False, it wasn't (or only partly was, before a
+            failed attempt), and the complete file is at `download_path` instead.
+        """
         print_job_header(f"Download Job: {self.url} to {self.download_path}")
         if not self.download_path.parent.exists():
             os.makedirs(self.download_path.parent)
-            
-        urllib.request.urlretrieve(
-            self.url,
-            self.download_path
-        )
\ No newline at end of file
+        
+        if c.config['run']['dry']:
+            return False
+        
+        # A pinned file's contents are fully determined by its hash, so the cached copy is used even when forced.
+        if self.sha256 is not None and self.blob_cache is not None and self.blob_cache.materialize(self.sha256, self.download_path):
+            print_fl(f"Using cached copy from '{self.blob_cache.root_dir}'.")
+            return False
+        
+        # An unpinned file could be out of date in a mirror directory, so a forced download of one goes to the network.
+        if self.sha256 is not None or not self.force or is_offline(c):
+            mirror_path = self.copy_from_local_mirror()
+            if mirror_path is not None:
+                print_fl(f"Using local mirror copy '{mirror_path}'.")
+                if self.sha256 is not None and self.blob_cache is not None:
+                    self.blob_cache.add(self.download_path, self.sha256)
+                return False
+        
+        if is_offline(c):
+            if self.force and self.download_path.exists():
+                print_fl("Offline. Keeping the existing file.")
+                return False
+            print_error(f"FATAL! '{self.download_path.name}' isn't in the blob cache or a local mirror, and downloads are disabled by --offline.")
+            sys.exit(1)
+        
+        urls = self.get_candidate_urls()
+        if len(urls) > 1:
+            urls = rank_by_latency(urls)
+            # Stick with the URL that a partial download (or the validators for a forced one) came from, so they can be reused.
+            saved_url = self.get_downloader().get_saved_url(self.download_path)
+            if saved_url in urls and not math.isinf(probe_latency(saved_url)):
+                urls.remove(saved_url)
+                urls.insert(0, saved_url)
+        
+        for i, url in enumerate(urls):
+            # A consumer can't take the file again from the start, so later attempts are saved and read back instead.
+            streaming = on_chunk is not None and i == 0
+            try:
+                if streaming and not save:
+                    result = self.get_downloader().stream(url, on_chunk, sha256=self.sha256)
+                else:
+                    result = self.get_downloader().download(url, self.download_path, connections=self.connections,
+                        sha256=self.sha256, conditional=self.force, on_chunk=on_chunk if streaming else None)
+                break
+            except (DownloadError, OSError) as e:
+                if i == len(urls) - 1:
+                    print_error(f"FATAL! Download of '{url}' failed: {e}")
+                    sys.exit(1)
+                print_warning(f"WARNING! Download of '{url}' failed: {e}. Trying '{urls[i + 1]}'.")
+        
+        if result.status == 304:
+            print_fl("Not modified on the server. Keeping the existing file.")
+            return False
+        
+        if self.sha256 is None:
+            if result.sha256 is not None:
+                print_fl(f"sha256: {result.sha256} (pass this as `sha256` to pin the download and enable caching)")
+        elif self.blob_cache is not None and (save or not streaming):
+            self.blob_cache.add(self.download_path, self.sha256)
+        return streaming
@@ -0,0 +1,299 @@
+import os, shutil, fnmatch, tarfile, zipfile, threading, subprocess
+from pathlib import Path
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from .jobserver import Jobserver
+
+# Reads and writes during extraction are done in blocks of this size.
+COPY_BUFFER_SIZE = 1024 * 1024
+# Zip members are handed to the thread pool in batches of about this many bytes (or one member, if it's larger),
+# so that archives with thousands of small files don't pay for a task per file.
+ZIP_BATCH_SIZE = 16 * 1024 * 1024
+# External decompressors used for tarballs when they're on the PATH, by file extension. They run in their own process
+# (multithreaded, for xz), in parallel with untarring in this one.
+EXTERNAL_DECOMPRESSORS = {
+    ".tar.xz": ["xz", "-dc", "-T0"],
+    ".txz": ["xz", "-dc", "-T0"],
+}
+
+def get_member_name(name: str) -> str:
+    """Normalize the name of an archive member to the path it's extracted to, relative to the extraction folder."""
+    return "/".join(i for i in name.replace("\\", "/").split("/") if i not in ("", "."))
+
+def matches_globs(name: str, patterns: list[str]) -> bool:
+    """Check whether an archive member matches any of a list of glob patterns (see `fnmatch`, where `*` also matches `/`).
+
+    A pattern that matches a directory also matches everything in it, so `*/bin` selects a whole `bin` folder.
+
+    Args:
+        name (str): The member's name (see `get_member_name`).
+        patterns (list[str]): The glob patterns.
+
+    Returns:
+        bool: True if the member or one of its parent directories matches a pattern.
+    """
+    parts = name.split("/")
+    prefixes = ["/".join(parts[:i]) for i in range(len(parts), 0, -1)]
+    for pattern in patterns:
+        pattern = get_member_name(pattern)
+        if any(fnmatch.fnmatchcase(i, pattern) for i in prefixes):
+            return True
+    return False
+
+def get_member_selector(members: set[str] = None, include: list[str] = None, exclude: list[str] = None) -> Callable[[str], bool]:
+    """Combine the ways of choosing which archive members to extract into one check.
+
+    Args:
+        members (set[str], optional): Only extract members with these names. Defaults to None.
+        include (list[str], optional): Only extract members matching one of these glob patterns. Defaults to None.
+        exclude (list[str], optional): Don't extract members matching any of these glob patterns. Defaults to None.
+
+    Returns:
+        Callable[[str], bool]: A function that takes a member name and returns whether to extract it, or None if every
+        member is extracted.
+    """
+    if members is None and not include and not exclude:
+        return None
+
+    def select(name: str) -> bool:
+        if members is not None and name not in members:
+            return False
+        if include and not matches_globs(name, include):
+            return False
+        return not (exclude and matches_globs(name, exclude))
+    return select
+
+def _extract_tar_member(archive: tarfile.TarFile, member: tarfile.TarInfo, extract_dir: Path):
+    if hasattr(tarfile, "tar_filter"):
+        archive.extract(member, extract_dir, filter="tar")
+    else:
+        archive.extract(member, extract_dir)
+
+def extract_tar(archive: tarfile.TarFile, extract_dir: Path, members: set[str] = None, include: list[str] = None,
+        exclude: list[str] = None) -> dict[str, int]:
+    """Extract the members of an open tar archive, like shutil.unpack_archive does, but keeping members from
+    escaping `extract_dir` where Python supports it. Works on archives opened in stream mode.
+
+    Members that aren't selected are skipped over without being written.
+
+    Args:
+        archive (tarfile.TarFile): The archive.
+        extract_dir (Path): The folder to extract to.
+        members (set[str], optional): Only extract members with these names (see `get_member_name`). Defaults to None.
+        include (list[str], optional): Only extract members matching one of these glob patterns (see `matches_globs`). Defaults to None.
+        exclude (list[str], optional): Don't extract members matching any of these glob patterns. Defaults to None.
+
+    Returns:
+        dict[str, int]: The extracted files, as a map of names to sizes. The size is None for links and other special files.
+    """
+    select = get_member_selector(members, include, exclude)
+    extracted = []
+    if select is None:
+        if hasattr(tarfile, "tar_filter"):
+            archive.extractall(extract_dir, filter="tar")
+        else:
+            archive.extractall(extract_dir)
+        # The members were loaded by extractall, so this doesn't read the archive again.
+        extracted = archive.getmembers()
+    else:
+        for member in archive:
+            if select(get_member_name(member.name)):
+                _extract_tar_member(archive, member, extract_dir)
+                extracted.append(member)
+    return {get_member_name(i.name): (i.size if i.isreg() else None) for i in extracted if not i.isdir()}
+
+def get_external_decompressor(archive_path: Path) -> list[str]:
+    """Get the command that decompresses an archive to stdout with an external tool, if there is one on the PATH.
+
+    Args:
+        archive_path (Path): The archive. Only its file extension is looked at.
+
+    Returns:
+        list[str]: The command, without the archive path, or None if the archive should be decompressed in Python.
+    """
+    name = Path(archive_path).name.lower()
+    for suffix, command in EXTERNAL_DECOMPRESSORS.items():
+        if name.endswith(suffix):
+            tool = shutil.which(command[0])
+            return None if tool is None else [tool] + command[1:]
+    return None
+
+def extract_archive(archive_path: Path, extract_dir: Path, threads: int = 0, members: set[str] = None, include: list[str] = None,
+        exclude: list[str] = None, jobserver: Jobserver = None) -> dict[str, int]:
+    """Extract an archive to a folder. A faster drop-in for shutil.unpack_archive.
+
+    Zip members are decompressed on a thread pool (zlib releases the GIL while it works). Tarballs are decompressed by an
+    external tool if one is available (`xz -T0`), while this process untars them. Any other format is left to
+    shutil.unpack_archive.
+
+    Members that aren't selected by `members`, `include` and `exclude` are skipped. Zip members are skipped without being
+    read at all. Tar members still have to be decompressed (tarballs are a single compressed stream), but aren't written.
+
+    Args:
+        archive_path (Path): The archive to extract.
+        extract_dir (Path): The folder to extract to. Created if it doesn't exist.
+        threads (int, optional): How many members of a zip archive to extract at once. 0 means one per CPU. Defaults to 0.
+        members (set[str], optional): Only extract members with these names (see `get_member_name`). Defaults to None.
+        include (list[str], optional): Only extract members matching one of these glob patterns (see `matches_globs`). Defaults to None.
+        exclude (list[str], optional): Don't extract members matching any of these glob patterns. Defaults to None.
+        jobserver (Jobserver, optional): The jobserver of the calling job, which already holds one of its slots. If set,
+            zip members are extracted on up to `jobserver.jobs` threads instead of `threads`, and each thread beyond the
+            first takes a token while it works. Defaults to None.
+
+    Returns:
+        dict[str, int]: The extracted files, as a map of names to sizes. The size is None for links and other special files.
+    """
+    archive_path = Path(archive_path)
+    extract_dir = Path(extract_dir)
+    os.makedirs(extract_dir, exist_ok=True)
+
+    if zipfile.is_zipfile(archive_path):
+        select = get_member_selector(members, include, exclude)
+        return _extract_zip(archive_path, extract_dir, threads if threads > 0 else os.cpu_count() or 1, select, jobserver)
+
+    command = get_external_decompressor(archive_path)
+    if command is not None:
+        return _extract_tar_external(archive_path, extract_dir, command, members, include, exclude)
+
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, "r|*", bufsize=COPY_BUFFER_SIZE) as archive:
+            return extract_tar(archive, extract_dir, members, include, exclude)
+
+    if get_member_selector(members, include, exclude) is not None:
+        raise ValueError(f"Can't extract only some members of '{archive_path}'.")
+    shutil.unpack_archive(archive_path, extract_dir)
+    return get_tree_manifest(extract_dir)
+
+def get_tree_manifest(root_dir: Path) -> dict[str, int]:
+    """List the files under a folder, in the same format as `extract_archive` returns."""
+    retVal = {}
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        for name in file_names + [i for i in dir_names if os.path.islink(os.path.join(dir_path, i))]:
+            path = Path(dir_path, name)
+            retVal[path.relative_to(root_dir).as_posix()] = None if path.is_symlink() else path.stat().st_size
+    return retVal
+
+def find_damaged_members(extract_dir: Path, manifest: dict[str, int]) -> set[str]:
+    """Check an extracted tree against the manifest returned by `extract_archive`, using only file metadata.
+
+    Args:
+        extract_dir (Path): The folder the archive was extracted to.
+        manifest (dict[str, int]): The extracted files, as a map of names to sizes.
+
+    Returns:
+        set[str]: The names of the files that are missing, or are a different size than they were extracted as.
+    """
+    retVal = set()
+    for name, size in manifest.items():
+        try:
+            st = os.lstat(extract_dir.joinpath(name))
+        except OSError:
+            retVal.add(name)
+            continue
+        if size is not None and st.st_size != size:
+            retVal.add(name)
+    return retVal
+
+def _extract_tar_external(archive_path: Path, extract_dir: Path, command: list[str], members: set[str], include: list[str],
+        exclude: list[str]) -> dict[str, int]:
+    process = subprocess.Popen(command + [str(archive_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=COPY_BUFFER_SIZE)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|", bufsize=COPY_BUFFER_SIZE) as archive:
+            retVal = extract_tar(archive, extract_dir, members, include, exclude)
+        # Drain anything after the end of the tar archive, so that the decompressor can exit.
+        while process.stdout.read(COPY_BUFFER_SIZE):
+            pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="replace").strip()
+        process.stderr.close()
+        process.wait()
+
+    if process.returncode != 0:
+        raise tarfile.ReadError(f"'{command[0]}' failed to decompress '{archive_path}' (exit code {process.returncode}): {stderr}")
+    return retVal
+
+def _get_zip_member_path(extract_dir: Path, name: str) -> Path:
+    # The same names are skipped as by shutil.unpack_archive.
+    if name.startswith("/") or ".." in name:
+        return None
+    return extract_dir.joinpath(*[i for i in name.split("/") if len(i) > 0])
+
+def _batch_zip_members(members: list[zipfile.ZipInfo]) -> list[list[zipfile.ZipInfo]]:
+    retVal = []
+    batch = []
+    batch_size = 0
+    # Largest first, so that the biggest members aren't left to the end on a single thread.
+    for member in sorted(members, key=lambda i: i.file_size, reverse=True):
+        batch.append(member)
+        batch_size += member.file_size
+        if batch_size >= ZIP_BATCH_SIZE:
+            retVal.append(batch)
+            batch = []
+            batch_size = 0
+    if len(batch) > 0:
+        retVal.append(batch)
+    return retVal
+
+def _extract_zip(archive_path: Path, extract_dir: Path, threads: int, select: Callable[[str], bool], jobserver: Jobserver) -> dict[str, int]:
+    with zipfile.ZipFile(archive_path) as archive:
+        infos = archive.infolist()
+
+    files = []
+    for member in infos:
+        path = _get_zip_member_path(extract_dir, member.filename)
+        if path is None or (select is not None and not select(get_member_name(member.filename))):
+            continue
+        if member.is_dir():
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(path.parent, exist_ok=True)
+            files.append(member)
+
+    # Each thread reads through its own handle, so that members are decompressed concurrently.
+    local = threading.local()
+    handles: list[zipfile.ZipFile] = []
+    handles_lock = threading.Lock()
+    # Under a jobserver, the calling job already holds one slot, and each batch beyond the first takes another.
+    if jobserver is not None:
+        threads = jobserver.jobs
+    own_slot = threading.Lock()
+
+    def extract_batch(batch: list[zipfile.ZipInfo]):
+        token = None
+        extra_slot = jobserver is not None and not own_slot.acquire(blocking=False)
+        if extra_slot:
+            token = jobserver.acquire()
+        try:
+            extract_members(batch)
+        finally:
+            if extra_slot:
+                jobserver.release(token)
+            elif jobserver is not None:
+                own_slot.release()
+
+    def extract_members(batch: list[zipfile.ZipInfo]):
+        if not hasattr(local, "archive"):
+            local.archive = zipfile.ZipFile(archive_path)
+            with handles_lock:
+                handles.append(local.archive)
+        for member in batch:
+            path = _get_zip_member_path(extract_dir, member.filename)
+            with local.archive.open(member) as src, open(path, "wb", buffering=0) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            # Zips made on Unix keep file modes (such as the executable bit) in the upper bits of the external attributes.
+            mode = (member.external_attr >> 16) & 0o777
+            if mode != 0:
+                os.chmod(path, mode)
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="extract") as executor:
+            for _ in executor.map(extract_batch, _batch_zip_members(files)):
+                pass
+    finally:
+        for i in handles:
+            i.close()
+    return {get_member_name(i.filename): i.file_size for i in files}
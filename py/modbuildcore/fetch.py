@@ -0,0 +1,654 @@
+import os, json, ssl, math, time, shutil, hashlib, threading, http.client, urllib.parse, urllib.request
+from pathlib import Path
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from .state import HASH_CHUNK_SIZE
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_TIMEOUT = 30.0
+MAX_REDIRECTS = 10
+USER_AGENT = "modbuild"
+# Segmented downloads are only used for files at least this large. Below that, the extra requests cost more than they save.
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+# How much each segment downloads between saves of its progress to the `.part.json` file.
+SEGMENT_SAVE_INTERVAL = 8 * 1024 * 1024
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+def hash_file(path: Path) -> str:
+    """Returns the sha256 hex digest of a file's contents."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DownloadError(Exception):
+    """Raised when a download fails in a way that retrying immediately won't fix, such as an HTTP error status."""
+    pass
+
+class _RangeNotHonoredError(DownloadError):
+    """Raised by a segment of a download when the server answers its range request with the whole file instead."""
+    pass
+
+
+class DownloadResult:
+    """Information about a completed download."""
+    url: str
+    final_url: str
+    status: int
+    headers: dict[str, str]
+    size: int
+    sha256: str
+
+    def __init__(self, url: str, final_url: str, status: int, headers: dict[str, str], size: int, sha256: str = None):
+        self.url = url
+        self.final_url = final_url
+        self.status = status
+        self.headers = headers
+        self.size = size
+        self.sha256 = sha256
+
+
+class ConnectionPool:
+    """A thread-safe pool of keep-alive HTTP(S) connections, reused between requests to the same host.
+
+    Proxies from the environment (`http_proxy`, `https_proxy`, `no_proxy`) are respected, like they are by urllib.
+    """
+    timeout: float
+    max_idle_per_host: int
+    _idle: dict[tuple, list[http.client.HTTPConnection]]
+    _lock: threading.Lock
+    _ssl_context: ssl.SSLContext
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, max_idle_per_host: int = 8):
+        """Initializes the ConnectionPool.
+
+        Args:
+            timeout (float, optional): Socket timeout for connections, in seconds. Defaults to DEFAULT_TIMEOUT.
+            max_idle_per_host (int, optional): How many idle connections to keep for each host. Defaults to 8.
+        """
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    def _get_proxy(self, scheme: str, host: str) -> str:
+        proxy = urllib.request.getproxies().get(scheme)
+        if proxy is None or urllib.request.proxy_bypass(host):
+            return None
+        return proxy
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        parsed = urllib.parse.urlsplit(f"{scheme}://{netloc}")
+        proxy = self._get_proxy(scheme, parsed.hostname)
+        if proxy is not None:
+            proxy_parsed = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(proxy_parsed.hostname, proxy_parsed.port or 80, timeout=self.timeout, context=self._ssl_context)
+                conn.set_tunnel(parsed.hostname, parsed.port or 443)
+                return conn
+            return http.client.HTTPConnection(proxy_parsed.hostname, proxy_parsed.port or 80, timeout=self.timeout)
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(parsed.hostname, parsed.port or 443, timeout=self.timeout, context=self._ssl_context)
+        if scheme == "http":
+            return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+        raise DownloadError(f"Unsupported URL scheme '{scheme}'.")
+
+    def _acquire(self, scheme: str, netloc: str) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        return self._connect(scheme, netloc), False
+
+    def release(self, scheme: str, netloc: str, conn: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        """Return a connection to the pool once its response has been read. Connections that can't be reused are closed.
+
+        Args:
+            scheme (str): The URL scheme the connection was made for.
+            netloc (str): The host (and port) the connection was made for.
+            conn (http.client.HTTPConnection): The connection.
+            response (http.client.HTTPResponse): The last response on the connection.
+        """
+        # A response that was closed before its body was fully read (`length` is what's left of it) leaves the rest of
+        # the body on the connection.
+        if response is None or not response.isclosed() or response.will_close or response.length:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method: str, url: str, headers: dict[str, str] = None) -> tuple[http.client.HTTPResponse, str, Callable[[], None]]:
+        """Send a request, following redirects.
+
+        Args:
+            method (str): The HTTP method, such as "GET" or "HEAD".
+            url (str): The URL to request.
+            headers (dict[str, str], optional): Extra request headers. These are sent again for each redirect. Defaults to None.
+
+        Returns:
+            tuple[http.client.HTTPResponse, str, Callable[[], None]]: The final response, the URL it came from, and a function that
+            must be called once the response body has been read (or abandoned) to return the connection to the pool.
+        """
+        request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        request_headers.update(headers or {})
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlsplit(url)
+            target = url if parsed.scheme == "http" and self._get_proxy("http", parsed.hostname) else urllib.parse.urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+
+            conn, reused = self._acquire(parsed.scheme, parsed.netloc)
+            try:
+                conn.request(method, target, headers=request_headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection. Retry once on a fresh one.
+                conn = self._connect(parsed.scheme, parsed.netloc)
+                conn.request(method, target, headers=request_headers)
+                response = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+
+            if response.status in REDIRECT_STATUSES and response.getheader("Location"):
+                response.read()
+                self.release(parsed.scheme, parsed.netloc, conn, response)
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+
+            def release(scheme=parsed.scheme, netloc=parsed.netloc, conn=conn, response=response):
+                self.release(scheme, netloc, conn, response)
+            return response, url, release
+
+        raise DownloadError(f"Too many redirects while requesting '{url}'.")
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+def _parse_content_range(value: str) -> tuple[int, int, int]:
+    # "bytes <start>-<end>/<total>", where total may be "*". Also "bytes */<total>" for 416 responses.
+    if value is None or not value.startswith("bytes "):
+        return None
+    span, _, total = value[6:].partition("/")
+    total = None if total in ("", "*") else int(total)
+    if span == "*":
+        return None, None, total
+    start, _, end = span.partition("-")
+    return int(start), int(end), total
+
+
+class Downloader:
+    """Downloads files over HTTP(S) with resume support.
+
+    Data is written to `<dest>.part`, and renamed to `dest` only once it's complete, so an interrupted download never
+    looks finished. The validators of the partial file (ETag/Last-Modified and length) are kept in `<dest>.part.json`,
+    and the next attempt resumes with a Range request (guarded by If-Range, so a changed file is restarted rather than
+    spliced). Large files can optionally be fetched as several segments over concurrent connections, each of which is
+    resumed individually. Partial files without an ETag or Last-Modified are never resumed, since a change to the file
+    couldn't be detected.
+
+    Once a download completes, its validators (ETag, Last-Modified and length) are kept in `<dest>.validators.json`,
+    so that a later conditional download can ask the server whether the file changed, and skip the body if it didn't.
+    """
+    pool: ConnectionPool
+    chunk_size: int
+
+    def __init__(self, pool: ConnectionPool = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Initializes the Downloader.
+
+        Args:
+            pool (ConnectionPool, optional): The connections to use. If None, a new pool is created. Defaults to None.
+            chunk_size (int, optional): How much to read from the network at a time, in bytes. Defaults to DEFAULT_CHUNK_SIZE.
+        """
+        self.pool = ConnectionPool() if pool is None else pool
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def get_part_path(dest: Path) -> Path:
+        return dest.with_name(f"{dest.name}.part")
+
+    @staticmethod
+    def get_part_info_path(dest: Path) -> Path:
+        return dest.with_name(f"{dest.name}.part.json")
+
+    @staticmethod
+    def get_validators_path(dest: Path) -> Path:
+        return dest.with_name(f"{dest.name}.validators.json")
+
+    def load_validators(self, url: str, dest: Path) -> dict:
+        """Get the validators saved when `dest` was downloaded from `url`.
+
+        Args:
+            url (str): The URL the file was downloaded from.
+            dest (Path): The downloaded file.
+
+        Returns:
+            dict: The "etag", "last_modified" and "content_length" of the download. None if there are no saved validators,
+            they're for a different URL, or the file's size no longer matches.
+        """
+        try:
+            validators = json.loads(self.get_validators_path(dest).read_text())
+            size = dest.stat().st_size
+        except (OSError, ValueError):
+            return None
+
+        if validators.get("url") != url or validators.get("content_length") != size:
+            return None
+        return validators
+
+    def get_saved_url(self, dest: Path) -> str:
+        """Get the URL that a partial download of `dest`, or else its saved validators, belong to.
+
+        Args:
+            dest (Path): The download destination.
+
+        Returns:
+            str: The URL, or None if nothing is saved for `dest`. Downloading from any other URL starts over.
+        """
+        for path in (self.get_part_info_path(dest), self.get_validators_path(dest)):
+            try:
+                return json.loads(path.read_text())["url"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        return None
+
+    def _load_part_info(self, url: str, dest: Path) -> dict:
+        part_path = self.get_part_path(dest)
+        info_path = self.get_part_info_path(dest)
+        try:
+            info = json.loads(info_path.read_text())
+        except (OSError, ValueError):
+            info = None
+
+        if info is None or info.get("url") != url or not part_path.exists():
+            part_path.unlink(missing_ok=True)
+            info_path.unlink(missing_ok=True)
+            return None
+        return info
+
+    def _discard_part(self, dest: Path):
+        self.get_part_path(dest).unlink(missing_ok=True)
+        self.get_part_info_path(dest).unlink(missing_ok=True)
+
+    def _save_part_info(self, dest: Path, info: dict):
+        info_path = self.get_part_info_path(dest)
+        temp_path = info_path.with_name(f"{info_path.name}.tmp")
+        temp_path.write_text(json.dumps(info))
+        os.replace(temp_path, info_path)
+
+    def _finish(self, url: str, dest: Path, sha256: str, digest: str) -> str:
+        part_path = self.get_part_path(dest)
+        if sha256 is not None:
+            if digest is None:
+                digest = hash_file(part_path)
+            if digest != sha256.lower():
+                # Not resumable, since there's no telling which part of the file is wrong.
+                part_path.unlink(missing_ok=True)
+                self.get_part_info_path(dest).unlink(missing_ok=True)
+                raise DownloadError(f"Checksum mismatch for '{url}': expected sha256 {sha256.lower()}, got {digest}.")
+
+        try:
+            info = json.loads(self.get_part_info_path(dest).read_text())
+        except (OSError, ValueError):
+            info = {}
+        os.replace(part_path, dest)
+
+        temp_path = self.get_validators_path(dest).with_suffix(".tmp")
+        temp_path.write_text(json.dumps({
+            "url": url,
+            "etag": info.get("etag"),
+            "last_modified": info.get("last_modified"),
+            "content_length": dest.stat().st_size,
+        }))
+        os.replace(temp_path, self.get_validators_path(dest))
+        self.get_part_info_path(dest).unlink(missing_ok=True)
+        return digest
+
+    @staticmethod
+    def _get_validator(info: dict) -> str:
+        return info.get("etag") or info.get("last_modified")
+
+    def download(self, url: str, dest: Path, *, connections: int = 1, headers: dict[str, str] = None, sha256: str = None,
+            conditional: bool = False, on_chunk: Callable[[bytes], None] = None) -> DownloadResult:
+        """Download a URL to a file, resuming a previous partial download of the same URL if there is one.
+
+        Args:
+            url (str): The URL to download.
+            dest (Path): Where to save the file. Its directory must exist.
+            connections (int, optional): The number of concurrent connections to use for large files on servers that
+                support range requests. Defaults to 1.
+            headers (dict[str, str], optional): Extra request headers. Defaults to None.
+            sha256 (str, optional): The expected sha256 hex digest of the file. Single-connection downloads are hashed
+                as they stream in. Segmented ones are hashed once they're assembled. Defaults to None.
+            conditional (bool, optional): If `dest` already exists with saved validators, only download it again if the
+                server says it changed (If-None-Match/If-Modified-Since). Defaults to False.
+            on_chunk (Callable[[bytes], None], optional): Called with the contents of the file, in order, as they're
+                downloaded. A resumed download replays the part that was already downloaded first. Not called for a 304.
+                Implies a single connection. Defaults to None.
+
+        Raises:
+            DownloadError: If the server responds with an error, sends less data than it said it would, or the file
+                doesn't match `sha256`.
+
+        Returns:
+            DownloadResult: Information about the download. Its status is 304 if the existing file is still current.
+        """
+        dest = Path(dest)
+        info = self._load_part_info(url, dest)
+
+        if conditional and info is None:
+            validators = self.load_validators(url, dest)
+            conditional_headers = {}
+            if validators is not None and validators.get("etag"):
+                conditional_headers["If-None-Match"] = validators["etag"]
+            if validators is not None and validators.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = validators["last_modified"]
+            if len(conditional_headers) > 0:
+                # A changed file is downloaded over this same request, rather than probing for a segmented download first.
+                return self._download_stream(url, dest, None, {**(headers or {}), **conditional_headers}, sha256, on_chunk)
+
+        if on_chunk is not None:
+            # The contents have to be delivered in order, which segments aren't.
+            if info is not None and "segments" in info:
+                self._discard_part(dest)
+                info = None
+            return self._download_stream(url, dest, info, headers, sha256, on_chunk)
+
+        if info is not None and "segments" in info:
+            if self._get_validator(info) is not None:
+                return self._download_segmented(url, dest, info, max(1, connections), headers, sha256)
+            # Without an ETag or Last-Modified, there's no telling whether the file changed since the segments were
+            # downloaded, so they can't be resumed.
+            self._discard_part(dest)
+            info = None
+
+        if info is None and connections > 1:
+            probe = self._probe(url, headers)
+            if probe is not None and probe["length"] >= MIN_SEGMENT_SIZE:
+                return self._download_segmented(url, dest, probe, connections, headers, sha256)
+
+        return self._download_stream(url, dest, info, headers, sha256)
+
+    def _download_stream(self, url: str, dest: Path, info: dict, headers: dict[str, str], sha256: str,
+            on_chunk: Callable[[bytes], None] = None) -> DownloadResult:
+        part_path = self.get_part_path(dest)
+        offset = part_path.stat().st_size if info is not None else 0
+
+        request_headers = dict(headers or {})
+        if offset > 0 and self._get_validator(info) is not None:
+            request_headers["Range"] = f"bytes={offset}-"
+            request_headers["If-Range"] = self._get_validator(info)
+        else:
+            offset = 0
+
+        response, final_url, release = self.pool.request("GET", url, request_headers)
+        try:
+            if response.status == 304 and dest.exists():
+                response.read()
+                return DownloadResult(url, final_url, 304, dict(response.getheaders()), dest.stat().st_size)
+
+            if response.status == 416 and offset > 0:
+                # Nothing left to fetch, if the partial file is already the full length.
+                _, _, total = _parse_content_range(response.getheader("Content-Range")) or (None, None, None)
+                response.read()
+                if total == offset:
+                    digest = None
+                    if on_chunk is not None:
+                        hasher = hashlib.sha256()
+                        self._replay(part_path, hasher, on_chunk)
+                        digest = hasher.hexdigest()
+                    digest = self._finish(url, dest, sha256, digest)
+                    return DownloadResult(url, final_url, 206, dict(response.getheaders()), offset, digest)
+                raise DownloadError(f"Server rejected resuming '{url}' at byte {offset}. Delete '{part_path}' to restart.")
+
+            if response.status == 206 and offset > 0:
+                start, _, _ = _parse_content_range(response.getheader("Content-Range")) or (None, None, None)
+                if start != offset:
+                    raise DownloadError(f"Server resumed '{url}' at the wrong offset ({start} instead of {offset}).")
+                mode = "ab"
+            elif response.status == 200:
+                offset = 0
+                mode = "wb"
+            else:
+                raise DownloadError(f"Downloading '{url}' failed with HTTP {response.status} {response.reason}.")
+
+            length = response.getheader("Content-Length")
+            expected = None if length is None else offset + int(length)
+            self._save_part_info(dest, {
+                "url": url,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+                "length": expected,
+            })
+
+            # The file is hashed as it's written, so it never has to be read back. When resuming, only the part that
+            # was already downloaded is read.
+            hasher = hashlib.sha256()
+            if offset > 0:
+                self._replay(part_path, hasher, on_chunk)
+
+            size = offset
+            with open(part_path, mode) as f:
+                while chunk := response.read(self.chunk_size):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+                    size += len(chunk)
+
+            if expected is not None and size != expected:
+                raise DownloadError(f"Download of '{url}' ended early ({size} of {expected} bytes). Run it again to resume.")
+
+            digest = self._finish(url, dest, sha256, hasher.hexdigest())
+            return DownloadResult(url, final_url, response.status, dict(response.getheaders()), size, digest)
+        finally:
+            release()
+
+    @staticmethod
+    def _replay(path: Path, hasher, on_chunk: Callable[[bytes], None]):
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                hasher.update(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+
+    def stream(self, url: str, on_chunk: Callable[[bytes], None], *, headers: dict[str, str] = None, sha256: str = None) -> DownloadResult:
+        """Download a URL without saving it, passing its contents to `on_chunk` as they arrive. Can't be resumed.
+
+        Args:
+            url (str): The URL to download.
+            on_chunk (Callable[[bytes], None]): Called with the contents of the file, in order.
+            headers (dict[str, str], optional): Extra request headers. Defaults to None.
+            sha256 (str, optional): The expected sha256 hex digest of the file. Checked after the last chunk is delivered. Defaults to None.
+
+        Raises:
+            DownloadError: If the server responds with an error, sends less data than it said it would, or the file
+                doesn't match `sha256`.
+
+        Returns:
+            DownloadResult: Information about the download.
+        """
+        response, final_url, release = self.pool.request("GET", url, headers)
+        try:
+            if response.status != 200:
+                raise DownloadError(f"Downloading '{url}' failed with HTTP {response.status} {response.reason}.")
+
+            length = response.getheader("Content-Length")
+            hasher = hashlib.sha256()
+            size = 0
+            while chunk := response.read(self.chunk_size):
+                hasher.update(chunk)
+                on_chunk(chunk)
+                size += len(chunk)
+
+            if length is not None and size != int(length):
+                raise DownloadError(f"Download of '{url}' ended early ({size} of {length} bytes).")
+            digest = hasher.hexdigest()
+            if sha256 is not None and digest != sha256.lower():
+                raise DownloadError(f"Checksum mismatch for '{url}': expected sha256 {sha256.lower()}, got {digest}.")
+            return DownloadResult(url, final_url, response.status, dict(response.getheaders()), size, digest)
+        finally:
+            release()
+
+    def _probe(self, url: str, headers: dict[str, str]) -> dict:
+        request_headers = dict(headers or {})
+        request_headers["Range"] = "bytes=0-0"
+        response, _, release = self.pool.request("GET", url, request_headers)
+        try:
+            if response.status != 206:
+                # No range support. Drop the connection rather than reading a body we don't want.
+                response.close()
+                return None
+            response.read()
+            _, _, total = _parse_content_range(response.getheader("Content-Range")) or (None, None, None)
+            if total is None:
+                return None
+            return {
+                "url": url,
+                "etag": response.getheader("ETag"),
+                "last_modified": response.getheader("Last-Modified"),
+                "length": total,
+            }
+        finally:
+            release()
+
+    def _download_segmented(self, url: str, dest: Path, info: dict, connections: int, headers: dict[str, str], sha256: str) -> DownloadResult:
+        part_path = self.get_part_path(dest)
+        length = info["length"]
+
+        if "segments" not in info:
+            segment_size = -(-length // connections)
+            info["segments"] = [[start, min(start + segment_size, length), 0] for start in range(0, length, segment_size)]
+            with open(part_path, "wb") as f:
+                f.truncate(length)
+            self._save_part_info(dest, info)
+
+        lock = threading.Lock()
+        validator = self._get_validator(info)
+        restarting = threading.Event()
+
+        def fetch_segment(segment: list[int]):
+            start, end, written = segment
+            if start + written >= end or restarting.is_set():
+                return
+            request_headers = dict(headers or {})
+            request_headers["Range"] = f"bytes={start + written}-{end - 1}"
+            if validator is not None:
+                request_headers["If-Range"] = validator
+
+            response, _, release = self.pool.request("GET", url, request_headers)
+            try:
+                if response.status != 206:
+                    # Either the file changed (If-Range failed) or the server stopped supporting ranges.
+                    response.close()
+                    restarting.set()
+                    raise _RangeNotHonoredError(f"Server didn't honor a range request for '{url}' (HTTP {response.status}).")
+
+                unsaved = 0
+                with open(part_path, "r+b") as f:
+                    f.seek(start + written)
+                    while chunk := response.read(min(self.chunk_size, end - start - segment[2])):
+                        f.write(chunk)
+                        unsaved += len(chunk)
+                        with lock:
+                            segment[2] += len(chunk)
+                            if unsaved >= SEGMENT_SAVE_INTERVAL:
+                                f.flush()
+                                self._save_part_info(dest, info)
+                                unsaved = 0
+                        if start + segment[2] >= end or restarting.is_set():
+                            break
+            finally:
+                release()
+                with lock:
+                    self._save_part_info(dest, info)
+
+            if start + segment[2] != end and not restarting.is_set():
+                raise DownloadError(f"A segment of '{url}' ended early. Run it again to resume.")
+
+        try:
+            with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="modbuild-download") as pool:
+                for future in [pool.submit(fetch_segment, i) for i in info["segments"]]:
+                    future.result()
+        except _RangeNotHonoredError:
+            # The segments that were already downloaded can't be trusted to belong to the same file, so start over,
+            # over a single connection, the same way `_download_stream` does when If-Range fails.
+            self._discard_part(dest)
+            return self._download_stream(url, dest, None, headers, sha256)
+
+        # Segments arrive out of order, so the file can only be hashed once it's complete.
+        digest = self._finish(url, dest, sha256, None)
+        return DownloadResult(url, url, 206, {}, length, digest)
+
+    def close(self):
+        self.pool.close()
+
+
+# Probe results are cached for the life of the process, so that a URL is only probed once per build.
+PROBE_TIMEOUT = 2.0
+_probe_cache: dict[str, float] = {}
+_probe_lock = threading.Lock()
+
+def probe_latency(url: str, timeout: float = PROBE_TIMEOUT) -> float:
+    """Measure how long a server takes to answer a HEAD request for a URL.
+
+    Args:
+        url (str): The URL to probe.
+        timeout (float, optional): How long to wait for a response, in seconds. Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        float: The round-trip time in seconds, or infinity if the server is unreachable or doesn't have the file.
+    """
+    with _probe_lock:
+        if url in _probe_cache:
+            return _probe_cache[url]
+
+    pool = ConnectionPool(timeout=timeout, max_idle_per_host=0)
+    start = time.perf_counter()
+    try:
+        response, _, release = pool.request("HEAD", url)
+        response.read()
+        release()
+        retVal = time.perf_counter() - start if response.status < 400 else math.inf
+    except (DownloadError, OSError, http.client.HTTPException):
+        retVal = math.inf
+    finally:
+        pool.close()
+
+    with _probe_lock:
+        _probe_cache[url] = retVal
+    return retVal
+
+def rank_by_latency(urls: list[str], timeout: float = PROBE_TIMEOUT) -> list[str]:
+    """Probe several URLs for the same file at once, and order them from fastest to slowest. Unreachable URLs are kept, last.
+
+    Args:
+        urls (list[str]): The URLs to rank. URLs with the same latency keep their original order.
+        timeout (float, optional): How long to wait for each probe, in seconds. Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        list[str]: The URLs, fastest first.
+    """
+    if len(urls) <= 1:
+        return list(urls)
+
+    with ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix="modbuild-probe") as pool:
+        latencies = list(pool.map(lambda i: probe_latency(i, timeout), urls))
+    order = sorted(range(len(urls)), key=lambda i: latencies[i])
+    return [urls[i] for i in order]
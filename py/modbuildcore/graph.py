@@ -0,0 +1,186 @@
+import json
+from pathlib import Path
+
+from .job_base import JobBase
+
+class JobGraph:
+    """The dependency graph reachable from a set of jobs, annotated with how long each job is expected to take.
+
+    Durations come from the timing history recorded in `JobBase.state_store` by previous invokations (see `JobStateStore.record_timings`).
+    Jobs without any history are treated as taking no time, and are reported as such.
+    """
+    jobs: list[JobBase]
+    durations: dict[JobBase, float]
+
+    def __init__(self, roots: list[JobBase], timing_history: dict[str, dict] = None):
+        """Initializes the JobGraph.
+
+        Args:
+            roots (list[JobBase]): The jobs to build the graph from. All of their dependencies are included.
+            timing_history (dict[str, dict], optional): Job durations by timing key, as returned by `JobStateStore.load_timing_history`.
+                If None, the history is loaded from `JobBase.state_store` if one is set. Defaults to None.
+        """
+        if timing_history is None:
+            timing_history = {} if JobBase.state_store is None else JobBase.state_store.load_timing_history()
+
+        # Ordered so that dependencies come before their dependents.
+        self.jobs = []
+        seen = set()
+        def visit(job: JobBase):
+            if job in seen:
+                return
+            seen.add(job)
+            for i in job.dependencies:
+                visit(i)
+            self.jobs.append(job)
+
+        for i in roots:
+            visit(i)
+
+        self.durations = {}
+        for i in self.jobs:
+            entry = timing_history.get(i.get_timing_key())
+            if entry is not None:
+                self.durations[i] = entry["average"]
+
+    def get_duration(self, job: JobBase) -> float:
+        return self.durations.get(job, 0.0)
+
+    def get_node_ids(self) -> dict[JobBase, str]:
+        return {job: f"job{index}" for index, job in enumerate(self.jobs)}
+
+    def get_earliest_finish_times(self) -> dict[JobBase, float]:
+        """Get the time each job would finish if every job started as soon as its dependencies finished (unlimited workers).
+
+        Returns:
+            dict[JobBase, float]: The finish time of each job, in seconds from the start of the build.
+        """
+        retVal = {}
+        for job in self.jobs:
+            start = max((retVal[i] for i in job.dependencies), default=0.0)
+            retVal[job] = start + self.get_duration(job)
+        return retVal
+
+    def get_critical_path(self) -> list[JobBase]:
+        """Get the longest chain of dependent jobs. No amount of parallelism can make the build faster than this chain.
+
+        Returns:
+            list[JobBase]: The jobs on the critical path, in the order they run.
+        """
+        finish = self.get_earliest_finish_times()
+        if len(finish) == 0:
+            return []
+
+        retVal = [max(self.jobs, key=lambda i: finish[i])]
+        while len(retVal[-1].dependencies) > 0:
+            retVal.append(max(retVal[-1].dependencies, key=lambda i: finish[i]))
+        retVal.reverse()
+        return retVal
+
+    def get_total_work(self) -> float:
+        """The time the build would take with every job running one after another."""
+        return sum(self.get_duration(i) for i in self.jobs)
+
+    def get_critical_path_length(self) -> float:
+        """The time the build would take with unlimited workers."""
+        return sum(self.get_duration(i) for i in self.get_critical_path())
+
+    def get_max_useful_workers(self) -> int:
+        """The largest number of jobs that run at once when every job starts as early as it can. More workers than this won't speed up the build."""
+        finish = self.get_earliest_finish_times()
+        events = []
+        for job in self.jobs:
+            duration = self.get_duration(job)
+            if duration > 0:
+                events.append((finish[job] - duration, 1))
+                events.append((finish[job], -1))
+
+        # Ends sort before starts at the same time, so back-to-back jobs don't count as overlapping.
+        events.sort()
+        running = 0
+        retVal = 0
+        for _, change in events:
+            running += change
+            retVal = max(retVal, running)
+        return max(retVal, 1)
+
+    def get_analysis(self) -> dict:
+        """Summarize the graph's critical path and available parallelism.
+
+        Returns:
+            dict: The total work, critical path (job names and length), theoretical speedup, max useful workers, and jobs without timing history.
+        """
+        total = self.get_total_work()
+        critical_length = self.get_critical_path_length()
+        return {
+            "total_work": total,
+            "critical_path": [i.get_name() for i in self.get_critical_path()],
+            "critical_path_length": critical_length,
+            "theoretical_speedup": total / critical_length if critical_length > 0 else 1.0,
+            "max_useful_workers": self.get_max_useful_workers(),
+            "jobs_without_history": [i.get_name() for i in self.jobs if i not in self.durations],
+        }
+
+    def to_json(self) -> dict:
+        """Convert the graph and its analysis to a JSON-serializable dict.
+
+        Returns:
+            dict: The nodes (with names, types and durations), the edges (from dependent to dependency), and the analysis.
+        """
+        ids = self.get_node_ids()
+        critical = set(self.get_critical_path())
+        return {
+            "nodes": [
+                {
+                    "id": ids[i],
+                    "name": i.get_name(),
+                    "type": type(i).__name__,
+                    "duration": self.durations.get(i),
+                    "critical": i in critical,
+                }
+                for i in self.jobs
+            ],
+            "edges": [
+                {"from": ids[job], "to": ids[dep]}
+                for job in self.jobs for dep in job.dependencies
+            ],
+            "analysis": self.get_analysis(),
+        }
+
+    def to_dot(self) -> str:
+        """Convert the graph to Graphviz DOT. Jobs on the critical path are highlighted.
+
+        Returns:
+            str: The DOT source.
+        """
+        ids = self.get_node_ids()
+        critical = self.get_critical_path()
+        critical_edges = set(zip(critical[1:], critical[:-1]))
+
+        lines = [
+            "digraph modbuild {",
+            "    rankdir=LR;",
+            "    node [shape=box, fontname=\"sans-serif\"];",
+        ]
+        for job in self.jobs:
+            duration = self.durations.get(job)
+            label = job.get_name().replace("\\", "\\\\").replace('"', '\\"')
+            label += "\\n(no history)" if duration is None else f"\\n{duration:.2f}s"
+            attrs = [f'label="{label}"']
+            if job in critical:
+                attrs.append("color=red, penwidth=2")
+            lines.append(f"    {ids[job]} [{', '.join(attrs)}];")
+
+        for job in self.jobs:
+            for dep in job.dependencies:
+                attrs = " [color=red, penwidth=2]" if (job, dep) in critical_edges else ""
+                lines.append(f"    {ids[dep]} -> {ids[job]}{attrs};")
+
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def write_dot(self, path: Path):
+        Path(path).write_text(self.to_dot())
+
+    def write_json(self, path: Path):
+        Path(path).write_text(json.dumps(self.to_json(), indent=4))
@@ -1,6 +1,14 @@
+import os, sys
 from invoke import Context
 from pathlib import Path
 
+from .artifacts import ArtifactCache
+from .jobserver import RESOURCE_CPU
+from .scheduler import JobScheduler
+from .state import JobStateStore, hash_string
+from .timing import BuildTimer
+from .utils import LazyValue, print_error, resolve_lazy
+
 ## Some older version of python don't like the self-referential annotation. This is a work-around.
 class JobBase:
     ...
@@ -11,9 +19,26 @@ class JobBase:
     
     The only functions you should override are `__init__`, `run`, and optionally `needs_to_run`. 
     See the documentation of each function for more information.
+    
+    Job types that can tell when they're up to date from their inputs and outputs can also override `get_state_key`
+    and `get_input_fingerprint`, and then use `is_up_to_date` in `needs_to_run`. If their outputs are fully determined
+    by those inputs, they can also set `cacheable` to True, so that their outputs can be restored from `JobBase.artifact_cache`.
+    
+    Job types that mostly wait on the network rather than the CPU should set `resource_class` to `RESOURCE_NETWORK`, so that
+    they don't take jobserver tokens away from compiles when jobs run concurrently.
+    
+    `mod_output_files` may be a `LazyValue` of the whole dict, and `output_paths` may contain `LazyValue`s, for outputs
+    whose names come from files (such as the mod's .toml) that shouldn't be read when the project is loaded. Read them
+    through `get_mod_output_files` and `get_output_paths`.
     """
     # Class
     _resolved_jobs: list[JobBase] = []
+    state_store: JobStateStore = None
+    artifact_cache: ArtifactCache = None
+    project_root: Path = None
+    cacheable: bool = False
+    resource_class: str = RESOURCE_CPU
+    timer: BuildTimer = BuildTimer()
     
     @classmethod
     def get_all_resolved_mod_outputs(cls) -> dict[Path, Path]:
@@ -24,7 +49,7 @@ class JobBase:
         """
         retVal = {}
         for i in cls._resolved_jobs:
-            retVal.update(i.mod_output_files)
+            retVal.update(i.get_mod_output_files())
         
         return retVal
     
@@ -32,7 +57,9 @@ class JobBase:
     _has_been_resolved: bool
     no_duplication: bool
     dependencies: list[JobBase]
-    mod_output_files: dict[Path, Path]
+    mod_output_files: dict[Path, Path] | LazyValue
+    input_paths: list[Path]
+    output_paths: list[Path | LazyValue]
     
     # Overridable Functions:
     def __init__(self):
@@ -45,6 +72,8 @@ class JobBase:
         self.no_duplication = True
         self.dependencies = []
         self.mod_output_files = {}
+        self.input_paths = []
+        self.output_paths = []
     
 
     def needs_to_run(self, c: Context) -> bool:
@@ -65,7 +94,7 @@ class JobBase:
         """
         return True
     
-    def run(self, c: Context):
+    def run(self, c: Context) -> bool:
         """This function defines the task to perform when the job is run. Override when defining your own job type.
         
         This function should assume the job needs to be run. Checking if the job needs to be run should be handled by 
@@ -76,9 +105,55 @@ class JobBase:
 
         Args:
             c (Context): The pyinvoke Context from the current task invokation.
+
+        Returns:
+            bool: False if the job failed without aborting the build (such as a command failing with `--warn-only`), in
+            which case its state isn't saved and its outputs aren't cached. Returning nothing counts as success.
         """
         pass
     
+    def get_name(self) -> str:
+        """Get a short, human-readable name for this job, used in timing summaries and traces. Optionally override when defining your own job type.
+
+        Returns:
+            str: The job's name. The default implementation returns the name of the job type.
+        """
+        return type(self).__name__
+    
+    def get_timing_key(self) -> str:
+        """Get the name this job's run durations are recorded under in the timing history, which `graph` reads back.
+        
+        Unlike `get_name`, which is only for display and can be shared by several jobs, this should be unique and stable
+        between invokations. Returns `get_state_key`, or for jobs without one, the job type and name.
+
+        Returns:
+            str: The timing key.
+        """
+        key = self.get_state_key()
+        return key if key is not None else f"{type(self).__name__}: {self.get_name()}"
+    
+    def get_state_key(self) -> str:
+        """Get the name this job's fingerprint record is stored under in `JobBase.state_store`. Optionally override when defining your own job type.
+        
+        The key should be unique to the job, and stable between invokations. The default implementation returns `None`,
+        meaning that the job doesn't support up-to-date checks and `is_up_to_date` will always return False.
+
+        Returns:
+            str: The state key, or None.
+        """
+        return None
+    
+    def get_input_fingerprint(self) -> dict[str, str]:
+        """Get digests of everything that affects what this job produces. Optionally override when defining your own job type.
+        
+        The default implementation fingerprints the files and directories in `self.input_paths`. Overrides should
+        extend the dict returned by this implementation with things like tool binaries, arguments, and environmental variables.
+
+        Returns:
+            dict[str, str]: A dict mapping a description of each input to its digest.
+        """
+        return self.state_store.fingerprint_paths(self.input_paths)
+    
     # Not to override:
     def depends_on(self, new_dependencies: list[JobBase]) -> JobBase:
         """Declare other jobs as dependencies for this one. 
@@ -100,49 +175,250 @@ class JobBase:
         A job is considered `resolved` after this method is called, regardless of whether the job actually ran. 
         
         Unless `self.no_duplication == True`, a job will not be resolved twice.
+        
+        Dependencies are resolved by a `JobScheduler`. If more than one concurrent job was requested (`modbuild.py -j N`),
+        independent dependency jobs will run at the same time.
 
         Args:
             c (Context): The pyinvoke Context from the current task invokation.
             skip_dependencies (bool, optional): If True, skip handling dependency jobs. Defaults to False.
         """
-        if self.no_duplication and self._has_been_resolved:
-            return
-        
-        if self.needs_to_run(c):
-            if not skip_dependencies:
-                for i in self.dependencies:
-                    i.resolve(c)
-            self.run(c)
-        
-        self._has_been_resolved = True
-        self._resolved_jobs.append(self)
+        with self.timer.measure(self.get_name(), "resolve"):
+            JobScheduler(c).resolve([self], skip_dependencies)
+    
+    @classmethod
+    def resolve_many(cls, c: Context, jobs: list[JobBase], skip_dependencies: bool = False, restrict_to: set[JobBase] = None):
+        """Resolve several jobs together. Behaves like calling `resolve` on each job in turn, 
+        except that independent jobs (and their dependencies) may run concurrently.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+            jobs (list[JobBase]): The jobs to resolve.
+            skip_dependencies (bool, optional): If True, skip handling dependency jobs. Defaults to False.
+            restrict_to (set[JobBase], optional): If set, only jobs in this set are resolved. Used to rebuild part of the graph. Defaults to None.
+        """
+        jobs = list(jobs)
+        with cls.timer.measure(", ".join(i.get_name() for i in jobs), "resolve"):
+            JobScheduler(c).resolve(jobs, skip_dependencies, restrict_to)
+    
+    @classmethod
+    def reset_resolution(cls):
+        """Mark every previously resolved job as unresolved, so that jobs can be resolved again in the same process (such as in watch mode)."""
+        for i in cls._resolved_jobs:
+            i._has_been_resolved = False
+        cls._resolved_jobs.clear()
         
     def get_recursive_mod_outputs(self, include_unresolved_jobs: bool = True, include_self: bool = True) -> dict[Path, Path]:
         """Get the combined mod_output_files from this job and all dependent jobs. By default, skips any dependent job that wasn't resolved.
         
         Used by specific job types to collect all files for build output folders and Thunderstore packaging.
+        
+        Each job in the dependency graph is visited once, even if it can be reached through several paths. 
+        None of the jobs' mod_output_files are modified. If two jobs declare the same output location with different
+        source files, the build is aborted, since it's ambiguous which file should be used.
 
         Args:
-            include_unresolved_jobs (bool, optional): If True, skip any dependency job that wasn't resolved. Defaults to True.
+            include_unresolved_jobs (bool, optional): If False, skip any dependency job that wasn't resolved (along with its own dependencies). Defaults to True.
             include_self (bool, optional): Include this job regardless of whether it was resolved. Defaults to True.
 
         Returns:
             dict[Path, Path]: The combined mod_output_files. The key will be the desired file location in the output, the value will be the path in the project.
         """
-        if not (include_self or self._has_been_resolved or include_unresolved_jobs):
-            return {}
+        retVal: dict[Path, Path] = {}
+        owners: dict[Path, JobBase] = {}
+        visited: set[JobBase] = set()
+        to_visit: list[JobBase] = [self]
         
-        retVal = self.mod_output_files
+        while len(to_visit) > 0:
+            job = to_visit.pop()
+            if job in visited:
+                continue
+            visited.add(job)
+            
+            if not ((job is self and include_self) or job._has_been_resolved or include_unresolved_jobs):
+                continue
+            
+            for dst, src in job.get_mod_output_files().items():
+                if dst in retVal and retVal[dst] != src:
+                    print_error(f"FATAL! '{dst}' is declared as a mod_output_file by both {owners[dst].get_name()} ('{retVal[dst]}') "
+                        f"and {job.get_name()} ('{src}'). Aborting...")
+                    sys.exit(1)
+                retVal[dst] = src
+                owners[dst] = job
+            
+            # Reversed so that dependencies are visited in declaration order.
+            to_visit.extend(reversed(job.dependencies))
         
-        for i in self.dependencies:
-            retVal.update(i.get_recursive_mod_outputs(include_unresolved_jobs, False))
+        return retVal
+    
+    def get_mod_output_files(self) -> dict[Path, Path]:
+        """Get this job's own mod_output_files, computing them first if they were declared as a `LazyValue`.
+
+        Returns:
+            dict[Path, Path]: The mod_output_files. The key will be the desired file location in the output, the value will be the path in the project.
+        """
+        return resolve_lazy(self.mod_output_files)
+    
+    def get_output_paths(self) -> list[Path]:
+        """Get the files this job produces, for the purposes of up-to-date checks. 
         
+        This includes `self.output_paths` and the project-side paths of `self.mod_output_files`.
+
+        Returns:
+            list[Path]: The output file paths.
+        """
+        retVal = resolve_lazy(self.output_paths)
+        for i in self.get_mod_output_files().values():
+            if i not in retVal:
+                retVal.append(i)
         return retVal
     
+    def get_output_fingerprint(self) -> dict[str, str]:
+        return self.state_store.fingerprint_paths(self.get_output_paths())
+    
+    def is_up_to_date(self) -> bool:
+        """Checks the current inputs and outputs of this job against the record saved after it last ran.
+        
+        A job is up to date if a state store is configured, the job has a state key, its input and output fingerprints
+        match the saved record, and every dependency that also supports up-to-date checks is up to date.
+
+        Returns:
+            bool: True if the job is up to date. False if otherwise.
+        """
+        if self.state_store is None:
+            return False
+        
+        key = self.get_state_key()
+        if key is None:
+            return False
+        
+        record = self.state_store.load(key)
+        if record is None:
+            return False
+        
+        if record.get("inputs") != self.get_input_fingerprint() or record.get("outputs") != self.get_output_fingerprint():
+            return False
+        
+        for i in self.dependencies:
+            if i.get_state_key() is not None and not i.is_up_to_date():
+                return False
+        
+        return True
+    
+    def save_state(self, c: Context):
+        """Save this job's current input and output fingerprints to `JobBase.state_store`. Called after the job runs successfully.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+        """
+        if self.state_store is None or c.config['run']['dry']:
+            return
+        
+        key = self.get_state_key()
+        if key is None:
+            return
+        
+        self.state_store.save(key, {
+            "job": type(self).__name__,
+            "inputs": self.get_input_fingerprint(),
+            "outputs": self.get_output_fingerprint(),
+        })
+    
+    def get_cache_key(self) -> str:
+        """Get the key this job's outputs are stored under in `JobBase.artifact_cache`.
+        
+        The key is a hash of the job type, the input fingerprint (which includes the toolchain and environment for job types
+        that invoke one), and the output paths, so the same inputs always map to the same outputs. Paths under
+        `JobBase.project_root` are hashed relative to it, so that clones in different places, or on different machines,
+        share cache entries.
+
+        Returns:
+            str: The cache key, or None if this job can't be cached.
+        """
+        if not self.cacheable or self.state_store is None or self.get_state_key() is None:
+            return None
+        
+        inputs = sorted((self.get_portable_path(k), v) for k, v in self.get_input_fingerprint().items())
+        outputs = [self.get_portable_path(i) for i in self.get_output_paths()]
+        return hash_string(repr((type(self).__name__, inputs, outputs)))
+    
+    @classmethod
+    def get_portable_path(cls, path: Path | str) -> str:
+        """Get a path relative to `JobBase.project_root` (or the current directory, if that isn't set), for use in cache keys.
+
+        Args:
+            path (Path | str): The path. Strings that aren't absolute paths, such as fingerprint names, are returned as they are.
+
+        Returns:
+            str: The path relative to the project root in POSIX form, or the path unchanged if it's outside the project root.
+        """
+        if not os.path.isabs(path):
+            return str(path) if isinstance(path, str) else Path(path).as_posix()
+        root = Path(cls.project_root if cls.project_root is not None else os.getcwd()).absolute()
+        try:
+            return Path(path).absolute().relative_to(root).as_posix()
+        except ValueError:
+            return str(path)
+    
+    def restore_from_cache(self, c: Context) -> bool:
+        """Try to restore this job's outputs from `JobBase.artifact_cache` instead of running it. Called before the job runs.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+
+        Returns:
+            bool: True if the outputs were restored, and the job doesn't need to run. False if otherwise.
+        """
+        if self.artifact_cache is None or c.config['run']['dry']:
+            return False
+        
+        key = self.get_cache_key()
+        if key is None:
+            return False
+        
+        return self.artifact_cache.restore(key, self.get_output_paths())
+    
+    def save_to_cache(self, c: Context):
+        """Store this job's outputs in `JobBase.artifact_cache`. Called after the job runs successfully.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+        """
+        if self.artifact_cache is None or c.config['run']['dry']:
+            return
+        
+        key = self.get_cache_key()
+        if key is None:
+            return
+        
+        self.artifact_cache.save(key, self.get_output_paths())
+    
+    def add_input_paths(self, paths: list[Path]):
+        """Declare additional files or directories that this job reads, for the purposes of up-to-date checks.
+
+        Args:
+            paths (list[Path]): The additional input paths. Directories are fingerprinted recursively.
+        """
+        self.input_paths.extend(paths)
+    
+    def add_output_paths(self, paths: list[Path]):
+        """Declare additional files that this job produces, for the purposes of up-to-date checks.
+        
+        Unlike mod_output_files, these files aren't collected by BuildOutputJobs or ThunderstorePackageJobs.
+
+        Args:
+            paths (list[Path]): The additional output paths.
+        """
+        self.output_paths.extend(paths)
+    
     def add_mod_output_files(self, files: dict[Path, Path]):
         """Add additional mod_output_files in addition to what the job already declares.
 
         Args:
             files (dict[Path, Path]): The additional mod_output_files to declare. The key will be the desired file location in the output, the value will be the path in the project.
         """
-        self.mod_output_files.update(files)
\ No newline at end of file
+        if isinstance(self.mod_output_files, LazyValue):
+            declared = self.mod_output_files
+            self.mod_output_files = LazyValue(lambda: {**declared.get(), **files})
+        else:
+            self.mod_output_files.update(files)
\ No newline at end of file
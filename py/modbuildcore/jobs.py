@@ -1,18 +1,37 @@
+from .job_base import JobBase
 from .archives import ArchiveExtractJob
+from .artifacts import ArtifactCache, LocalArtifactBackend, HttpArtifactBackend
 from .cmake import CMakeProjectConfig, CMakeBuildJob
 from .downloads import DownloadJob
 from .makefiles import MakefileJob
+from .mips import MipsCompileJob
+from .state import JobStateStore
+from .blobs import BlobCache
+from .trees import TreeStore
 from .build_output import BuildOutputJob
 from .thunderstore import ThunderstorePackageJob
 from .tomls import ModTomlJob
+from .symbols import SymbolIndexJob, SymbolIndex
+from .utils import LazyValue
 
 __all__ = [
+    'JobBase',
     'ArchiveExtractJob',
+    'ArtifactCache',
+    'LocalArtifactBackend',
+    'HttpArtifactBackend',
     'CMakeProjectConfig',
     'CMakeBuildJob',
     'DownloadJob',
     'MakefileJob',
+    'MipsCompileJob',
+    'JobStateStore',
+    'BlobCache',
+    'TreeStore',
     'BuildOutputJob',
     'ThunderstorePackageJob',
     'ModTomlJob',
+    'SymbolIndexJob',
+    'SymbolIndex',
+    'LazyValue',
 ]
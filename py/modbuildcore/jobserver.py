@@ -0,0 +1,267 @@
+import os, shutil, select, tempfile, threading, atexit
+from pathlib import Path
+from contextlib import contextmanager
+
+from invoke import Context
+
+# Resource classes that jobs can declare with `JobBase.resource_class`. CPU-bound jobs share the jobserver tokens with
+# any make and ninja processes they spawn. Network-bound jobs don't use the CPU, so they get a separate, smaller limit.
+RESOURCE_CPU = "cpu"
+RESOURCE_NETWORK = "network"
+
+# How often a thread waiting for a token re-checks for the implicit token being returned, in seconds.
+TOKEN_POLL_INTERVAL = 0.05
+
+def get_max_workers(c: Context) -> int:
+    """Reads the number of concurrent jobs from the invoke config (set by `modbuild.py -j N`).
+
+    Args:
+        c (Context): The pyinvoke Context from the current task invokation.
+
+    Returns:
+        int: The number of jobs that may run at once. A configured value of 0 means one per CPU.
+    """
+    try:
+        jobs = int(c.config.modbuild.jobs)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 1
+
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def get_network_jobs(c: Context) -> int:
+    """Reads the number of concurrent network-bound jobs from the invoke config (`modbuild.network_jobs`).
+
+    Args:
+        c (Context): The pyinvoke Context from the current task invokation.
+
+    Returns:
+        int: The number of network-bound jobs that may run at once.
+    """
+    try:
+        return max(1, int(c.config.modbuild.network_jobs))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return 4
+
+
+class Jobserver:
+    """A GNU make compatible jobserver, shared by modbuild's own jobs and any make or ninja processes they spawn.
+
+    The jobserver is a named pipe holding one token (a single byte) per job slot, minus the one implicit slot that this
+    process owns. A job acquires a token before it runs and returns it afterwards. Child make processes are told about the
+    pipe through MAKEFLAGS, and use the slot held by the job that spawned them as their own implicit slot, so that the total
+    number of running jobs, compilers included, never exceeds `jobs`.
+
+    On platforms without named pipes, tokens are only shared between modbuild's own jobs.
+    """
+    jobs: int
+    fifo_path: Path
+    _read_fd: int
+    _write_fd: int
+    _poll_fd: int
+    _implicit_free: bool
+    _semaphore: threading.Semaphore
+    _lock: threading.Lock
+
+    @staticmethod
+    def is_supported() -> bool:
+        return hasattr(os, "mkfifo")
+
+    def __init__(self, jobs: int):
+        """Initializes the Jobserver, and fills it with tokens.
+
+        Args:
+            jobs (int): The total number of job slots, including the implicit one.
+        """
+        self.jobs = max(1, jobs)
+        self.fifo_path = None
+        self._read_fd = -1
+        self._write_fd = -1
+        self._poll_fd = -1
+        self._implicit_free = True
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+        if not self.is_supported():
+            self._semaphore = threading.Semaphore(self.jobs)
+            return
+
+        self.fifo_path = Path(tempfile.mkdtemp(prefix="modbuild-jobserver-")).joinpath("fifo")
+        os.mkfifo(self.fifo_path, 0o600)
+        # Make reads with blocking I/O on the descriptors it inherits, while we poll on a separate open file description,
+        # so that making ours non-blocking doesn't affect our children.
+        self._read_fd = os.open(self.fifo_path, os.O_RDWR)
+        self._write_fd = os.open(self.fifo_path, os.O_WRONLY)
+        os.set_inheritable(self._read_fd, True)
+        os.set_inheritable(self._write_fd, True)
+        self._poll_fd = os.open(self.fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self._poll_fd, b"+" * (self.jobs - 1))
+
+    def acquire(self) -> bytes:
+        """Block until a job slot is available, and take it.
+
+        Returns:
+            bytes: The token that was taken, which must be passed to `release`. None for the implicit slot.
+        """
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+            return None
+
+        while True:
+            with self._lock:
+                if self._implicit_free:
+                    self._implicit_free = False
+                    return None
+                try:
+                    token = os.read(self._poll_fd, 1)
+                except BlockingIOError:
+                    token = b""
+                if len(token) > 0:
+                    return token
+            select.select([self._poll_fd], [], [], TOKEN_POLL_INTERVAL)
+
+    def release(self, token: bytes):
+        """Return a job slot taken with `acquire`.
+
+        Args:
+            token (bytes): The token returned by `acquire`.
+        """
+        if self._semaphore is not None:
+            self._semaphore.release()
+            return
+
+        with self._lock:
+            if token is None:
+                self._implicit_free = True
+            else:
+                os.write(self._poll_fd, token)
+
+    def get_make_flags(self, fifo: bool = False) -> str:
+        """Get the MAKEFLAGS that connect a child process to this jobserver.
+
+        Args:
+            fifo (bool, optional): If True, refer to the jobserver by path (GNU make 4.4+ and ninja 1.13+). Otherwise, by
+                inherited file descriptors (GNU make 4.2+), which must be passed with `get_pass_fds`. Defaults to False.
+
+        Returns:
+            str: The MAKEFLAGS value, or None if this platform doesn't support sharing the jobserver.
+        """
+        if self.fifo_path is None:
+            return None
+        if fifo:
+            return f"-j{self.jobs} --jobserver-auth=fifo:{self.fifo_path}"
+        return f"-j{self.jobs} --jobserver-auth={self._read_fd},{self._write_fd}"
+
+    def get_pass_fds(self) -> tuple[int, ...]:
+        if self.fifo_path is None:
+            return ()
+        return (self._read_fd, self._write_fd)
+
+    def close(self):
+        for fd in (self._read_fd, self._write_fd, self._poll_fd):
+            if fd >= 0:
+                os.close(fd)
+        self._read_fd = self._write_fd = self._poll_fd = -1
+        if self.fifo_path is not None:
+            shutil.rmtree(self.fifo_path.parent, ignore_errors=True)
+            self.fifo_path = None
+
+
+class JobResources:
+    """The limits on how many jobs of each resource class can run at once. See `RESOURCE_CPU` and `RESOURCE_NETWORK`."""
+    jobserver: Jobserver
+    network_jobs: int
+    _network: threading.Semaphore
+
+    def __init__(self, jobs: int, network_jobs: int):
+        """Initializes the JobResources.
+
+        Args:
+            jobs (int): The number of CPU-bound jobs (and child compiler processes) that may run at once.
+            network_jobs (int): The number of network-bound jobs that may run at once.
+        """
+        self.jobserver = Jobserver(jobs)
+        self.network_jobs = network_jobs
+        self._network = threading.Semaphore(network_jobs)
+
+    @contextmanager
+    def acquire(self, resource_class: str):
+        """A context manager that holds a slot of the given resource class for the enclosed block.
+
+        Args:
+            resource_class (str): The resource class of the job. Unknown classes are treated as CPU-bound.
+        """
+        if resource_class == RESOURCE_NETWORK:
+            with self._network:
+                yield
+            return
+
+        token = self.jobserver.acquire()
+        try:
+            yield
+        finally:
+            self.jobserver.release(token)
+
+    def close(self):
+        self.jobserver.close()
+
+
+_job_resources: JobResources = None
+_job_resources_pid: int = None
+_job_resources_lock = threading.Lock()
+
+def get_job_resources(c: Context) -> JobResources:
+    """Get the JobResources shared by every job in this process, creating them on first use.
+
+    Args:
+        c (Context): The pyinvoke Context from the current task invokation.
+
+    Returns:
+        JobResources: The shared resources, or None if jobs are configured to run one at a time.
+    """
+    global _job_resources, _job_resources_pid
+
+    jobs = get_max_workers(c)
+    if jobs <= 1:
+        return None
+
+    with _job_resources_lock:
+        # A forked process (such as a request handled by `modbuild.py --server`) gets its own jobserver.
+        if _job_resources is None or _job_resources_pid != os.getpid() or _job_resources.jobserver.jobs != jobs:
+            if _job_resources is not None and _job_resources_pid == os.getpid():
+                _job_resources.close()
+            _job_resources = JobResources(jobs, get_network_jobs(c))
+            _job_resources_pid = os.getpid()
+        return _job_resources
+
+def get_subprocess_jobserver_args(c: Context, env: dict[str, str], *, fifo: bool = False) -> dict:
+    """Connect a child build tool to the shared jobserver, if there is one.
+
+    Args:
+        c (Context): The pyinvoke Context from the current task invokation.
+        env (dict[str, str]): The environment the child will be started with. MAKEFLAGS is updated in place.
+        fifo (bool, optional): Refer to the jobserver by path instead of inherited file descriptors. Use this for tools
+            that only support the fifo style, such as ninja. Defaults to False.
+
+    Returns:
+        dict: Extra keyword arguments for `subprocess.run`.
+    """
+    resources = get_job_resources(c)
+    if resources is None:
+        return {}
+
+    make_flags = resources.jobserver.get_make_flags(fifo)
+    if make_flags is None:
+        return {}
+
+    env["MAKEFLAGS"] = make_flags
+    if fifo:
+        return {}
+    return {"pass_fds": resources.jobserver.get_pass_fds()}
+
+@atexit.register
+def _close_job_resources():
+    if _job_resources is not None and _job_resources_pid == os.getpid():
+        _job_resources.close()
@@ -1,25 +1,74 @@
-import shutil, os
+import shutil, os, re, json
 from pathlib import Path
 
 from invoke import Context
 from .job_base import JobBase
+from .jobserver import get_subprocess_jobserver_args
+from .state import hash_string
+from .utils import LazyValue, invoke_subprocess_run, print_job_header, resolve_lazy, slugify
+
+MAKE_ASSIGNMENT_PATTERN = re.compile(r"^([A-Za-z0-9_.-]+)\s*(:::=|::=|:=|\?=|\+=|=)\s*(.*?)\s*$")
+MAKE_REFERENCE_PATTERN = re.compile(r"\$[({]([A-Za-z0-9_.-]+)[)}]")
+
+def read_make_variables(makefile_path: Path) -> dict[str, str]:
+    """Read the variables a makefile such as `common.mk` assigns, with references to other variables expanded.
+    
+    Only plain assignments are understood. Conditionals, includes and recipes are skipped, and references to functions
+    or unknown variables are left as written.
+
+    Args:
+        makefile_path (Path): The makefile to read.
+
+    Returns:
+        dict[str, str]: The variables, by name.
+    """
+    text = Path(makefile_path).read_text()
+    text = re.sub(r"\\\r?\n", " ", text)
+    
+    raw: dict[str, str] = {}
+    for line in text.splitlines():
+        if line.startswith("\t"):
+            continue
+        match = MAKE_ASSIGNMENT_PATTERN.match(line.split("#", 1)[0].strip())
+        if match is None:
+            continue
+        name, operator, value = match.groups()
+        if operator == "?=" and name in raw:
+            continue
+        if operator == "+=" and name in raw:
+            value = f"{raw[name]} {value}"
+        raw[name] = value
+    
+    def expand(value: str, depth: int) -> str:
+        if depth > 32:
+            return value
+        return MAKE_REFERENCE_PATTERN.sub(lambda m: expand(raw[m[1]], depth + 1) if m[1] in raw else m[0], value)
+    return {name: expand(value, 0).strip() for name, value in raw.items()}
+
 
-from .utils import invoke_subprocess_run, print_job_header
-        
 class MakefileJob(JobBase):
     """This job executes a makefile with additional environmental variables.
+    
+    If `JobBase.state_store` is set, the job is skipped when the makefile, environmental variables, Make binary,
+    declared input paths, and declared output paths are all unchanged since it last ran.
+    
+    When jobs run concurrently (`modbuild.py -j N`), Make joins modbuild's jobserver through MAKEFLAGS, so it compiles in
+    parallel using whatever slots the other jobs aren't using. This requires GNU Make 4.2 or newer.
     """
     make_binary_path: Path
     makefile_path: Path
-    extended_env: dict[str, str]
+    extended_env: dict[str, str | LazyValue]
     
-    def __init__(self, makefile_path: Path, extended_env: dict[str, str], *, make_binary_path: Path = None):
+    def __init__(self, makefile_path: Path, extended_env: dict[str, str | LazyValue], *, make_binary_path: Path = None,
+            input_paths: list[Path] = None, output_paths: list[Path | LazyValue] = None):
         """Initializes the MakefileJob.
 
         Args:
             makefile_path (Path): The path to the Makefile to run.
-            extended_env (dict[str, str]): Additional/overiding environmental variables to use when invoking Make.
+            extended_env (dict[str, str | LazyValue]): Additional/overiding environmental variables to use when invoking Make. Values may be LazyValues.
             make_binary_path (Path, optional): The location of the Make binary. If None, defaults the `make` command on your system path. Defaults to None.
+            input_paths (list[Path], optional): Source files/directories, tools, and included makefiles that the build reads. Used for up-to-date checks. Defaults to None.
+            output_paths (list[Path | LazyValue], optional): Files the makefile produces. Used for up-to-date checks. Defaults to None.
         """
         super().__init__()
         if make_binary_path is None:
@@ -28,13 +77,42 @@ class MakefileJob(JobBase):
             self.make_binary_path = make_binary_path
         self.makefile_path = makefile_path
         self.extended_env = extended_env
+        
+        self.add_input_paths([makefile_path] + (input_paths or []))
+        self.add_output_paths(output_paths or [])
+    
+    def get_name(self) -> str:
+        return f"Makefile: {Path(self.makefile_path).name}"
+    
+    def get_env(self) -> dict[str, str]:
+        return {key: str(value) for key, value in resolve_lazy(self.extended_env).items()}
+    
+    def get_state_key(self) -> str:
+        identity = str(self.makefile_path) + json.dumps(self.get_env(), sort_keys=True)
+        return f"makefile_{slugify(Path(self.makefile_path).stem)}_{hash_string(identity)[:16]}"
+    
+    def get_input_fingerprint(self) -> dict[str, str]:
+        retVal = super().get_input_fingerprint()
+        retVal["make_binary"] = self.state_store.fingerprint_path(self.make_binary_path)
+        for key, value in self.get_env().items():
+            retVal[f"env:{key}"] = hash_string(value)
+        return retVal
+    
+    # Override:
+    def needs_to_run(self, c: Context) -> bool:
+        if self.is_up_to_date():
+            print_job_header(f"Makefile Job: {self.makefile_path} is up to date.")
+            return False
+        return True
     
-    def run(self, c: Context):
+    def run(self, c: Context) -> bool:
         print_job_header(f"Makefile Job: {self.makefile_path}")
         make_env = os.environ.copy()
-        make_env.update(self.extended_env)
+        make_env.update(self.get_env())
         
-        invoke_subprocess_run(c, True,
+        result = invoke_subprocess_run(c, True,
             [self.make_binary_path, "-f", self.makefile_path],
-            env=make_env
-        )
\ No newline at end of file
+            env=make_env,
+            **get_subprocess_jobserver_args(c, make_env)
+        )
+        return result is None or result.returncode == 0
\ No newline at end of file
@@ -0,0 +1,448 @@
+import os, sys, json, shlex, threading, subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from invoke import Context
+from .job_base import JobBase
+from .jobserver import get_job_resources
+from .extraction import matches_globs
+from .makefiles import read_make_variables
+from .state import hash_string
+from .utils import LazyValue, print_job_header, print_fl, print_error, resolve_lazy, slugify
+
+def parse_depfile(path: Path) -> list[str]:
+    """Read the prerequisites from a Make-style depfile, such as the ones clang writes with `-MD`.
+
+    Args:
+        path (Path): The depfile.
+
+    Returns:
+        list[str]: The prerequisites, as written (relative paths are relative to the compiler's working directory).
+    """
+    text = Path(path).read_text(errors="replace").replace("\\\r\n", " ").replace("\\\n", " ")
+    retVal = []
+    token = []
+    i = 0
+    while i <= len(text):
+        char = text[i] if i < len(text) else " "
+        if char == "\\" and i + 1 < len(text) and text[i + 1] in " #":
+            token.append(text[i + 1])
+            i += 2
+            continue
+        if char == "$" and i + 1 < len(text) and text[i + 1] == "$":
+            token.append("$")
+            i += 2
+            continue
+        if char.isspace():
+            if len(token) > 0:
+                name = "".join(token)
+                # Targets end with a colon. Windows drive letters don't, since they're followed by a path.
+                if not name.endswith(":"):
+                    retVal.append(name)
+                token = []
+        else:
+            token.append(char)
+        i += 1
+    return retVal
+
+
+class MipsCompileJob(JobBase):
+    """Compile the C files in a folder with the MIPS clang, and link them into an elf. Does the same as `mod_elf.mk`, without Make.
+
+    Files are compiled in parallel, one per CPU, or within the shared jobserver's limit when jobs run concurrently
+    (`modbuild.py -j N`). Each object's dependencies are tracked with the depfile clang writes with `-MD`, so only files whose
+    source, included headers or compile command changed are recompiled, and the elf is only relinked if an object changed.
+
+    The compile and link flags are read from a makefile's CFLAGS, CPPFLAGS and LDFLAGS (`common.mk`), so that this job and
+    `mod_elf.mk` stay in sync. If `JobBase.state_store` is set, the job is skipped entirely when none of its input paths,
+    flags or tools have changed.
+
+    With `pch_headers` set, those headers are compiled once into a clang precompiled header, which every file is compiled
+    with (`-include-pch`), so that big headers like the decomp's `global.h` aren't parsed again for each file. The PCH is
+    tracked with a depfile like the objects are, and every object is recompiled when it's rebuilt.
+
+    With `unity_build` set, the files are compiled in batches of `unity_batch_size`, each batch as one generated file that
+    includes the batch's sources (a unity or jumbo build), so headers are parsed once per batch rather than once per file.
+    Files in a batch share one scope, so files that clash with others (such as by defining the same static names or macros)
+    can be listed in `unity_exclude` to be compiled on their own. Since changing any file in a batch recompiles the whole
+    batch, this is best for clean and release builds.
+    """
+    cc_path: Path
+    ld_path: Path
+    src_dir: Path
+    flags_makefile: Path
+    extra_cflags: list[str]
+    extra_ldflags: list[str]
+    pch_headers: list[str]
+    unity_build: bool
+    unity_batch_size: int
+    unity_exclude: list[str]
+    threads: int
+    _elf_path: Path | LazyValue
+    _build_dir: Path | LazyValue
+    _map_path: Path
+    _make_variables: dict[str, str]
+
+    def __init__(self, src_dir: Path, elf_path: Path | LazyValue, cc_path: Path, ld_path: Path, *, build_dir: Path | LazyValue = None,
+            flags_makefile: Path = None, extra_cflags: list[str] = None, extra_ldflags: list[str] = None, map_path: Path = None,
+            input_paths: list[Path] = None, pch_headers: list[str] = None, unity_build: bool = False, unity_batch_size: int = 8,
+            unity_exclude: list[str] = None, threads: int = 0):
+        """Initializes the MipsCompileJob.
+
+        Args:
+            src_dir (Path): The folder to compile every .c file in, recursively.
+            elf_path (Path | LazyValue): The elf to link.
+            cc_path (Path): The MIPS clang binary.
+            ld_path (Path): The linker binary (ld.lld).
+            build_dir (Path | LazyValue, optional): Where to put objects and depfiles. Defaults to the elf's folder.
+            flags_makefile (Path, optional): A makefile to read CFLAGS, CPPFLAGS and LDFLAGS from, such as `common.mk`. Defaults to None.
+            extra_cflags (list[str], optional): Compile flags to use in addition to the makefile's. Defaults to None.
+            extra_ldflags (list[str], optional): Link flags to use in addition to the makefile's. Defaults to None.
+            map_path (Path, optional): Where the linker writes the map file. Defaults to `mod.map` in `build_dir`.
+            input_paths (list[Path], optional): Other files and directories the build reads, such as include directories and
+                the linker script. Used for up-to-date checks. Defaults to None.
+            pch_headers (list[str], optional): Headers to precompile, as they're written in `#include`. They should have include
+                guards, and not depend on what's included before them. Defaults to None.
+            unity_build (bool, optional): Compile the files in batches, as one generated file per batch. Defaults to False.
+            unity_batch_size (int, optional): How many files to put in each batch of a unity build. Defaults to 8.
+            unity_exclude (list[str], optional): Glob patterns of files (relative to `src_dir`, such as `"legacy/*.c"`) to
+                compile on their own in a unity build. Defaults to None.
+            threads (int, optional): How many files to compile at once when jobs don't run concurrently. 0 means one per CPU. Defaults to 0.
+        """
+        super().__init__()
+        self.src_dir = Path(src_dir)
+        self._elf_path = elf_path
+        self.cc_path = cc_path
+        self.ld_path = ld_path
+        self._build_dir = build_dir
+        self._map_path = map_path
+        self.flags_makefile = flags_makefile
+        self.extra_cflags = extra_cflags or []
+        self.extra_ldflags = extra_ldflags or []
+        self.pch_headers = pch_headers or []
+        self.unity_build = unity_build
+        self.unity_batch_size = max(1, unity_batch_size)
+        self.unity_exclude = unity_exclude or []
+        self.threads = threads
+        self._make_variables = None
+
+        self.add_input_paths([self.src_dir] + ([flags_makefile] if flags_makefile is not None else []) + (input_paths or []))
+        self.add_output_paths([LazyValue(lambda: self.elf_path)])
+
+    # The paths may come from the mod's .toml, which is only read once something needs them.
+    @property
+    def elf_path(self) -> Path:
+        return Path(resolve_lazy(self._elf_path))
+
+    @property
+    def build_dir(self) -> Path:
+        return self.elf_path.parent if self._build_dir is None else Path(resolve_lazy(self._build_dir))
+
+    @property
+    def map_path(self) -> Path:
+        return self.build_dir.joinpath("mod.map") if self._map_path is None else Path(self._map_path)
+
+    # The makefile is only read once something needs the flags.
+    def get_make_variable(self, name: str) -> list[str]:
+        if self.flags_makefile is None:
+            return []
+        if self._make_variables is None:
+            self._make_variables = read_make_variables(self.flags_makefile)
+        return shlex.split(self._make_variables.get(name, ""))
+
+    @property
+    def cflags(self) -> list[str]:
+        return self.get_make_variable("CFLAGS") + self.get_make_variable("CPPFLAGS") + self.extra_cflags
+
+    @property
+    def ldflags(self) -> list[str]:
+        return self.get_make_variable("LDFLAGS") + self.extra_ldflags
+
+    def get_state_path(self) -> Path:
+        """Get the file that records the command each object was compiled with, and the elf's link command."""
+        return self.build_dir.joinpath(f"{self.elf_path.stem}.compile.json")
+
+    def find_sources(self) -> list[Path]:
+        retVal = []
+        for dir_path, dir_names, file_names in os.walk(self.src_dir):
+            dir_names.sort()
+            retVal.extend(Path(dir_path, i) for i in sorted(file_names) if i.endswith(".c"))
+        return retVal
+
+    def get_object_path(self, source: Path) -> Path:
+        return self.build_dir.joinpath(source.relative_to(self.src_dir)).with_suffix(".o")
+
+    def get_translation_units(self, sources: list[Path], write: bool = True) -> list[tuple[Path, Path]]:
+        """Get the files to pass to the compiler, and their objects. Outside of unity builds, these are just the sources.
+
+        In a unity build, this writes the generated batch files (only those whose contents changed, so that unchanged
+        batches aren't recompiled).
+
+        Args:
+            sources (list[Path]): The C files, as returned by `find_sources`.
+            write (bool, optional): Write the batch files. Defaults to True.
+
+        Returns:
+            list[tuple[Path, Path]]: The file and object path of each translation unit.
+        """
+        if not self.unity_build:
+            return [(i, self.get_object_path(i)) for i in sources]
+
+        retVal = []
+        batched = []
+        for source in sources:
+            if matches_globs(source.relative_to(self.src_dir).as_posix(), self.unity_exclude):
+                retVal.append((source, self.get_object_path(source)))
+            else:
+                batched.append(source)
+
+        unity_dir = self.build_dir.joinpath("unity")
+        for batch_index, start in enumerate(range(0, len(batched), self.unity_batch_size)):
+            unity_path = unity_dir.joinpath(f"{self.elf_path.stem}_unity_{batch_index}.c")
+            text = "".join(f'#include "{i.absolute().as_posix()}"\n' for i in batched[start:start + self.unity_batch_size])
+            if write and (not unity_path.exists() or unity_path.read_text() != text):
+                os.makedirs(unity_dir, exist_ok=True)
+                unity_path.write_text(text)
+            retVal.append((unity_path, unity_path.with_suffix(".o")))
+        return retVal
+
+    def get_pch_prefix_path(self) -> Path:
+        """Get the generated header that includes each of `pch_headers`, which the PCH is compiled from."""
+        return self.build_dir.joinpath(f"{self.elf_path.stem}_pch.h")
+
+    def get_pch_path(self) -> Path:
+        return self.build_dir.joinpath(f"{self.elf_path.stem}_pch.h.pch")
+
+    def get_pch_command(self) -> list[str]:
+        pch_path = self.get_pch_path()
+        return [str(self.cc_path)] + self.cflags + ["-x", "c-header", str(self.get_pch_prefix_path()),
+            "-MD", "-MF", str(pch_path.with_suffix(".d")), "-o", str(pch_path)]
+
+    def write_pch_prefix(self):
+        # Only written when it changes, so that its modification time doesn't make the PCH stale.
+        text = "".join(f'#include "{i}"\n' for i in self.pch_headers)
+        path = self.get_pch_prefix_path()
+        if not path.exists() or path.read_text() != text:
+            os.makedirs(path.parent, exist_ok=True)
+            path.write_text(text)
+
+    def get_compile_command(self, source: Path, object_path: Path) -> list[str]:
+        pch_flags = ["-include-pch", str(self.get_pch_path())] if len(self.pch_headers) > 0 else []
+        return [str(self.cc_path)] + self.cflags + pch_flags + \
+            [str(source), "-MD", "-MF", str(object_path.with_suffix(".d")), "-c", "-o", str(object_path)]
+
+    def get_link_command(self, object_paths: list[Path]) -> list[str]:
+        return [str(self.ld_path)] + [str(i) for i in object_paths] + self.ldflags + ["-Map", str(self.map_path), "-o", str(self.elf_path)]
+
+    def get_link_inputs(self, cwd: Path) -> list[Path]:
+        """Get the linker scripts passed in the link flags (`-T <script>`), which the elf has to be relinked after changes to."""
+        ldflags = self.ldflags
+        return [cwd.joinpath(ldflags[i + 1]) for i in range(len(ldflags) - 1) if ldflags[i] == "-T"]
+
+    def is_object_stale(self, cwd: Path, source: Path, object_path: Path, command: list[str], recorded_command: list[str],
+            get_mtime, extra_dependencies: list[Path] = None) -> bool:
+        """Check whether an object needs to be recompiled, from its depfile and the command it was compiled with.
+
+        Args:
+            cwd (Path): The directory the compiler runs in, which relative paths in the depfile are relative to.
+            source (Path): The C file.
+            object_path (Path): Its object file.
+            command (list[str]): The command it would be compiled with now.
+            recorded_command (list[str]): The command it was last compiled with, or None.
+            get_mtime (Callable[[Path], int]): Returns a file's modification time, or None if it doesn't exist. Cached by the caller, since most headers are shared.
+            extra_dependencies (list[Path], optional): Other files the object depends on, such as the PCH. Defaults to None.
+
+        Returns:
+            bool: True if the object is missing or older than its source or any header it included, or the command changed.
+        """
+        if command != recorded_command:
+            return True
+        object_mtime = get_mtime(object_path)
+        depfile_path = object_path.with_suffix(".d")
+        if object_mtime is None or get_mtime(depfile_path) is None:
+            return True
+        for dependency in [str(source)] + parse_depfile(depfile_path) + [str(i) for i in extra_dependencies or []]:
+            mtime = get_mtime(cwd.joinpath(dependency))
+            if mtime is None or mtime > object_mtime:
+                return True
+        return False
+
+    # Override:
+    def get_name(self) -> str:
+        return f"MIPS Compile: {self.elf_path.name}"
+
+    def get_state_key(self) -> str:
+        identity = str(self.src_dir) + str(self.elf_path)
+        return f"mips_compile_{slugify(self.elf_path.stem)}_{hash_string(identity)[:16]}"
+
+    def get_input_fingerprint(self) -> dict[str, str]:
+        retVal = super().get_input_fingerprint()
+        retVal["cc"] = self.state_store.fingerprint_path(self.cc_path)
+        retVal["ld"] = self.state_store.fingerprint_path(self.ld_path)
+        retVal["cflags"] = hash_string(json.dumps(self.cflags + self.pch_headers))
+        retVal["unity"] = hash_string(json.dumps([self.unity_build, self.unity_batch_size, self.unity_exclude]))
+        retVal["ldflags"] = hash_string(json.dumps(self.ldflags))
+        return retVal
+
+    def needs_to_run(self, c: Context) -> bool:
+        if self.is_up_to_date():
+            print_job_header(f"MIPS Compile Job: {self.elf_path} is up to date.")
+            return False
+        return True
+
+    def run(self, c: Context):
+        print_job_header(f"MIPS Compile Job: {self.elf_path}")
+        cwd = Path(c.cwd)
+        echo: bool = c.config['run']['echo']
+        dry: bool = c.config['run']['dry']
+
+        try:
+            state = json.loads(self.get_state_path().read_text())
+        except (OSError, ValueError):
+            state = {}
+        recorded: dict[str, list[str]] = state.get("objects", {})
+
+        mtimes: dict[Path, int] = {}
+        def get_mtime(path: Path) -> int:
+            if path not in mtimes:
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtimes[path] = None
+            return mtimes[path]
+
+        extra_dependencies = []
+        if len(self.pch_headers) > 0:
+            if not dry:
+                self.write_pch_prefix()
+            pch_path = self.get_pch_path()
+            pch_command = self.get_pch_command()
+            if self.is_object_stale(cwd, self.get_pch_prefix_path(), pch_path, pch_command, state.get("pch"), get_mtime):
+                if dry:
+                    print_fl(f"Would precompile {', '.join(self.pch_headers)}")
+                else:
+                    self.compile_pch(cwd, pch_command, echo)
+                    state["pch"] = pch_command
+                    mtimes.pop(pch_path, None)
+            extra_dependencies.append(pch_path)
+
+        sources = self.find_sources()
+        units = self.get_translation_units(sources, not dry)
+        object_paths = [i[1] for i in units]
+        stale = []
+        for source, object_path in units:
+            command = self.get_compile_command(source, object_path)
+            if self.is_object_stale(cwd, source, object_path, command, recorded.get(str(object_path)), get_mtime, extra_dependencies):
+                stale.append((source, object_path, command))
+
+        if dry:
+            for source, object_path, command in stale:
+                print_fl(f"Would compile {source}")
+            return
+
+        failed = self.compile_many(c, cwd, stale, recorded, echo)
+        # Objects that compiled are recorded even if others failed, so that they aren't compiled again.
+        state["objects"] = recorded
+        if len(failed) > 0:
+            self.write_state(state)
+            print_error(f"FATAL! {len(failed)} file(s) failed to compile: {', '.join(str(i) for i in failed)}. Aborting...")
+            sys.exit(1)
+        if self.unity_build:
+            print_fl(f"Compiled {len(stale)} of {len(units)} translation unit(s), from {len(sources)} file(s).")
+        else:
+            print_fl(f"Compiled {len(stale)} of {len(sources)} file(s).")
+
+        link_command = self.get_link_command(object_paths)
+        elf_mtime = get_mtime(self.elf_path)
+        needs_link = len(stale) > 0 or elf_mtime is None or state.get("link") != link_command or \
+            any((get_mtime(i) or 0) > elf_mtime for i in self.get_link_inputs(cwd))
+        if needs_link:
+            print_fl(f"Linking {self.elf_path.name}")
+            if echo:
+                print_fl(shlex.join(link_command))
+            os.makedirs(self.elf_path.parent, exist_ok=True)
+            result = subprocess.run(link_command, cwd=cwd)
+            if result.returncode != 0:
+                state.pop("link", None)
+                self.write_state(state)
+                print_error(f"FATAL! Linking '{self.elf_path}' failed with exit status {result.returncode}. Aborting...")
+                sys.exit(1)
+            state["link"] = link_command
+        self.write_state(state)
+
+    def compile_pch(self, cwd: Path, command: list[str], echo: bool):
+        print_fl(f"Precompiling {', '.join(self.pch_headers)}")
+        if echo:
+            print_fl(shlex.join(command))
+        os.makedirs(self.build_dir, exist_ok=True)
+        result = subprocess.run(command, cwd=cwd)
+        if result.returncode != 0:
+            print_error(f"FATAL! Precompiling '{self.get_pch_prefix_path()}' failed with exit status {result.returncode}. Aborting...")
+            sys.exit(1)
+
+    def compile_many(self, c: Context, cwd: Path, units: list[tuple[Path, Path, list[str]]], recorded: dict[str, list[str]],
+            echo: bool) -> list[Path]:
+        """Compile translation units in parallel, printing each one's compiler output once it finishes.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+            cwd (Path): The directory to run the compiler in.
+            units (list[tuple[Path, Path, list[str]]]): The source, object path and compile command of each unit.
+            recorded (dict[str, list[str]]): The recorded compile commands, by object path. Updated for each unit that compiles.
+            echo (bool): Print each compile command.
+
+        Returns:
+            list[Path]: The sources that failed to compile. Once one fails, units that haven't started are skipped and counted as failed.
+        """
+        if len(units) == 0:
+            return []
+
+        # When jobs run concurrently, this job already holds one jobserver slot, and each compile beyond the first takes another.
+        resources = get_job_resources(c)
+        if resources is not None:
+            workers = resources.jobserver.jobs
+        else:
+            workers = self.threads if self.threads > 0 else os.cpu_count() or 1
+        own_slot = threading.Lock()
+        output_lock = threading.Lock()
+        failed: list[Path] = []
+
+        def compile_unit(unit: tuple[Path, Path, list[str]]):
+            source, object_path, command = unit
+            if len(failed) > 0:
+                failed.append(source)
+                return
+
+            token = None
+            extra_slot = resources is not None and not own_slot.acquire(blocking=False)
+            if extra_slot:
+                token = resources.jobserver.acquire()
+            try:
+                os.makedirs(object_path.parent, exist_ok=True)
+                result = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            finally:
+                if extra_slot:
+                    resources.jobserver.release(token)
+                elif resources is not None:
+                    own_slot.release()
+
+            with output_lock:
+                print_fl(f"Compiling {source}")
+                if echo:
+                    print_fl(shlex.join(command))
+                if len(result.stdout) > 0:
+                    print_fl(result.stdout.decode(errors="replace").rstrip())
+                if result.returncode == 0:
+                    recorded[str(object_path)] = command
+                else:
+                    recorded.pop(str(object_path), None)
+                    failed.append(source)
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(units)), thread_name_prefix="compile") as executor:
+            for _ in executor.map(compile_unit, units):
+                pass
+        return failed
+
+    def write_state(self, state: dict):
+        os.makedirs(self.build_dir, exist_ok=True)
+        self.get_state_path().write_text(json.dumps(state, indent=1))
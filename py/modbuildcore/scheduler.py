@@ -0,0 +1,203 @@
+import os, sys
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from invoke import Context
+from .jobserver import JobResources, get_max_workers, get_job_resources
+from .utils import print_error, print_job_header
+
+class JobScheduler:
+    """Resolves a set of root jobs and all of their dependencies as a DAG.
+
+    Resolution happens in two passes. First, the dependency graph is walked from the root jobs, calling `needs_to_run`
+    on each job once (jobs that don't need to run are resolved immediately, and their dependencies are not visited,
+    matching the serial behavior of `JobBase.resolve`). Then, the jobs that do need to run are executed in topological
+    order on a thread pool, so that independent jobs (such as downloads and CMake builds) overlap.
+
+    While running concurrently, each job holds a slot of its `resource_class` from the shared `JobResources`. CPU-bound
+    jobs take jobserver tokens, which are shared with the make and ninja processes they spawn.
+
+    If any job fails, no further jobs are started, queued jobs are cancelled, and the failure is re-raised once the
+    jobs that are already running finish.
+    """
+    c: Context
+    max_workers: int
+    resources: JobResources
+
+    def __init__(self, c: Context, max_workers: int = None):
+        """Initializes the JobScheduler.
+
+        Args:
+            c (Context): The pyinvoke Context from the current task invokation.
+            max_workers (int, optional): The number of jobs to run at once. If None, reads the value from the invoke config. Defaults to None.
+        """
+        self.c = c
+        self.max_workers = get_max_workers(c) if max_workers is None else max(1, max_workers)
+        self.resources = get_job_resources(c) if self.max_workers > 1 else None
+
+    def resolve(self, jobs: list, skip_dependencies: bool = False, restrict_to: set = None):
+        """Resolve the given jobs, and their dependencies unless `skip_dependencies` is set.
+
+        Args:
+            jobs (list[JobBase]): The root jobs to resolve.
+            skip_dependencies (bool, optional): If True, skip handling dependency jobs. Defaults to False.
+            restrict_to (set[JobBase], optional): If set, jobs outside of this set are left alone (neither run nor marked as resolved). Defaults to None.
+        """
+        run_order, dependencies = self.plan(jobs, skip_dependencies, restrict_to)
+
+        if self.max_workers <= 1 or len(run_order) <= 1:
+            for job in run_order:
+                self.run_job(job)
+                self.mark_resolved(job)
+        else:
+            self.execute(run_order, dependencies)
+
+    def plan(self, jobs: list, skip_dependencies: bool = False, restrict_to: set = None) -> tuple[list, dict]:
+        """Walk the dependency graph and determine which jobs need to run.
+
+        Jobs that don't need to run are marked as resolved during this pass.
+
+        Args:
+            jobs (list[JobBase]): The root jobs to resolve.
+            skip_dependencies (bool, optional): If True, only the root jobs are considered. Defaults to False.
+            restrict_to (set[JobBase], optional): If set, jobs outside of this set are skipped entirely. Defaults to None.
+
+        Returns:
+            tuple[list[JobBase], dict[JobBase, list[JobBase]]]: The jobs to run, in an order where dependencies always come
+            before their dependents, and a mapping of each of those jobs to the dependencies it must wait on.
+        """
+        run_order = []
+        dependencies = {}
+        checked = set()
+        visiting = []
+
+        def visit(job) -> bool:
+            # Returns True if the job will be run as part of this plan.
+            if job in visiting:
+                cycle = " -> ".join(type(i).__name__ for i in visiting[visiting.index(job):] + [job])
+                print_error(f"FATAL! Dependency cycle detected: {cycle}. Aborting...")
+                sys.exit(1)
+            if job in checked:
+                return job in dependencies
+            checked.add(job)
+
+            if restrict_to is not None and job not in restrict_to:
+                return False
+            if job.no_duplication and job._has_been_resolved:
+                return False
+
+            with job.timer.measure(job.get_name(), "check", job.get_timing_key()):
+                needs_to_run = job.needs_to_run(self.c)
+            if not needs_to_run:
+                self.mark_resolved(job)
+                return False
+
+            visiting.append(job)
+            job_deps = []
+            if not skip_dependencies:
+                for i in job.dependencies:
+                    if visit(i):
+                        job_deps.append(i)
+            visiting.pop()
+
+            dependencies[job] = job_deps
+            run_order.append(job)
+            return True
+
+        for job in jobs:
+            visit(job)
+
+        return run_order, dependencies
+
+    def execute(self, run_order: list, dependencies: dict):
+        """Run the planned jobs on a thread pool, starting each job as soon as all of its dependencies have finished.
+
+        Args:
+            run_order (list[JobBase]): The jobs to run, in topological order.
+            dependencies (dict[JobBase, list[JobBase]]): The planned dependencies of each job.
+        """
+        waiting_on = {job: set(deps) for job, deps in dependencies.items()}
+        dependents = {job: [] for job in run_order}
+        for job, deps in dependencies.items():
+            for i in deps:
+                dependents[i].append(job)
+
+        ready = [job for job in run_order if not waiting_on[job]]
+        running: dict[Future, object] = {}
+        failure: BaseException = None
+
+        # Network-bound jobs don't take CPU slots, so leave room for them to run alongside a full set of CPU-bound jobs.
+        pool_size = self.max_workers
+        if self.resources is not None:
+            pool_size += self.resources.network_jobs
+
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="modbuild") as pool:
+            while ready or running:
+                while ready:
+                    job = ready.pop(0)
+                    running[pool.submit(self.run_job, job)] = job
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    if future.cancelled():
+                        continue
+
+                    exc = future.exception()
+                    if exc is not None:
+                        if failure is None:
+                            failure = exc
+                            for i in running:
+                                i.cancel()
+                        continue
+
+                    self.mark_resolved(job)
+                    if failure is None:
+                        for i in dependents[job]:
+                            waiting_on[i].discard(job)
+                            if not waiting_on[i]:
+                                ready.append(i)
+
+        if failure is not None:
+            raise failure
+
+    def run_job(self, job):
+        """Run a single job. Executed on a worker thread when running concurrently.
+
+        Args:
+            job (JobBase): The job to run.
+        """
+        if self.resources is not None:
+            with self.resources.acquire(job.resource_class):
+                self._run_job(job)
+        else:
+            self._run_job(job)
+
+    def _run_job(self, job):
+        # Only the "run" phase goes into the timing history that `graph` uses, so restoring from the cache and saving
+        # state are timed separately, and don't make the job look faster or slower than it is.
+        if job.cacheable and job.artifact_cache is not None:
+            with job.timer.measure(job.get_name(), "restore", job.get_timing_key()):
+                restored = job.restore_from_cache(self.c)
+            if restored:
+                print_job_header(f"{job.get_name()} restored from the artifact cache.")
+                with job.timer.measure(job.get_name(), "save", job.get_timing_key()):
+                    job.save_state(self.c)
+                return
+
+        with job.timer.measure(job.get_name(), "run", job.get_timing_key()):
+            succeeded = job.run(self.c) is not False
+        # A failed run's outputs may be partial, so it mustn't look up to date next time, or be shared through the cache.
+        if not succeeded:
+            return
+        with job.timer.measure(job.get_name(), "save", job.get_timing_key()):
+            job.save_to_cache(self.c)
+            job.save_state(self.c)
+
+    def mark_resolved(self, job):
+        """Record that a job has been resolved. Always called from the thread that owns the scheduler.
+
+        Args:
+            job (JobBase): The job that was resolved.
+        """
+        job._has_been_resolved = True
+        job._resolved_jobs.append(job)
@@ -0,0 +1,307 @@
+import os, sys, json, socket, struct, traceback
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+from .utils import print_error, print_task_header
+
+# Messages between the client and the server are framed as a 1-byte kind, a 4-byte big-endian length, and the payload:
+#   b"r": (client -> server) The request, as JSON: {"argv": [...], "cwd": "...", "env": {...}}
+#   b"o": (server -> client) A chunk of combined stdout/stderr output.
+#   b"x": (server -> client) The exit code of the invokation, as a 4-byte big-endian signed int. Always the last frame.
+# `modbuild.py` has its own copy of the client side, so that it doesn't need to import anything to use the server.
+FRAME_HEADER = struct.Struct("!cI")
+
+def send_frame(sock: socket.socket, kind: bytes, payload: bytes):
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    retVal = b""
+    while len(retVal) < size:
+        chunk = sock.recv(size - len(retVal))
+        if len(chunk) == 0:
+            raise ConnectionError("Connection closed before a complete frame was received.")
+        retVal += chunk
+    return retVal
+
+def recv_frame(sock: socket.socket) -> tuple[bytes, bytes]:
+    kind, size = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    return kind, recv_exact(sock, size)
+
+def is_supported() -> bool:
+    return hasattr(os, "fork") and hasattr(socket, "AF_UNIX")
+
+
+class EnvironReadRecorder(MutableMapping):
+    """Stands in for `os.environ`, and records which variables are read through it. Writes go to the real environment."""
+    environ: MutableMapping
+    keys_read: set[str]
+    read_all: bool
+
+    def __init__(self, environ: MutableMapping):
+        self.environ = environ
+        self.keys_read = set()
+        self.read_all = False
+
+    def __getitem__(self, key: str) -> str:
+        self.keys_read.add(key)
+        return self.environ[key]
+
+    def __contains__(self, key: object) -> bool:
+        self.keys_read.add(key)
+        return key in self.environ
+
+    def __setitem__(self, key: str, value: str):
+        self.environ[key] = value
+
+    def __delitem__(self, key: str):
+        del self.environ[key]
+
+    def __iter__(self) -> Iterator[str]:
+        # Anything that walks the environment (such as copying it for a subprocess) can depend on all of it.
+        self.read_all = True
+        return iter(self.environ)
+
+    def __len__(self) -> int:
+        return len(self.environ)
+
+    def copy(self) -> dict[str, str]:
+        self.read_all = True
+        return self.environ.copy()
+
+    def is_stale(self, loaded_env: dict[str, str], env: dict[str, str]) -> bool:
+        """Checks whether anything that was read would have a different value in another environment.
+
+        Args:
+            loaded_env (dict[str, str]): The environment when the reads were recorded.
+            env (dict[str, str]): The environment to compare against.
+
+        Returns:
+            bool: True if any of the variables that were read differ between the two environments.
+        """
+        if self.read_all:
+            return loaded_env != env
+        return any(loaded_env.get(i) != env.get(i) for i in self.keys_read)
+
+@contextmanager
+def record_environ_reads() -> Iterator[EnvironReadRecorder]:
+    """Replaces `os.environ` with an `EnvironReadRecorder` for the duration of the context."""
+    environ = os.environ
+    recorder = EnvironReadRecorder(environ)
+    os.environ = recorder
+    try:
+        yield recorder
+    finally:
+        os.environ = environ
+
+
+class ModBuildServer:
+    """A resident server that keeps the tasks, `project.py` and its jobs loaded between invokations of `modbuild.py`.
+
+    Each request is handled in a forked copy of the server, so every invokation starts from the same warm (and unresolved)
+    state, and can't leave changes behind. The output of the invokation, including that of any subprocesses, is streamed
+    back to the client.
+
+    Before each request, the server checks whether any of the files it loaded have changed since they were loaded, and
+    reloads them if so. The environmental variables read while loading the project are recorded too. If the client's
+    environment has different values for any of them, the forked copy reloads the project with the client's environment
+    before running the invokation, so that it matches running `modbuild.py` locally.
+
+    Only available on platforms with `os.fork` and Unix sockets.
+    """
+    socket_path: Path
+    run_argv: Callable[[list[str]], int]
+    get_watched_files: Callable[[], list[Path]]
+    reload: Callable[[], None]
+    prepare: Callable[[], None]
+    _watched_mtimes: dict[Path, int]
+    _loaded_env: dict[str, str]
+    _environ_reads: EnvironReadRecorder
+    _handlers: set[int]
+
+    def __init__(self, socket_path: Path, run_argv: Callable[[list[str]], int], *,
+            get_watched_files: Callable[[], list[Path]] = None, reload: Callable[[], None] = None, prepare: Callable[[], None] = None):
+        """Initializes the ModBuildServer.
+
+        Args:
+            socket_path (Path): The Unix socket to listen on.
+            run_argv (Callable[[list[str]], int]): Runs a single invokation for the given argv, and returns the exit code.
+            get_watched_files (Callable[[], list[Path]], optional): Returns the files that, if changed, require the server to reload. Defaults to None.
+            reload (Callable[[], None], optional): Reloads the project. Required if `get_watched_files` is set. Defaults to None.
+            prepare (Callable[[], None], optional): Called before each request is forked, to refresh any state the request should inherit (such as caches). Defaults to None.
+        """
+        self.socket_path = socket_path
+        self.run_argv = run_argv
+        self.get_watched_files = get_watched_files
+        self.reload = reload
+        self.prepare = prepare
+        self._handlers = set()
+        # The project may already have been imported before the server was created, without its environmental reads being
+        # recorded, so it's loaded again here.
+        self.load(self.get_watched_mtimes if self.reload is None else self.reload)
+
+    def load(self, loader: Callable[[], object]):
+        """Runs `loader`, and records the files it loaded along with the environmental variables it read.
+
+        Args:
+            loader (Callable[[], object]): Loads (or reloads) the project.
+        """
+        self._loaded_env = dict(os.environ)
+        with record_environ_reads() as self._environ_reads:
+            loader()
+            self._watched_mtimes = self.get_watched_mtimes()
+
+    def get_watched_mtimes(self) -> dict[Path, int]:
+        retVal = {}
+        if self.get_watched_files is None:
+            return retVal
+        for i in self.get_watched_files():
+            try:
+                retVal[Path(i)] = os.stat(i).st_mtime_ns
+            except OSError:
+                retVal[Path(i)] = None
+        return retVal
+
+    def reload_if_stale(self):
+        if self.get_watched_files is None or self.get_watched_mtimes() == self._watched_mtimes:
+            return
+        print_task_header("Project files changed. Reloading...")
+        self.load(self.reload)
+
+    def serve_forever(self) -> int:
+        """Listen for and handle requests until interrupted.
+
+        Returns:
+            int: The exit code for the server process.
+        """
+        if not is_supported():
+            print_error("FATAL! The modbuild server requires os.fork and Unix sockets, which aren't available on this platform.")
+            return 1
+
+        os.makedirs(self.socket_path.parent, exist_ok=True)
+        if self.socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self.socket_path))
+                print_error(f"FATAL! A modbuild server is already listening on '{self.socket_path}'.")
+                return 1
+            except OSError:
+                # Left over from a server that didn't shut down cleanly.
+                self.socket_path.unlink()
+            finally:
+                probe.close()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Anyone who can connect can run builds with any environment, so only this user may.
+        umask = os.umask(0o077)
+        try:
+            listener.bind(str(self.socket_path))
+        finally:
+            os.umask(umask)
+        listener.listen()
+        listener.settimeout(1.0)
+        print_task_header(f"Modbuild server listening on '{self.socket_path}'. Press Ctrl+C to stop.")
+
+        try:
+            while True:
+                self._reap_handlers()
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+
+                conn.settimeout(None)
+                self.reload_if_stale()
+                if self.prepare is not None:
+                    self.prepare()
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+                pid = os.fork()
+                if pid == 0:
+                    listener.close()
+                    code = 1
+                    try:
+                        code = self.handle(conn)
+                    finally:
+                        os._exit(code)
+
+                self._handlers.add(pid)
+                conn.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            self.socket_path.unlink(missing_ok=True)
+
+        return 0
+
+    def handle(self, conn: socket.socket) -> int:
+        """Handle a single request. Runs in a forked handler process, which forks again to run the invokation
+        with its stdout and stderr connected to a pipe, and forwards that pipe to the client.
+
+        Args:
+            conn (socket.socket): The connection to the client.
+
+        Returns:
+            int: The exit code for the handler process.
+        """
+        kind, payload = recv_frame(conn)
+        if kind != b"r":
+            return 1
+        request = json.loads(payload)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                conn.close()
+                os.close(read_fd)
+                devnull = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(devnull, 0)
+                os.dup2(write_fd, 1)
+                os.dup2(write_fd, 2)
+                os.close(devnull)
+                os.close(write_fd)
+
+                os.chdir(request["cwd"])
+                os.environ.clear()
+                os.environ.update(request["env"])
+                if self.reload is not None and self._environ_reads.is_stale(self._loaded_env, request["env"]):
+                    self.reload()
+                code = self.run_argv(request["argv"])
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        os.close(write_fd)
+        client_connected = True
+        while chunk := os.read(read_fd, 64 * 1024):
+            if not client_connected:
+                continue
+            try:
+                send_frame(conn, b"o", chunk)
+            except OSError:
+                # The client went away. Keep draining the output so the invokation can finish anyway.
+                client_connected = False
+        os.close(read_fd)
+
+        _, status = os.waitpid(pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+        try:
+            send_frame(conn, b"x", struct.pack("!i", code))
+        except OSError:
+            pass
+        conn.close()
+        return 0
+
+    def _reap_handlers(self):
+        for pid in list(self._handlers):
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done != 0:
+                self._handlers.discard(pid)
@@ -0,0 +1,210 @@
+import os, json, hashlib, threading
+from pathlib import Path
+
+HASH_CHUNK_SIZE = 1024 * 1024
+MISSING_DIGEST = "missing"
+
+def hash_string(text: str) -> str:
+    """Returns the sha256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class JobStateStore:
+    """A persistent, per-job record of input and output fingerprints, stored as JSON files in a state directory.
+
+    Jobs that support up-to-date checks (see `JobBase.get_state_key`) save a record after every successful run,
+    and compare against it the next time they're resolved. If neither the inputs nor the outputs have changed,
+    the job doesn't need to run.
+
+    File contents are hashed with sha256. To avoid re-reading large files (such as toolchain binaries) on every
+    invokation, digests are cached alongside the file's size and modification time, and only recomputed when those change.
+
+    To enable up-to-date checks for a project, assign an instance to `JobBase.state_store` in `project.py`.
+    """
+    state_dir: Path
+    _file_hashes: dict[str, list]
+    _file_hashes_dirty: bool
+    _lock: threading.RLock
+
+    def __init__(self, state_dir: Path):
+        """Initializes the JobStateStore.
+
+        Args:
+            state_dir (Path): The directory to store job records and the file hash cache in. Created when first written to.
+        """
+        self.state_dir = state_dir
+        self._file_hashes = None
+        self._file_hashes_dirty = False
+        self._lock = threading.RLock()
+
+    def get_record_path(self, key: str) -> Path:
+        return self.state_dir.joinpath(f"{key}.json")
+
+    def get_file_hashes_path(self) -> Path:
+        return self.state_dir.joinpath("file_hashes.json")
+
+    def get_timing_history_path(self) -> Path:
+        return self.state_dir.joinpath("timing_history.json")
+
+    def load(self, key: str) -> dict:
+        """Load the record saved for a job.
+
+        Args:
+            key (str): The job's state key.
+
+        Returns:
+            dict: The saved record, or None if no (readable) record exists.
+        """
+        try:
+            return json.loads(self.get_record_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: str, record: dict):
+        """Save the record for a job, replacing any previous record.
+
+        Args:
+            key (str): The job's state key.
+            record (dict): The record to save. Must be JSON serializable.
+        """
+        with self._lock:
+            self._write_json(self.get_record_path(key), record)
+            self.flush()
+
+    def discard(self, key: str):
+        """Delete the saved record for a job, so that it will be considered out of date.
+
+        Args:
+            key (str): The job's state key.
+        """
+        with self._lock:
+            self.get_record_path(key).unlink(missing_ok=True)
+
+    def flush(self):
+        """Write the file hash cache to disk, if it has changed."""
+        with self._lock:
+            if self._file_hashes_dirty:
+                self._write_json(self.get_file_hashes_path(), self._file_hashes)
+                self._file_hashes_dirty = False
+
+    def load_timing_history(self) -> dict[str, dict]:
+        """Load the recorded run durations of jobs from previous invokations.
+
+        Returns:
+            dict[str, dict]: A dict mapping job timing keys (see `JobBase.get_timing_key`) to their history: the `last` and `average` run time in seconds, and the number of `runs`.
+        """
+        try:
+            return json.loads(self.get_timing_history_path().read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def record_timings(self, timings: list):
+        """Add the run durations from this invokation to the timing history.
+
+        Args:
+            timings (list[JobTiming]): The "run" phase timings recorded by a BuildTimer.
+        """
+        if len(timings) == 0:
+            return
+
+        with self._lock:
+            history = self.load_timing_history()
+            for i in timings:
+                entry = history.setdefault(i.key, {"last": 0.0, "average": 0.0, "runs": 0})
+                entry["last"] = i.wall
+                entry["average"] = (entry["average"] * entry["runs"] + i.wall) / (entry["runs"] + 1)
+                entry["runs"] += 1
+            self._write_json(self.get_timing_history_path(), history)
+
+    def refresh(self):
+        """Re-read the file hash cache from disk, picking up hashes saved by other processes. Unsaved hashes are discarded."""
+        with self._lock:
+            self._file_hashes = None
+            self._file_hashes_dirty = False
+            self._get_file_hashes()
+
+    def hash_file(self, path: Path) -> str:
+        """Get the sha256 digest of a file's contents, using the cached digest if the file's size and mtime are unchanged.
+
+        Args:
+            path (Path): The file to hash.
+
+        Returns:
+            str: The hex digest, or `MISSING_DIGEST` if the file doesn't exist.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return MISSING_DIGEST
+
+        key = str(Path(path).absolute())
+        with self._lock:
+            cached = self._get_file_hashes().get(key)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+        with self._lock:
+            self._get_file_hashes()[key] = [st.st_size, st.st_mtime_ns, digest]
+            self._file_hashes_dirty = True
+        return digest
+
+    def fingerprint_path(self, path: Path) -> str:
+        """Get a digest representing a file or an entire directory tree.
+
+        Directory digests cover the relative path and content of every file in the tree.
+
+        Args:
+            path (Path): The file or directory to fingerprint.
+
+        Returns:
+            str: The hex digest, or `MISSING_DIGEST` if the path doesn't exist.
+        """
+        if path is None:
+            return MISSING_DIGEST
+        path = Path(path)
+        if path.is_file():
+            return self.hash_file(path)
+        if not path.is_dir():
+            return MISSING_DIGEST
+
+        hasher = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                file_path = Path(dirpath, name)
+                hasher.update(file_path.relative_to(path).as_posix().encode("utf-8"))
+                hasher.update(b"\0")
+                hasher.update(self.hash_file(file_path).encode("ascii"))
+                hasher.update(b"\n")
+        return hasher.hexdigest()
+
+    def fingerprint_paths(self, paths: list[Path]) -> dict[str, str]:
+        """Fingerprint several files and/or directories.
+
+        Args:
+            paths (list[Path]): The paths to fingerprint.
+
+        Returns:
+            dict[str, str]: A dict mapping each path (as a string) to its digest.
+        """
+        return {str(i): self.fingerprint_path(i) for i in paths}
+
+    def _get_file_hashes(self) -> dict[str, list]:
+        if self._file_hashes is None:
+            try:
+                self._file_hashes = json.loads(self.get_file_hashes_path().read_text())
+            except (OSError, ValueError):
+                self._file_hashes = {}
+        return self._file_hashes
+
+    def _write_json(self, path: Path, data):
+        os.makedirs(path.parent, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps(data, indent=1, sort_keys=True))
+        os.replace(temp_path, path)
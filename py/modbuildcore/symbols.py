@@ -0,0 +1,354 @@
+import os, mmap, struct, tomllib, threading
+from pathlib import Path
+
+from invoke import Context
+from .job_base import JobBase
+from .state import hash_string
+from .utils import LazyValue, resolve_lazy, print_job_header, print_fl, slugify
+
+INDEX_MAGIC = b"MBSYMIDX"
+INDEX_VERSION = 1
+# magic, version, section count, symbol count, and the offsets of the section table, the symbols (sorted by address),
+# the name order (indices into the symbols, sorted by name) and the string table.
+_HEADER = struct.Struct("<8s7I")
+# rom, vram, size, name offset, name length, flags
+_SECTION = struct.Struct("<3IIHH")
+# vram, size, name offset, name length, section index, kind
+_SYMBOL = struct.Struct("<IIIHHB3x")
+_NAME_ORDER = struct.Struct("<I")
+
+SECTION_RELOCATABLE = 1
+KIND_FUNCTION = 0
+KIND_DATA = 1
+KIND_NAMES = {KIND_FUNCTION: "function", KIND_DATA: "data"}
+# How many symbols before an address are checked for one that contains it.
+ADDRESS_LOOKBACK = 64
+
+
+class SymbolSection:
+    """A section from the reference symbol files."""
+    name: str
+    rom: int
+    vram: int
+    size: int
+    relocatable: bool
+
+    def __init__(self, name: str, rom: int, vram: int, size: int, relocatable: bool):
+        self.name = name
+        self.rom = rom
+        self.vram = vram
+        self.size = size
+        self.relocatable = relocatable
+
+
+class Symbol:
+    """A function or data symbol from the reference symbol files."""
+    name: str
+    vram: int
+    size: int
+    kind: str
+    section: SymbolSection
+
+    def __init__(self, name: str, vram: int, size: int, kind: str, section: SymbolSection):
+        self.name = name
+        self.vram = vram
+        self.size = size
+        self.kind = kind
+        self.section = section
+
+    @property
+    def rom(self) -> int:
+        """The symbol's ROM address, or None if its section isn't in ROM."""
+        if self.section.rom == 0 and self.section.vram != 0:
+            return None
+        return self.section.rom + self.vram - self.section.vram
+
+    def __repr__(self) -> str:
+        return f"Symbol({self.name!r}, 0x{self.vram:08X}, size=0x{self.size:X}, {self.kind}, {self.section.name!r})"
+
+
+def read_overlay_sections(path: Path) -> set[str]:
+    """Read the names of the relocatable (overlay) sections from a list like `overlays.us.rev1.txt`, one per line."""
+    return {i.strip() for i in Path(path).read_text().splitlines() if len(i.strip()) > 0}
+
+def build_symbol_index(syms_paths: list[Path], index_path: Path, overlays_path: Path = None) -> int:
+    """Compile reference symbol files (N64Recomp's `.syms.toml` / `.datasyms.toml` format) into a binary index for `SymbolIndex`.
+
+    Args:
+        syms_paths (list[Path]): The symbol files. Each has `[[section]]` tables with a `functions` and/or `symbols` list.
+        index_path (Path): Where to write the index. It's replaced atomically.
+        overlays_path (Path, optional): A list of the relocatable sections, such as `overlays.us.rev1.txt`. Defaults to None.
+
+    Returns:
+        int: The number of symbols in the index.
+    """
+    overlays = set() if overlays_path is None else read_overlay_sections(overlays_path)
+
+    strings = bytearray()
+    string_offsets: dict[str, tuple[int, int]] = {}
+    def add_string(text: str) -> tuple[int, int]:
+        if text not in string_offsets:
+            encoded = text.encode("utf-8")
+            string_offsets[text] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return string_offsets[text]
+
+    # Functions and data for the same section come from different files, so sections are merged by name.
+    sections: dict[str, list] = {}
+    symbols: list[tuple] = []
+    for path in syms_paths:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+        for section in data.get("section", []):
+            name = section["name"]
+            if name not in sections:
+                flags = SECTION_RELOCATABLE if name in overlays else 0
+                sections[name] = [section.get("rom", 0), section.get("vram", 0), section.get("size", 0), flags, len(sections)]
+            else:
+                entry = sections[name]
+                for i, key in enumerate(("rom", "vram", "size")):
+                    entry[i] = entry[i] or section.get(key, 0)
+            section_index = sections[name][4]
+            for kind, key in ((KIND_FUNCTION, "functions"), (KIND_DATA, "symbols")):
+                for symbol in section.get(key, []):
+                    symbols.append((symbol["vram"], symbol.get("size", 0), symbol["name"], section_index, kind))
+
+    symbols.sort(key=lambda i: (i[0], i[3], i[2]))
+    name_order = sorted(range(len(symbols)), key=lambda i: symbols[i][2].encode("utf-8"))
+
+    body = bytearray()
+    for name, (rom, vram, size, flags, _) in sections.items():
+        name_offset, name_length = add_string(name)
+        body.extend(_SECTION.pack(rom, vram, size, name_offset, name_length, flags))
+    symbols_offset = _HEADER.size + len(body)
+    for vram, size, name, section_index, kind in symbols:
+        name_offset, name_length = add_string(name)
+        body.extend(_SYMBOL.pack(vram, size, name_offset, name_length, section_index, kind))
+    name_order_offset = _HEADER.size + len(body)
+    for i in name_order:
+        body.extend(_NAME_ORDER.pack(i))
+    strings_offset = _HEADER.size + len(body)
+
+    header = _HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(sections), len(symbols),
+        _HEADER.size, symbols_offset, name_order_offset, strings_offset)
+
+    index_path = Path(index_path)
+    os.makedirs(index_path.parent, exist_ok=True)
+    temp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.write(strings)
+    os.replace(temp_path, index_path)
+    return len(symbols)
+
+
+class SymbolIndex:
+    """Fast lookups in a symbol index built by `build_symbol_index` (or a `SymbolIndexJob`).
+
+    The index is memory-mapped, so opening it doesn't read it, and each lookup is a binary search that only touches the
+    records it compares against. Name lookups and address lookups are both O(log n). Use as a context manager, or call `close`.
+    """
+    path: Path
+    sections: list[SymbolSection]
+    symbol_count: int
+    _file: object
+    _map: mmap.mmap
+    _symbols_offset: int
+    _name_order_offset: int
+    _strings_offset: int
+
+    def __init__(self, path: Path):
+        """Opens the SymbolIndex.
+
+        Args:
+            path (Path): The index file.
+
+        Raises:
+            ValueError: If the file isn't a symbol index of a supported version.
+        """
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+
+        magic, version, section_count, self.symbol_count, sections_offset, self._symbols_offset, \
+            self._name_order_offset, self._strings_offset = _HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"'{self.path}' isn't a version {INDEX_VERSION} symbol index. Rebuild it with `./modbuild.py symindex`.")
+
+        self.sections = []
+        for i in range(section_count):
+            rom, vram, size, name_offset, name_length, flags = _SECTION.unpack_from(self._map, sections_offset + i * _SECTION.size)
+            self.sections.append(SymbolSection(self._get_string(name_offset, name_length), rom, vram, size, bool(flags & SECTION_RELOCATABLE)))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "SymbolIndex":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    def _get_name_bytes(self, index: int) -> bytes:
+        _, _, name_offset, name_length, _, _ = _SYMBOL.unpack_from(self._map, self._symbols_offset + index * _SYMBOL.size)
+        start = self._strings_offset + name_offset
+        return self._map[start:start + name_length]
+
+    def _get_vram(self, index: int) -> int:
+        return struct.unpack_from("<I", self._map, self._symbols_offset + index * _SYMBOL.size)[0]
+
+    def _get_name_order(self, position: int) -> int:
+        return _NAME_ORDER.unpack_from(self._map, self._name_order_offset + position * _NAME_ORDER.size)[0]
+
+    def get_symbol(self, index: int) -> Symbol:
+        """Get a symbol by its position in address order."""
+        vram, size, name_offset, name_length, section_index, kind = _SYMBOL.unpack_from(self._map, self._symbols_offset + index * _SYMBOL.size)
+        return Symbol(self._get_string(name_offset, name_length), vram, size, KIND_NAMES.get(kind, "unknown"), self.sections[section_index])
+
+    def get_section(self, name: str) -> SymbolSection:
+        """Get a section by name, or None if there isn't one."""
+        for i in self.sections:
+            if i.name == name:
+                return i
+        return None
+
+    def find_by_name(self, name: str) -> list[Symbol]:
+        """Get every symbol with a name. Static symbols can have the same name in several sections.
+
+        Args:
+            name (str): The symbol name.
+
+        Returns:
+            list[Symbol]: The matching symbols. Empty if there are none.
+        """
+        target = name.encode("utf-8")
+        low, high = 0, self.symbol_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_name_bytes(self._get_name_order(middle)) < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        retVal = []
+        while low < self.symbol_count and self._get_name_bytes(self._get_name_order(low)) == target:
+            retVal.append(self.get_symbol(self._get_name_order(low)))
+            low += 1
+        return retVal
+
+    def find_by_address(self, address: int, section: str = None) -> Symbol:
+        """Get the symbol an address is in.
+
+        Args:
+            address (int): The VRAM address.
+            section (str, optional): Only consider symbols in this section. Defaults to None.
+
+        Overlays can share addresses, so without `section`, the address may be in a symbol from any of them. The closest
+        one that contains it is returned, so pass `section` to look in a specific overlay.
+
+        Returns:
+            Symbol: The symbol containing the address. For symbols of unknown size, the closest one at or before the
+            address. None if there's no such symbol.
+        """
+        # The first symbol after the address.
+        low, high = 0, self.symbol_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_vram(middle) <= address:
+                low = middle + 1
+            else:
+                high = middle
+
+        for index in range(low - 1, max(-1, low - 1 - ADDRESS_LOOKBACK), -1):
+            symbol = self.get_symbol(index)
+            if section is not None and symbol.section.name != section:
+                continue
+            if symbol.size == 0 or address < symbol.vram + symbol.size:
+                return symbol
+            # Functions in the same section don't overlap, so an earlier one can't contain the address either. Symbols from
+            # other sections (overlays) can, so keep looking if any section is allowed.
+            if section is not None and symbol.kind == "function":
+                return None
+        return None
+
+
+class SymbolIndexJob(JobBase):
+    """Compile reference symbol files (such as the Zelda64RecompSyms files that mod.toml uses) into a `SymbolIndex`.
+
+    Parsing the symbol files takes a while, so tools that need many lookups should open the index instead.
+    If `JobBase.state_store` is set, the index is only rebuilt when the symbol files or the overlay list change.
+    """
+    cacheable = True
+    index_path: Path
+    overlays_path: Path
+    _syms_paths: list[Path] | LazyValue
+    _syms_paths_added: bool
+
+    def __init__(self, syms_paths: list[Path] | LazyValue, index_path: Path, overlays_path: Path = None):
+        """Initializes the SymbolIndexJob.
+
+        Args:
+            syms_paths (list[Path] | LazyValue): The symbol files to index. May be a LazyValue, such as one that reads them
+                from a ModTomlJob's .toml (see `ModTomlJob.get_reference_syms_paths`).
+            index_path (Path): Where to write the index.
+            overlays_path (Path, optional): The list of relocatable sections, such as `overlays.us.rev1.txt`. Defaults to None.
+        """
+        self._syms_paths_added = False
+        super().__init__()
+        self._syms_paths = syms_paths
+        self.index_path = index_path
+        self.overlays_path = overlays_path
+        self.output_paths.append(index_path)
+
+    @property
+    def syms_paths(self) -> list[Path]:
+        return resolve_lazy(self._syms_paths)
+
+    # The symbol files may come from a .toml, so they're only added once something asks for them.
+    @property
+    def input_paths(self) -> list[Path]:
+        if not self._syms_paths_added:
+            self._syms_paths_added = True
+            self._input_paths.extend(self.syms_paths)
+            if self.overlays_path is not None:
+                self._input_paths.append(self.overlays_path)
+        return self._input_paths
+
+    @input_paths.setter
+    def input_paths(self, value: list[Path]):
+        self._input_paths = value
+
+    def open(self) -> SymbolIndex:
+        """Open the index this job builds. The job should have been resolved first."""
+        return SymbolIndex(self.index_path)
+
+    # Override:
+    def get_name(self) -> str:
+        return f"Symbol Index: {self.index_path.name}"
+
+    def get_state_key(self) -> str:
+        return f"symbol_index_{slugify(self.index_path.stem)}_{hash_string(str(self.index_path))[:16]}"
+
+    def needs_to_run(self, c: Context) -> bool:
+        if self.index_path.exists() and self.is_up_to_date():
+            print_job_header(f"Symbol Index Job: {self.index_path} is up to date.")
+            return False
+        return True
+
+    def run(self, c: Context):
+        print_job_header(f"Symbol Index Job: {self.index_path}")
+        if c.config['run']['dry']:
+            return
+        count = build_symbol_index(self.syms_paths, self.index_path, self.overlays_path)
+        print_fl(f"Indexed {count} symbols from {len(self.syms_paths)} file(s).")
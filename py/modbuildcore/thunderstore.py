@@ -3,34 +3,37 @@ from pathlib import Path
 
 from invoke import Context
 from .job_base import JobBase
-from .utils import print_job_header, print_fl
+from .utils import LazyValue, print_job_header, print_fl, resolve_lazy
 
 class ThunderstorePackageJob(JobBase):
     """This job creates a Thunderstore .zip package, ready to be uploaded.
     
     This Job uses dependent mod_output_files to determine what needs to go in the package. 
     The package itself is not a mod_output_file.
+    
+    The package file, manifest values, README text and CHANGELOG text can be given as `LazyValue`s, which are only computed
+    when the package is actually built.
     """
-    package_file: Path
-    manifest: dict[str, str]
-    readme_text: Path
-    changelog_text: Path
+    package_file: Path | LazyValue
+    manifest: dict[str, str | LazyValue]
+    readme_text: str | LazyValue
+    changelog_text: str | LazyValue
     icon_file: Path
     
     def __init__(self,
-            package_file: Path,
+            package_file: Path | LazyValue,
             manifest: dict,
-            readme_text: Path,
-            changelog_text: Path,
+            readme_text: str | LazyValue,
+            changelog_text: str | LazyValue,
             icon_file: Path,
         ):
         """Initializes the ThunderstorePackageJob, and defines the Thunderstore package.
 
         Args:
-            package_file (Path): The output path for the Package file.
-            manifest (dict): a dict representing the Thunderstore package's `manifest.json`.
-            readme_text (Path): The text to include in the package's `README.md`.
-            changelog_text (Path): The text to include in the package's `CHANGELOG.md`.
+            package_file (Path | LazyValue): The output path for the Package file.
+            manifest (dict): a dict representing the Thunderstore package's `manifest.json`. Values may be LazyValues.
+            readme_text (str | LazyValue): The text to include in the package's `README.md`.
+            changelog_text (str | LazyValue): The text to include in the package's `CHANGELOG.md`.
             icon_file (Path): The source image to use for the package's icon.
         """
         super().__init__()
@@ -40,13 +43,23 @@ class ThunderstorePackageJob(JobBase):
         self.changelog_text = changelog_text
         self.icon_file = icon_file
         
+    def get_name(self) -> str:
+        return f"Thunderstore Package: {resolve_lazy(self.manifest['name'])}"
+    
+    def get_manifest(self) -> dict:
+        return resolve_lazy(self.manifest)
+    
+    def get_package_file(self) -> Path:
+        return Path(resolve_lazy(self.package_file))
+        
     def run(self, c: Context):
-        print_job_header(f"Thunderstore Package Job: {self.manifest['name']}")
+        manifest = self.get_manifest()
+        print_job_header(f"Thunderstore Package Job: {manifest['name']}")
         # Thunderstore Metadata:
-        output_file = zipfile.ZipFile(self.package_file, 'w', zipfile.ZIP_DEFLATED)
-        output_file.writestr("manifest.json", json.dumps(self.manifest, indent=4))
-        output_file.writestr("README.md", self.readme_text)
-        output_file.writestr("CHANGELOG.md", self.changelog_text)
+        output_file = zipfile.ZipFile(self.get_package_file(), 'w', zipfile.ZIP_DEFLATED)
+        output_file.writestr("manifest.json", json.dumps(manifest, indent=4))
+        output_file.writestr("README.md", resolve_lazy(self.readme_text))
+        output_file.writestr("CHANGELOG.md", resolve_lazy(self.changelog_text))
         output_file.write(self.icon_file, "icon.png")
         
         for dst, src in self.get_recursive_mod_outputs().items():
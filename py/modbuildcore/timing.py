@@ -0,0 +1,175 @@
+import os, time, json, threading
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Child process usage just won't be reported.
+    resource = None
+
+from .utils import print_fl, print_color
+
+class JobTiming:
+    """The measurements for one phase (checking or running) of one job."""
+    name: str
+    key: str
+    phase: str
+    thread_name: str
+    start: float
+    wall: float
+    cpu: float
+    child_user: float
+    child_sys: float
+
+    def __init__(self, name: str, phase: str, thread_name: str, start: float, key: str = None):
+        self.name = name
+        self.key = key if key is not None else name
+        self.phase = phase
+        self.thread_name = thread_name
+        self.start = start
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_user = 0.0
+        self.child_sys = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "key": self.key,
+            "phase": self.phase,
+            "thread": self.thread_name,
+            "start": self.start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "child_user": self.child_user,
+            "child_sys": self.child_sys,
+        }
+
+
+def _get_child_usage() -> tuple[float, float]:
+    if resource is None:
+        return 0.0, 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime, usage.ru_stime
+
+
+class BuildTimer:
+    """Records how long each job takes to check and run during a modbuild invokation.
+
+    For each measurement, the wall time, the CPU time of the thread doing the work, and the CPU time used by child
+    processes (such as make, CMake and RecompModTool) are recorded. Child process usage is collected per-process by
+    the OS, so when several jobs run concurrently, it's attributed to whichever jobs were running when it was reaped.
+
+    The recorded timings can be written out as Chrome/Perfetto trace-event JSON, or printed as a summary table.
+    """
+    timings: list[JobTiming]
+    _origin: float
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.timings = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name: str, phase: str, key: str = None):
+        """A context manager that times the enclosed block and records it.
+
+        Args:
+            name (str): The name of the job (or other activity) being timed, for display.
+            phase (str): What the job is doing, such as "check" or "run".
+            key (str, optional): A stable, unique identity for the job, which the timing history is recorded under. If None, uses `name`. Defaults to None.
+        """
+        timing = JobTiming(name, phase, threading.current_thread().name, time.perf_counter() - self._origin, key)
+        cpu_start = time.thread_time()
+        child_user_start, child_sys_start = _get_child_usage()
+        try:
+            yield timing
+        finally:
+            timing.wall = time.perf_counter() - self._origin - timing.start
+            timing.cpu = time.thread_time() - cpu_start
+            child_user_end, child_sys_end = _get_child_usage()
+            timing.child_user = child_user_end - child_user_start
+            timing.child_sys = child_sys_end - child_sys_start
+            with self._lock:
+                self.timings.append(timing)
+
+    def get_timings(self, phase: str = None) -> list[JobTiming]:
+        """Get the recorded timings, optionally only for a single phase.
+
+        Args:
+            phase (str, optional): If set, only return timings for this phase. Defaults to None.
+
+        Returns:
+            list[JobTiming]: The matching timings, in the order they were recorded.
+        """
+        with self._lock:
+            return [i for i in self.timings if phase is None or i.phase == phase]
+
+    def to_chrome_trace(self) -> dict:
+        """Convert the recorded timings into the Chrome trace-event format, which can be loaded in Perfetto or chrome://tracing.
+
+        Returns:
+            dict: The trace, ready to be serialized as JSON.
+        """
+        pid = os.getpid()
+        thread_ids: dict[str, int] = {}
+        events = []
+
+        for i in self.get_timings():
+            if i.thread_name not in thread_ids:
+                thread_ids[i.thread_name] = len(thread_ids)
+                events.append({
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread_ids[i.thread_name],
+                    "args": {"name": i.thread_name},
+                })
+
+            events.append({
+                "name": i.name,
+                "cat": i.phase,
+                "ph": "X",
+                "ts": round(i.start * 1e6),
+                "dur": round(i.wall * 1e6),
+                "pid": pid,
+                "tid": thread_ids[i.thread_name],
+                "args": {
+                    "cpu_s": round(i.cpu, 6),
+                    "child_user_s": round(i.child_user, 6),
+                    "child_sys_s": round(i.child_sys, 6),
+                },
+            })
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+        }
+
+    def write_chrome_trace(self, path: Path):
+        """Write the recorded timings to a file as Chrome trace-event JSON.
+
+        Args:
+            path (Path): The file to write.
+        """
+        path = Path(path)
+        if path.parent != Path(""):
+            os.makedirs(path.parent, exist_ok=True)
+        path.write_text(json.dumps(self.to_chrome_trace(), indent=1))
+
+    def print_summary(self):
+        """Print a table of every recorded timing, sorted from longest to shortest."""
+        timings = sorted(self.get_timings(), key=lambda i: i.wall, reverse=True)
+        if len(timings) == 0:
+            return
+
+        name_width = max(len("Job"), max(len(i.name) for i in timings))
+        header = f"{'Job':<{name_width}}  {'Phase':<7}  {'Wall(s)':>8}  {'CPU(s)':>8}  {'Child user(s)':>13}  {'Child sys(s)':>12}"
+
+        print_color('green', "\n-> ", "Job timings:")
+        print_fl(header)
+        print_fl("-" * len(header))
+        for i in timings:
+            print_fl(f"{i.name:<{name_width}}  {i.phase:<7}  {i.wall:>8.3f}  {i.cpu:>8.3f}  {i.child_user:>13.3f}  {i.child_sys:>12.3f}")
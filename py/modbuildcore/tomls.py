@@ -1,70 +1,229 @@
-import tomllib, pathlib, zipfile, os
+import tomllib, pathlib, zipfile, struct, zlib, os
 from pathlib import Path
 
 from invoke import Context
 from .job_base import JobBase
-from .utils import invoke_subprocess_run, print_job_header
+from .state import hash_string
+from .utils import invoke_subprocess_run, print_job_header, print_fl, slugify
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_UNICODE_PATH_EXTRA_ID = 0x7075
+
+def _fix_extra_field(extra: bytearray, name: bytes):
+    # An Info-ZIP Unicode Path field holds another copy of the name, and the CRC of the header's name.
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, size = struct.unpack_from("<2H", extra, offset)
+        if field_id == _UNICODE_PATH_EXTRA_ID and size >= 5:
+            start = offset + 4
+            extra[start + 5:start + size] = extra[start + 5:start + size].replace(b"\\", b"/")
+            struct.pack_into("<L", extra, start + 1, zlib.crc32(name))
+        offset += 4 + size
+
+def _fix_zip_headers(f, zip_path: Path, infos: list[zipfile.ZipInfo], central_dir_offset: int):
+    for info in infos:
+        f.seek(info.header_offset)
+        header = bytearray(f.read(_LOCAL_HEADER.size))
+        fields = _LOCAL_HEADER.unpack(header)
+        if fields[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad local header for '{info.orig_filename}' in '{zip_path}'.")
+        name_length, extra_length = fields[10], fields[11]
+        rest = bytearray(f.read(name_length + extra_length))
+        name = bytes(rest[:name_length]).replace(b"\\", b"/")
+        rest[:name_length] = name
+        extra = rest[name_length:]
+        _fix_extra_field(extra, name)
+        rest[name_length:] = extra
+        f.seek(info.header_offset + _LOCAL_HEADER.size)
+        f.write(rest)
+
+    # The central directory is read whole. It's only headers, so its size doesn't depend on the file contents.
+    f.seek(central_dir_offset)
+    end = f.seek(0, os.SEEK_END)
+    f.seek(central_dir_offset)
+    central_dir = bytearray(f.read(end - central_dir_offset))
+    offset = 0
+    while offset + _CENTRAL_HEADER.size <= len(central_dir) and central_dir[offset:offset + 4] == zipfile.stringCentralDir:
+        fields = _CENTRAL_HEADER.unpack_from(central_dir, offset)
+        name_length, extra_length, comment_length = fields[12], fields[13], fields[14]
+        name_start = offset + _CENTRAL_HEADER.size
+        name = bytes(central_dir[name_start:name_start + name_length]).replace(b"\\", b"/")
+        central_dir[name_start:name_start + name_length] = name
+        extra = central_dir[name_start + name_length:name_start + name_length + extra_length]
+        _fix_extra_field(extra, name)
+        central_dir[name_start + name_length:name_start + name_length + extra_length] = extra
+        offset = name_start + name_length + extra_length + comment_length
+    f.seek(central_dir_offset)
+    f.write(central_dir)
+
+def fix_zip_path_separators(zip_path: Path) -> int:
+    """Replace backslashes with forward slashes in the member names of a zip file, without touching the compressed data.
+
+    Both separators are one byte, so names keep their length, and every header stays where it is. Only the local headers
+    and the central directory are rewritten, in place, so memory use and the work done depend on the number of members,
+    not their size.
+
+    Args:
+        zip_path (Path): The zip file to fix.
+
+    Returns:
+        int: The number of members that were renamed. If it's 0, the file wasn't touched.
+    """
+    with zipfile.ZipFile(zip_path, "r") as archive:
+        infos = [i for i in archive.infolist() if "\\" in i.orig_filename]
+        central_dir_offset = archive.start_dir
+    if len(infos) == 0:
+        return 0
+
+    with open(zip_path, "r+b") as f:
+        _fix_zip_headers(f, zip_path, infos, central_dir_offset)
+    return len(infos)
 
 class ModTomlJob(JobBase):
     """Run the RecompModTool to generate an .nrm file from a .toml.
     
     The generated .nrm file will automatically be considered a mod_output_file.
+    
+    If `JobBase.state_store` is set, the job is skipped when the .toml file, every file it references (the input .elf,
+    the reference symbol files and any `additional_files`), the RecompModTool binary, and the generated .nrm are all
+    unchanged since it last ran. Files are only re-hashed when their size or modification time changed, so checking
+    the large Zelda64RecompSyms files is cheap. If `JobBase.artifact_cache` is also set, the .nrm
+    is restored from the cache when it has been generated from identical inputs before.
     """
+    cacheable = True
     mod_tool_path: Path
     toml_path: Path
     run_nrm_path_fix: bool
-    build_dir: Path
-    data: dict
+    _build_dir: Path
+    _data: dict
+    _toml_paths_added: bool
     
     def __init__(self, mod_tool_path: Path, toml_path: Path, build_dir: Path = None):
         """Initializes the ModTomlJob. 
         
-        The .toml file is read when this job is initialized, meaning you can access the information in the .toml using `self.data`.
+        The .toml file is read the first time anything needs information from it, such as `self.data` (which holds the
+        information in the .toml), `self.build_dir` or `self.mod_output_files`. Creating the job doesn't touch the file.
 
         Args:
             mod_tool_path (Path): The path to the RecompModTool binary.
             toml_path (Path): The path to the .toml file to pass to RecompModTool.
             build_dir (Path, optional): The path to the build directory to pass to RecompModTool. If None, uses the directory of the input .elf binary specified by the .toml file. Defaults to None.
         """
+        self._toml_paths_added = False
         super().__init__()
         self.mod_tool_path = mod_tool_path    
         self.toml_path = toml_path
-        self.build_dir = build_dir
-        self.data = tomllib.loads(self.toml_path.read_text())
-        
-        if self.build_dir is None:
-            self.build_dir = self.get_elf_path().parent
-        
-        self.mod_output_files[Path(self.get_output_path().name)] = self.get_output_path()
+        self._build_dir = build_dir
+        self._data = None
         
         self.run_nrm_path_fix = False
     
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = tomllib.loads(self.toml_path.read_text())
+        return self._data
+    
+    @property
+    def build_dir(self) -> Path:
+        if self._build_dir is None:
+            self._build_dir = self.get_elf_path().parent
+        return self._build_dir
+    
+    # The .nrm output and the .elf input both come from the .toml, so they're only added once something asks for them.
+    @property
+    def mod_output_files(self) -> dict[Path, Path]:
+        self._add_toml_paths()
+        return self._mod_output_files
+    
+    @mod_output_files.setter
+    def mod_output_files(self, value: dict[Path, Path]):
+        self._mod_output_files = value
+    
+    @property
+    def input_paths(self) -> list[Path]:
+        self._add_toml_paths()
+        return self._input_paths
+    
+    @input_paths.setter
+    def input_paths(self, value: list[Path]):
+        self._input_paths = value
+    
+    def _add_toml_paths(self):
+        if self._toml_paths_added:
+            return
+        self._toml_paths_added = True
+        self._mod_output_files[Path(self.get_output_path().name)] = self.get_output_path()
+        self._input_paths.extend([self.toml_path] + self.get_toml_input_paths())
+    
     def get_path_from_toml(self, rel_path: str | Path) -> Path:
         return self.toml_path.parent.joinpath(rel_path).resolve()
     
     def get_elf_path(self) -> Path:
         return self.get_path_from_toml(self.data["inputs"]["elf_path"])
     
+    def get_toml_input_paths(self) -> list[Path]:
+        """Get every file the .toml tells RecompModTool to read: the input .elf, the reference symbol files, and the additional files.
+
+        Returns:
+            list[Path]: The input file paths, resolved relative to the .toml.
+        """
+        inputs: dict = self.data["inputs"]
+        retVal = [self.get_elf_path()] + self.get_reference_syms_paths()
+        retVal.extend(self.get_path_from_toml(i) for i in inputs.get("additional_files", []))
+        return retVal
+    
+    def get_reference_syms_paths(self) -> list[Path]:
+        """Get the reference symbol files the .toml uses (`func_reference_syms_file` and `data_reference_syms_files`).
+
+        Returns:
+            list[Path]: The symbol file paths, resolved relative to the .toml.
+        """
+        inputs: dict = self.data["inputs"]
+        retVal = []
+        if "func_reference_syms_file" in inputs:
+            retVal.append(self.get_path_from_toml(inputs["func_reference_syms_file"]))
+        retVal.extend(self.get_path_from_toml(i) for i in inputs.get("data_reference_syms_files", []))
+        return retVal
+    
     def get_output_path(self) -> Path:
         return self.build_dir.joinpath(self.data["inputs"]["mod_filename"]).with_suffix(".nrm")
     
     def nrm_path_fix(self):
-        in_zip = zipfile.ZipFile(self.get_output_path(), 'r')
-        out_file_path = self.get_output_path().with_suffix(".nrm_temp")        
-        out_zip = zipfile.ZipFile(out_file_path, 'w', in_zip.compression)        
-        
-        for file in in_zip.filelist:
-            new_path = file.filename.replace("\\", "/")
-            out_zip.writestr(new_path, in_zip.read(file))
-        
-        in_zip.close()
-        out_zip.close()
+        """Replace the backslashes in the .nrm's member paths with forward slashes, in place. See `fix_zip_path_separators`."""
+        renamed = fix_zip_path_separators(self.get_output_path())
+        if renamed > 0:
+            print_fl(f"Fixed the paths of {renamed} file(s) in '{self.get_output_path().name}'.")
         
-        os.remove(self.get_output_path())
-        os.rename(out_file_path, self.get_output_path())
+    def get_name(self) -> str:
+        return f"Mod Toml: {self.toml_path.name}"
+    
+    def get_state_key(self) -> str:
+        identity = str(self.toml_path) + str(self.build_dir)
+        return f"mod_toml_{slugify(self.data['inputs']['mod_filename'])}_{hash_string(identity)[:16]}"
+    
+    def get_input_fingerprint(self) -> dict[str, str]:
+        retVal = super().get_input_fingerprint()
+        retVal["mod_tool"] = self.state_store.fingerprint_path(self.mod_tool_path)
+        retVal["nrm_path_fix"] = str(self.run_nrm_path_fix)
+        return retVal
+    
+    # Override:
+    def needs_to_run(self, c: Context) -> bool:
+        if self.is_up_to_date():
+            print_job_header(f"Mod Toml Job: {self.toml_path} is up to date.")
+            return False
+        return True
         
-    def run(self, c: Context):
+    def run(self, c: Context) -> bool:
         print_job_header(f"Mod Toml Job: {self.toml_path}")
-        invoke_subprocess_run(c, True,
+        result = invoke_subprocess_run(c, True,
             [self.mod_tool_path, self.toml_path, self.build_dir]
-        )
\ No newline at end of file
+        )
+        if result is not None and result.returncode != 0:
+            return False
+        
+        if self.run_nrm_path_fix and not c.config['run']['dry']:
+            self.nrm_path_fix()
+        return True
\ No newline at end of file
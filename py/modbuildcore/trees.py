@@ -0,0 +1,229 @@
+import os, sys, json, stat, shutil, threading
+from pathlib import Path
+
+from .blobs import CAN_SHARE_HARDLINKS, SHA256_PATTERN, get_default_cache_dir
+from .extraction import find_damaged_members
+from .state import hash_string
+from .utils import FileLock
+
+# The ways `TreeStore.materialize` can place a tree. "auto" tries reflinks, then hardlinks, then copies, file by file.
+MATERIALIZE_MODES = ("auto", "reflink", "hardlink", "symlink", "copy")
+# The FICLONE ioctl from linux/fs.h. Makes a file share another's blocks, copy-on-write (btrfs, XFS, bcachefs...).
+FICLONE = 0x40049409
+
+def reflink_file(src: Path, dest: Path) -> bool:
+    """Create `dest` as a copy-on-write clone of `src`, if the platform and filesystem support it.
+
+    Returns:
+        bool: True if `dest` was created. False if reflinks aren't available, in which case `dest` doesn't exist.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    with open(src, "rb") as src_file:
+        dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(dest_fd, FICLONE, src_file.fileno())
+        except OSError:
+            os.close(dest_fd)
+            os.unlink(dest)
+            return False
+        os.close(dest_fd)
+    shutil.copymode(src, dest)
+    _make_writable(dest)
+    return True
+
+
+class _TreeLinker:
+    """Places files from a store entry, remembering which methods failed so that they aren't retried for every file."""
+    can_reflink: bool
+    can_hardlink: bool
+
+    def __init__(self, mode: str):
+        self.can_reflink = mode in ("auto", "reflink")
+        self.can_hardlink = mode in ("auto", "hardlink") and CAN_SHARE_HARDLINKS
+
+    def place(self, src: Path, dest: Path):
+        if src.is_symlink():
+            os.symlink(os.readlink(src), dest)
+            return
+        if self.can_reflink:
+            if reflink_file(src, dest):
+                return
+            self.can_reflink = False
+        if self.can_hardlink:
+            try:
+                os.link(src, dest)
+                return
+            except OSError:
+                # Different filesystem, or one without hardlinks.
+                self.can_hardlink = False
+        shutil.copy2(src, dest)
+        _make_writable(dest)
+
+
+class TreeStore:
+    """A store of extracted archives, one per archive sha256 (and set of extraction filters), shared by every project on this machine.
+
+    When an ArchiveExtractJob extracts an archive, it adds the extracted tree to the store. Any other checkout that needs
+    the same archive extracted gets it from the store instead, as copy-on-write clones (reflinks) where the filesystem
+    supports them, hardlinks where it doesn't (except on Windows, see `blobs.CAN_SHARE_HARDLINKS`), and copies otherwise.
+    Since hardlinked files share their contents with the store, files in the store are made read-only. With the "symlink"
+    mode, the extraction folder is just a symlink to the store entry, which is the fastest option but means the tree is
+    shared, not copied.
+
+    Each entry is a folder named by its key, plus a `<key>.json` manifest of its files that's only written once the
+    entry is complete.
+    """
+    root_dir: Path
+
+    def __init__(self, root_dir: Path):
+        """Initializes the TreeStore.
+
+        Args:
+            root_dir (Path): The directory to store trees in. Created when first written to.
+        """
+        self.root_dir = Path(root_dir)
+
+    @classmethod
+    def get_default(cls) -> "TreeStore":
+        return cls(get_default_cache_dir().joinpath("trees"))
+
+    @staticmethod
+    def get_key(sha256: str, include: list[str] = None, exclude: list[str] = None) -> str:
+        """Get the key for an archive extracted with a set of filters. Without filters, this is the archive's digest."""
+        sha256 = sha256.lower()
+        if not SHA256_PATTERN.match(sha256):
+            raise ValueError(f"'{sha256}' isn't a sha256 hex digest.")
+        if not include and not exclude:
+            return sha256
+        return hash_string(json.dumps([sha256, list(include or []), list(exclude or [])]))
+
+    def get_path(self, key: str) -> Path:
+        return self.root_dir.joinpath(key)
+
+    def get_manifest_path(self, key: str) -> Path:
+        return self.root_dir.joinpath(f"{key}.json")
+
+    def get_lock(self, key: str) -> FileLock:
+        return FileLock(self.root_dir.joinpath(f"{key}.lock"))
+
+    def load_manifest(self, key: str) -> dict[str, int]:
+        """Get the manifest of a complete entry, or None if there isn't one, or it was damaged (in which case it's removed)."""
+        try:
+            manifest = json.loads(self.get_manifest_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+        if len(find_damaged_members(self.get_path(key), manifest)) > 0:
+            self.remove(key)
+            return None
+        return manifest
+
+    def remove(self, key: str):
+        self.get_manifest_path(key).unlink(missing_ok=True)
+        remove_tree(self.get_path(key))
+
+    def add(self, src_dir: Path, key: str, manifest: dict[str, int]) -> bool:
+        """Add an extracted tree to the store, by moving it there if it's on the same filesystem, and copying it otherwise.
+
+        Args:
+            src_dir (Path): The extracted tree. It may no longer exist afterwards.
+            key (str): The entry's key (see `get_key`).
+            manifest (dict[str, int]): The extracted files, as returned by `extraction.extract_archive`.
+
+        Returns:
+            bool: True if `src_dir` was moved into the store. False if it was copied, or the store already had the entry.
+        """
+        with self.get_lock(key):
+            if self.load_manifest(key) is not None:
+                return False
+
+            entry_path = self.get_path(key)
+            remove_tree(entry_path)
+            temp_path = entry_path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                os.rename(src_dir, temp_path)
+                moved = True
+            except OSError:
+                shutil.copytree(src_dir, temp_path, symlinks=True)
+                moved = False
+
+            _make_readonly(temp_path)
+            os.replace(temp_path, entry_path)
+            self.get_manifest_path(key).write_text(json.dumps(manifest))
+            return moved
+
+    def materialize(self, key: str, dest_dir: Path, mode: str = "auto", members: set[str] = None) -> dict[str, int]:
+        """Place a stored tree at `dest_dir`. Files already in `dest_dir` are left alone, unless they're in `members`.
+
+        Args:
+            key (str): The entry's key (see `get_key`).
+            dest_dir (Path): Where to place the tree. Must not exist in "symlink" mode, unless `members` is set.
+            mode (str, optional): One of `MATERIALIZE_MODES`. Defaults to "auto".
+            members (set[str], optional): Only place these files, replacing them if they exist. Defaults to None.
+
+        Returns:
+            dict[str, int]: The entry's manifest, or None if the store doesn't have the entry.
+        """
+        if mode not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown materialize mode '{mode}'. Use one of {', '.join(MATERIALIZE_MODES)}.")
+
+        with self.get_lock(key):
+            manifest = self.load_manifest(key)
+            if manifest is None:
+                return None
+            entry_path = self.get_path(key)
+
+            if mode == "symlink" and members is None:
+                os.makedirs(dest_dir.parent, exist_ok=True)
+                os.symlink(entry_path.absolute(), dest_dir, target_is_directory=True)
+                return manifest
+
+            linker = _TreeLinker("auto" if mode == "symlink" else mode)
+            if members is not None:
+                for name in members:
+                    dest = dest_dir.joinpath(name)
+                    if dest.is_symlink() or dest.exists():
+                        dest.unlink()
+                    os.makedirs(dest.parent, exist_ok=True)
+                    linker.place(entry_path.joinpath(name), dest)
+                return manifest
+
+            for dir_path, dir_names, file_names in os.walk(entry_path):
+                rel_dir = Path(dir_path).relative_to(entry_path)
+                os.makedirs(dest_dir.joinpath(rel_dir), exist_ok=True)
+                # os.walk lists symlinks to directories as directories, but doesn't descend into them.
+                for name in file_names + [i for i in dir_names if os.path.islink(os.path.join(dir_path, i))]:
+                    dest = dest_dir.joinpath(rel_dir, name)
+                    if not (dest.is_symlink() or dest.exists()):
+                        linker.place(Path(dir_path, name), dest)
+            return manifest
+
+
+def remove_tree(path: Path):
+    """Delete a folder tree, including read-only files, or just the link if `path` is a symlink."""
+    path = Path(path)
+    if path.is_symlink():
+        path.unlink()
+    elif path.exists():
+        shutil.rmtree(path, onerror=_remove_readonly)
+
+def _make_readonly(root_dir: Path):
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if not os.path.islink(path):
+                mode = os.stat(path).st_mode
+                os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def _make_writable(path: Path):
+    # Only files shared with the store (hardlinks) need to stay read-only.
+    os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR)
+
+def _remove_readonly(func, path, exc_info):
+    # Windows won't delete read-only files. A file with other hardlinks may be shared with a store, and making it writable
+    # would unprotect the store's copy too, so that's left as an error.
+    if os.lstat(path).st_nlink > 1:
+        raise exc_info[1]
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
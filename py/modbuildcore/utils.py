@@ -1,6 +1,7 @@
 
-import sys, subprocess, re
+import os, sys, time, subprocess, re, importlib, threading
 from pathlib import Path
+from typing import Callable
 
 from invoke import Context
 from colors import *
@@ -11,6 +12,134 @@ def slugify(text: str) -> str:
     text = re.sub(r'[^a-zA-Z0-9_]', '', text)
     return text
 
+class LazyValue:
+    """A value that is computed by calling `factory` the first time it's needed, and cached after that.
+    
+    Use this in `project.py` for job arguments that are expensive to compute (such as reading files or running `git`),
+    so that commands which only inspect the project, such as `--list`, don't pay for them. Job types that accept a 
+    LazyValue call `resolve_lazy` on the argument when they actually use it.
+    """
+    factory: Callable[[], object]
+    _value: object
+    _resolved: bool
+    _lock: threading.Lock
+    
+    def __init__(self, factory: Callable[[], object]):
+        self.factory = factory
+        self._value = None
+        self._resolved = False
+        self._lock = threading.Lock()
+    
+    def get(self):
+        with self._lock:
+            if not self._resolved:
+                self._value = self.factory()
+                self._resolved = True
+            return self._value
+
+def resolve_lazy(value):
+    """Returns the value of a LazyValue, or `value` itself if it isn't one. The values in dicts and lists are resolved too."""
+    if isinstance(value, LazyValue):
+        return value.get()
+    if isinstance(value, dict):
+        return {k: resolve_lazy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_lazy(i) for i in value]
+    return value
+
+
+class LazyModule:
+    """Stands in for a module that is only imported the first time one of its attributes is accessed.
+    
+    Unlike `importlib.util.LazyLoader`, looking at the object itself (such as with `isinstance`) doesn't trigger the import,
+    so it's safe to keep in a module that pyinvoke scans for tasks.
+    """
+    _names: tuple[str, ...]
+    _module: object
+    
+    def __init__(self, *names: str):
+        """Initializes the LazyModule.
+
+        Args:
+            *names (str): The modules to try importing, in order. The first one that exists is used.
+        """
+        self._names = names
+        self._module = None
+    
+    def load(self):
+        if self._module is None:
+            for i in self._names:
+                try:
+                    self._module = importlib.import_module(i)
+                    break
+                except ModuleNotFoundError as e:
+                    # Only fall through to the next name if this module is missing, not one it imports.
+                    if e.name != i or i == self._names[-1]:
+                        raise
+        return self._module
+    
+    def is_loaded(self) -> bool:
+        return self._module is not None
+    
+    def reload(self):
+        if self._module is not None:
+            self._module = importlib.reload(self._module)
+    
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+
+class FileLock:
+    """An exclusive lock on a file, held across processes, used as a context manager.
+    
+    Uses `fcntl.flock` on Unix and `msvcrt.locking` on Windows. The lock file is created if it doesn't exist, and is left
+    in place afterwards. Each `with` block opens the file again, so the same FileLock can also be used from several threads.
+    """
+    path: Path
+    _local: threading.local
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+    
+    def __enter__(self):
+        os.makedirs(self.path.parent, exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                while True:
+                    try:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after about 10 seconds.
+                        time.sleep(0.1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            f.close()
+            raise
+        self._local.file = f
+        return self
+    
+    def __exit__(self, *args):
+        f = self._local.file
+        self._local.file = None
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+
 def print_fl(*args, **kwargs):
     print(*args, flush=True, **kwargs)
 
@@ -0,0 +1,287 @@
+import os, sys, time, select, struct, ctypes, ctypes.util
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from .job_base import JobBase
+
+# Quiet period after the first change, so that a save touching several files triggers a single rebuild.
+DEFAULT_SETTLE_TIME = 0.2
+
+class PathWatcher(ABC):
+    """Base class for watching files and directories for changes. Subclasses implement `wait_for_changes`."""
+    paths: list[Path]
+
+    def __init__(self, paths: list[Path]):
+        """Initializes the PathWatcher.
+
+        Args:
+            paths (list[Path]): The files and directories to watch. Directories are watched recursively. Paths that don't exist yet are ignored.
+        """
+        self.paths = [Path(i).absolute() for i in paths]
+
+    @abstractmethod
+    def wait_for_changes(self, settle_time: float = DEFAULT_SETTLE_TIME) -> set[Path]:
+        """Block until at least one watched path changes.
+
+        Args:
+            settle_time (float, optional): After the first change, keep collecting changes until none have been seen for this many seconds.
+
+        Returns:
+            set[Path]: The paths that changed.
+        """
+
+    def close(self):
+        pass
+
+    def is_watched(self, path: Path) -> bool:
+        return any(path == i or i in path.parents for i in self.paths)
+
+
+class PollingWatcher(PathWatcher):
+    """Watches paths by periodically comparing the size and modification time of every file. Works on any platform."""
+    interval: float
+    _snapshot: dict[Path, tuple[int, int]]
+
+    def __init__(self, paths: list[Path], interval: float = 1.0):
+        """Initializes the PollingWatcher.
+
+        Args:
+            paths (list[Path]): The files and directories to watch.
+            interval (float, optional): Seconds between scans. Defaults to 1.0.
+        """
+        super().__init__(paths)
+        self.interval = interval
+        self._snapshot = self.scan()
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        retVal = {}
+        for path in self.paths:
+            if path.is_file():
+                st = path.stat()
+                retVal[path] = (st.st_size, st.st_mtime_ns)
+            elif path.is_dir():
+                for dirpath, dirnames, filenames in os.walk(path):
+                    for name in filenames:
+                        file_path = Path(dirpath, name)
+                        try:
+                            st = file_path.stat()
+                        except OSError:
+                            continue
+                        retVal[file_path] = (st.st_size, st.st_mtime_ns)
+        return retVal
+
+    def _collect(self) -> set[Path]:
+        new_snapshot = self.scan()
+        changed = {i for i in new_snapshot.keys() | self._snapshot.keys() if new_snapshot.get(i) != self._snapshot.get(i)}
+        self._snapshot = new_snapshot
+        return changed
+
+    def wait_for_changes(self, settle_time: float = DEFAULT_SETTLE_TIME) -> set[Path]:
+        changed = set()
+        while len(changed) == 0:
+            time.sleep(self.interval)
+            changed = self._collect()
+
+        while True:
+            time.sleep(settle_time)
+            more = self._collect()
+            if len(more) == 0:
+                return changed
+            changed |= more
+
+
+class InotifyWatcher(PathWatcher):
+    """Watches paths using the Linux inotify API, so that changes are picked up immediately without rescanning."""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct("iIII")
+
+    _libc: ctypes.CDLL
+    _fd: int
+    _watch_dirs: dict[int, Path]
+
+    @classmethod
+    def is_supported(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return hasattr(libc, "inotify_init1")
+
+    def __init__(self, paths: list[Path]):
+        super().__init__(paths)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watch_dirs = {}
+
+        for path in self.paths:
+            if path.is_dir():
+                self._add_tree(path)
+            elif path.parent.is_dir():
+                # Files are watched through their directory, since editors often save by replacing the file.
+                self._add_dir(path.parent)
+
+    def _add_dir(self, path: Path):
+        if path in self._watch_dirs.values():
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{path}'")
+        self._watch_dirs[wd] = path
+
+    def _add_tree(self, path: Path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            self._add_dir(Path(dirpath))
+
+    def _read_events(self, timeout: float) -> set[Path]:
+        changed = set()
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if len(ready) == 0:
+            return changed
+
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            directory = self._watch_dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & self.IN_DELETE_SELF:
+                del self._watch_dirs[wd]
+                continue
+
+            path = directory.joinpath(os.fsdecode(name)) if len(name) > 0 else directory
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.is_watched(path):
+                    self._add_tree(path)
+                continue
+            if self.is_watched(path):
+                changed.add(path)
+        return changed
+
+    def wait_for_changes(self, settle_time: float = DEFAULT_SETTLE_TIME) -> set[Path]:
+        changed = set()
+        while len(changed) == 0:
+            changed = self._read_events(None)
+
+        while True:
+            more = self._read_events(settle_time)
+            if len(more) == 0:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(paths: list[Path], *, poll: bool = False, interval: float = 1.0) -> PathWatcher:
+    """Create the best available watcher for this platform.
+
+    Args:
+        paths (list[Path]): The files and directories to watch.
+        poll (bool, optional): Always use a PollingWatcher. Defaults to False.
+        interval (float, optional): Seconds between scans, if polling. Defaults to 1.0.
+
+    Returns:
+        PathWatcher: An InotifyWatcher on Linux, or a PollingWatcher otherwise.
+    """
+    if not poll and InotifyWatcher.is_supported():
+        try:
+            return InotifyWatcher(paths)
+        except OSError:
+            # Usually means the inotify watch limit was reached.
+            pass
+    return PollingWatcher(paths, interval)
+
+
+def get_watch_paths(roots: list[JobBase]) -> list[Path]:
+    """Get the input_paths of the given jobs and all of their dependencies.
+
+    Inputs that are produced by a job in the graph (such as a ModTomlJob's mod.elf) are left out, since the build itself
+    writes them, and watching them would start a rebuild after every build. Changes to them are picked up through the
+    dependencies of the jobs that read them instead.
+
+    Args:
+        roots (list[JobBase]): The jobs to collect inputs from.
+
+    Returns:
+        list[Path]: The unique input paths, as absolute paths.
+    """
+    input_paths = []
+    output_paths = set()
+    visited = set()
+    to_visit = list(roots)
+    while len(to_visit) > 0:
+        job = to_visit.pop()
+        if job in visited:
+            continue
+        visited.add(job)
+        for i in job.input_paths:
+            path = Path(i).absolute()
+            if path not in input_paths:
+                input_paths.append(path)
+        output_paths.update(Path(i).absolute() for i in job.get_output_paths())
+        to_visit.extend(job.dependencies)
+
+    retVal = []
+    for path in input_paths:
+        if path in output_paths or any(i in output_paths for i in path.parents):
+            continue
+        retVal.append(path)
+    return retVal
+
+
+def get_affected_jobs(roots: list[JobBase], changed_paths: set[Path]) -> set[JobBase]:
+    """Get the subgraph of jobs that needs to be resolved after some files changed.
+
+    A job is affected if one of the changed paths is (or is inside) one of its input_paths, or if any of its dependencies is affected.
+
+    Args:
+        roots (list[JobBase]): The jobs to search from.
+        changed_paths (set[Path]): The paths that changed.
+
+    Returns:
+        set[JobBase]: The affected jobs, including any affected roots.
+    """
+    changed_paths = {Path(i).absolute() for i in changed_paths}
+    memo: dict[JobBase, bool] = {}
+
+    def is_affected(job: JobBase) -> bool:
+        if job in memo:
+            return memo[job]
+        memo[job] = False
+
+        retVal = False
+        for i in job.input_paths:
+            path = Path(i).absolute()
+            if any(changed == path or path in changed.parents for changed in changed_paths):
+                retVal = True
+                break
+
+        for i in job.dependencies:
+            # Always visit every dependency, so that all affected jobs end up in the memo.
+            retVal = is_affected(i) or retVal
+
+        memo[job] = retVal
+        return retVal
+
+    for i in roots:
+        is_affected(i)
+
+    return {job for job, affected in memo.items() if affected}
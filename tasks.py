@@ -6,18 +6,20 @@ if __name__ == '__main__':
     print(f"Wrong file! This is the pyinvoke tasks file for the `modbuild.py` tool. Run `python[3] ./modbuild.py` to use it.")
     sys.exit(0)
 
-import shutil, os, json
+import os, json
 from pathlib import Path
 
 from modbuildcore.jobs import *
 from modbuildcore.utils import *
+from modbuildcore.graph import JobGraph
+from modbuildcore.trees import remove_tree
+from modbuildcore.watch import create_watcher, get_watch_paths, get_affected_jobs
 
 from invoke import Context, task, call
 
-try: 
-    import user_project as p # type: ignore
-except ImportError as e:
-    import project as p
+# The project file is only evaluated the first time a task uses it, so that `--list`, `--help` and shell completion
+# don't construct any jobs. `user_project.py` is used instead of `project.py` if it exists.
+p = LazyModule("user_project", "project")
 
 ARG_SPLIT_CHAR = ","
 
@@ -26,11 +28,24 @@ _built_cmake_handlers: list[CMakeBuildJob] = []
 
 def print_task_header(*args, **kwargs): 
     print_color('green', "\n-> ", *args, **kwargs)
+
+def get_all_project_jobs() -> list[JobBase]:
+    retVal: list[JobBase] = []
+    retVal.extend(p.downloads.values())
+    retVal.extend(p.archive_extractions.values())
+    retVal.extend(p.makefiles.values())
+    retVal.extend(p.mod_tomls.values())
+    for group in p.cmake_build_groups.values():
+        retVal.extend(group.values())
+    retVal.extend(p.build_outputs.values())
+    retVal.extend(p.thunderstore_packages.values())
+    retVal.extend(p.symbol_indexes.values())
+    return retVal
     
 
 @task(help={
     'skip_dependencies': "Do not try to resolve dependency jobs.",
-    'force': "Redownloads any previously downloaded files.",
+    'force': "Redownloads any previously downloaded files that changed on the server. Unchanged files cost a single conditional request.",
     'name': f"Only download specific files. Names should be the keys used in `project.downloads`, separated by '{ARG_SPLIT_CHAR}'.",
     'list': f"List all DownloadJob names in `project.downloads`, then exit."
 })
@@ -59,11 +74,11 @@ def download(c: Context, skip_dependencies: bool = False, force: bool = False, n
     
     for download in dl_list:
         download.force = force
-        download.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, dl_list, skip_dependencies)
     
 @task(help={
     'skip_dependencies': "Do not try to resolve dependency jobs.",
-    'force': "Re-extract archives even if the output folder already exists",
+    'force': "Re-extract archives even if they were already extracted.",
     'name': f"Only extract specific archives. Names should be the keys used in `project.archive_extractions`, separated by '{ARG_SPLIT_CHAR}'.",
     'list': f"List all ArchiveExtractJob names in `project.archive_extractions`, then exit."
 })
@@ -72,7 +87,8 @@ def extract(c: Context, skip_dependencies: bool = False, force: bool = False, na
     Runs the archive extractions defined in `project.archive_extractions`. 
     Entries in `project.archive_extractions` should be instances of `modbuildcore.archives.ArchiveExtractJob`. 
     
-    By default, extractions will be skipped (and considered unresolved) if the destination folder already exists.
+    By default, extractions will be skipped (and considered unresolved) if the archive was already fully extracted to the destination folder.
+    Files that went missing from an extraction are extracted again, and a changed archive is extracted again from scratch.
     
     Unless manually specified, extracted files/folders do not count as'mod_output_files and are not collected by BuildOutputJobs or ThunderstorePackageJobs.
     """
@@ -92,17 +108,17 @@ def extract(c: Context, skip_dependencies: bool = False, force: bool = False, na
     
     for extraction in extract_list:
         extraction.force = force
-        extraction.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, extract_list, skip_dependencies)
 
 @task(help={
     'skip_dependencies': "Do not try to resolve dependency jobs.",
     'name': f"Only run specific makefile configurations. Names should be the keys used in `project.makefiles`, separated by '{ARG_SPLIT_CHAR}'.",
-    'list': f"List all MakefileJob names in `project.makefiles`, then exit."
+    'list': f"List all MakefileJob and MipsCompileJob names in `project.makefiles`, then exit."
 })
 def makefile(c: Context, skip_dependencies: bool = False, name: str = None, list: bool = False):
     """
     Builds the makefile configurations defined in `project.makefiles`.
-    Entries in `project.makefiles` should be instances of `modbuildcore.makefiles.MakefileJob`. 
+    Entries in `project.makefiles` should be instances of `modbuildcore.makefiles.MakefileJob` or `modbuildcore.mips.MipsCompileJob`. 
     """
     if list:
         print_task_header("Listing makefile names:")
@@ -112,14 +128,13 @@ def makefile(c: Context, skip_dependencies: bool = False, name: str = None, list
     
     print_task_header("Running makefiles...")
     
-    makefile_list : list[MakefileJob] = None
+    makefile_list : list[MakefileJob | MipsCompileJob] = None
     if name is None:
         makefile_list = p.makefiles.values()
     else:
         makefile_list = [p.makefiles[i] for i in name.split(ARG_SPLIT_CHAR)]
     
-    for makefile in makefile_list:
-        makefile.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, makefile_list, skip_dependencies)
 
 @task(
     help={
@@ -127,11 +142,13 @@ def makefile(c: Context, skip_dependencies: bool = False, name: str = None, list
         'name': f"Only build .nrm files from specific registered .toml files. " \
             f"Names should be the keys used in `project.mod_tomls`, separated by '{ARG_SPLIT_CHAR}'.",
         'path_fix': "EXPERIMENTAL (AND NOT ENDORSED BY WISEGUY)! Reconstructs the .nrm file " \
-            "after RecompModTool finishes in order to eliminate backslashes from filepaths.",
+            "after RecompModTool finishes in order to eliminate backslashes from filepaths. " \
+            "Defaults to `project.nrm_path_fix_by_default`.",
+        'no_path_fix': "Don't reconstruct the .nrm file, even if `project.nrm_path_fix_by_default` is set.",
         'list': f"List all ModTomlJob names in `project.mod_tomls`, then exit."
     }
 )
-def nrm(c: Context, skip_dependencies: bool = False, name: str = None, path_fix: bool = p.nrm_path_fix_by_default, list: bool = False):
+def nrm(c: Context, skip_dependencies: bool = False, name: str = None, path_fix: bool = False, no_path_fix: bool = False, list: bool = False):
     """
     Builds .nrm files from .toml files, as specified in `project.mod_tomls`. The resultant .nrms are counted as 'mod_output_files'.
     Entries in `project.mod_tomls` should be instances of `modbuildcore.makefiles.ModTomlJob`. 
@@ -151,9 +168,12 @@ def nrm(c: Context, skip_dependencies: bool = False, name: str = None, path_fix:
     else:
         toml_list = [p.mod_tomls[i] for i in name.split(ARG_SPLIT_CHAR)]
     
+    if not path_fix and not no_path_fix:
+        path_fix = p.nrm_path_fix_by_default
+    
     for mod in toml_list:
         mod.run_nrm_path_fix = path_fix
-        mod.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, toml_list, skip_dependencies)
 
 @task(help={
     'skip_dependencies': "Do not try to resolve dependency jobs.",
@@ -188,13 +208,14 @@ def cmake(c: Context, skip_dependencies: bool = False, group_name: str = None, b
     else:
         selected_groups = p.cmake_build_groups
         
+    build_list: list[CMakeBuildJob] = []
     for group_key, group in selected_groups.items():
         if build_name is None:
-            for build_key, build_job in  group.items():
-                build_job.resolve(c, skip_dependencies)
+            build_list.extend(group.values())
         else:
-            for build_key, build_job in [(bkey, group[bkey]) for bkey in build_name.split(ARG_SPLIT_CHAR)]:
-                build_job.resolve(c, skip_dependencies)
+            build_list.extend([group[bkey] for bkey in build_name.split(ARG_SPLIT_CHAR)])
+    
+    JobBase.resolve_many(c, build_list, skip_dependencies)
                     
 @task (
     default=True,
@@ -233,7 +254,7 @@ def build(c: Context, skip_dependencies: bool = False, unresolved_jobs: bool = F
     for test_dir in test_dir_list:
         test_dir.include_unresolved_jobs = unresolved_jobs
         test_dir.include_all_resolved_jobs = all_resolved_jobs
-        test_dir.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, test_dir_list, skip_dependencies)
 
 
 @task(
@@ -265,12 +286,13 @@ def manifest(c: Context, name: str = None, output_file: str = None, list: bool =
         package_list = [p.thunderstore_packages[i] for i in name.split(ARG_SPLIT_CHAR)]
         
     for package in package_list:
+        manifest_data = package.get_manifest()
         if output_file is None:
-            output = Path(package.manifest['name']).with_suffix(".json")
+            output = Path(manifest_data['name']).with_suffix(".json")
         else:
             output = Path(output_file)
             
-        output.write_text(json.dumps(package.manifest, indent=4))
+        output.write_text(json.dumps(manifest_data, indent=4))
 
 
 @task (
@@ -303,8 +325,7 @@ def thunderstore(c: Context, skip_dependencies: bool = False, name: str = None,
     else:
         package_list = [p.thunderstore_packages[i] for i in name.split(ARG_SPLIT_CHAR)]
         
-    for package in package_list:
-        package.resolve(c, skip_dependencies)
+    JobBase.resolve_many(c, package_list, skip_dependencies)
 
 
 @task (
@@ -319,6 +340,170 @@ def all(c: Context):
     pass
 
 
+@task(help={
+    'skip_dependencies': "Do not try to resolve dependency jobs.",
+    'name': f"Only build specific symbol indexes. Names should be the keys used in `project.symbol_indexes`, separated by '{ARG_SPLIT_CHAR}'.",
+    'list': f"List all SymbolIndexJob names in `project.symbol_indexes`, then exit."
+})
+def symindex(c: Context, skip_dependencies: bool = False, name: str = None, list: bool = False):
+    """
+    Builds symbol indexes from reference symbol files, as specified in `project.symbol_indexes`.
+    Entries in `project.symbol_indexes` should be instances of `modbuildcore.symbols.SymbolIndexJob`.
+    An index is only rebuilt if its symbol files have changed. `./modbuild.py syms lookup` builds the index it uses too.
+    """
+    if list:
+        print_task_header("Listing symbol index names:")
+        for key in p.symbol_indexes.keys():
+            print_fl(key)
+        return
+    
+    print_task_header("Building symbol indexes...")
+    
+    index_list : list[SymbolIndexJob] = None
+    if name is None:
+        index_list = p.symbol_indexes.values()
+    else:
+        index_list = [p.symbol_indexes[i] for i in name.split(ARG_SPLIT_CHAR)]
+    JobBase.resolve_many(c, index_list, skip_dependencies)
+
+
+@task(
+    positional=['command', 'query'],
+    help={
+        'command': "What to do. Currently only 'lookup'.",
+        'query': f"Symbol names, section names, or addresses (hexadecimal, with '0x'), separated by '{ARG_SPLIT_CHAR}'.",
+        'name': "The symbol index to use. Should be a key used in `project.symbol_indexes`. Defaults to the first one.",
+        'section': "For address lookups: only consider symbols in this section. Useful for overlays, whose addresses can overlap.",
+    }
+)
+def syms(c: Context, command: str, query: str, name: str = None, section: str = None):
+    """
+    Looks up symbols in a symbol index (see `symindex`), building it first if it's missing or out of date.
+    
+    `./modbuild.py syms lookup Player_Update` prints where a symbol is, and `./modbuild.py syms lookup 0x80123456` 
+    prints which symbol an address is in.
+    """
+    if command != "lookup":
+        print_error(f"Unknown syms command '{command}'. Use `./modbuild.py syms lookup <names or addresses>`.")
+        sys.exit(1)
+    
+    index_job: SymbolIndexJob = next(iter(p.symbol_indexes.values())) if name is None else p.symbol_indexes[name]
+    JobBase.resolve_many(c, [index_job])
+    if c.config['run']['dry']:
+        return
+    
+    print_task_header("Symbol lookup:")
+    with index_job.open() as index:
+        for item in query.split(ARG_SPLIT_CHAR):
+            item = item.strip()
+            if item.lower().startswith("0x"):
+                try:
+                    address = int(item, 16)
+                except ValueError:
+                    print_error(f"'{item}' isn't a valid hexadecimal address.")
+                    sys.exit(1)
+                symbol = index.find_by_address(address, section)
+                if symbol is None:
+                    print_fl(f"{item}: no symbol")
+                else:
+                    print_fl(f"{item}: {symbol.name}+0x{address - symbol.vram:X} ({symbol.kind}, {symbol.section.name})")
+                continue
+            
+            symbols = index.find_by_name(item)
+            for symbol in symbols:
+                rom = "" if symbol.rom is None else f", ROM 0x{symbol.rom:08X}"
+                print_fl(f"{symbol.name}: VRAM 0x{symbol.vram:08X}{rom}, size 0x{symbol.size:X} ({symbol.kind}, {symbol.section.name})")
+            sym_section = index.get_section(item)
+            if sym_section is not None:
+                kind = "relocatable section" if sym_section.relocatable else "section"
+                print_fl(f"{sym_section.name}: {kind}, VRAM 0x{sym_section.vram:08X}, ROM 0x{sym_section.rom:08X}, size 0x{sym_section.size:X}")
+            if len(symbols) == 0 and sym_section is None:
+                print_fl(f"{item}: not found")
+
+
+@task(help={
+    'name': f"Only watch and update specific build output folders. Names should be the keys used in `project.build_outputs`, separated by '{ARG_SPLIT_CHAR}'.",
+    'poll': "Detect changes by periodically scanning files, instead of using inotify.",
+    'interval': "Seconds between scans when polling.",
+})
+def watch(c: Context, name: str = None, poll: bool = False, interval: float = 1.0):
+    """
+    Builds the BuildOutputJob folder(s) in `project.build_outputs`, then watches the input_paths of those jobs and their 
+    dependencies. Whenever files change, only the jobs that use those files (and the jobs that depend on them) are resolved again,
+    and the build output folders are updated with their new mod_output_files.
+    
+    Changes to `project.py` itself are not picked up. Restart the watch after editing it. Press Ctrl+C to stop watching.
+    """
+    output_list: list[BuildOutputJob] = None
+    if name is None:
+        output_list = list(p.build_outputs.values())
+    else:
+        output_list = [p.build_outputs[i] for i in name.split(ARG_SPLIT_CHAR)]
+    
+    for output in output_list:
+        output.include_unresolved_jobs = False
+        output.include_all_resolved_jobs = False
+    
+    print_task_header("Preparing build output folders...")
+    JobBase.resolve_many(c, output_list)
+    
+    watcher = create_watcher(get_watch_paths(output_list), poll=poll, interval=interval)
+    print_task_header(f"Watching {len(watcher.paths)} path(s) with {type(watcher).__name__}. Press Ctrl+C to stop.")
+    
+    try:
+        while True:
+            changed = watcher.wait_for_changes()
+            affected = get_affected_jobs(output_list, changed)
+            if len(affected) == 0:
+                continue
+            
+            print_task_header(f"{len(changed)} file(s) changed. Rebuilding {len(affected)} job(s)...")
+            JobBase.reset_resolution()
+            try:
+                JobBase.resolve_many(c, [i for i in output_list if i in affected], restrict_to=affected)
+            except SystemExit:
+                print_error("Rebuild failed. Waiting for further changes...")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+@task(help={
+    'dot': "Write the job graph to this file in Graphviz DOT format.",
+    'json_file': "Write the job graph and its analysis to this file as JSON.",
+})
+def graph(c: Context, dot: str = None, json_file: str = None):
+    """
+    Exports the graph of every job declared in `project.py` and its dependencies, annotated with the average run time 
+    of each job from previous invokations, and reports the critical path.
+    
+    The critical path is the longest chain of dependent jobs, and limits how fast the build can get no matter how many 
+    jobs run concurrently (see `--jobs`). Jobs that have never run have no timing history and are counted as taking no time.
+    
+    This command does not resolve any jobs.
+    """
+    job_graph = JobGraph(get_all_project_jobs())
+    
+    if dot is not None:
+        job_graph.write_dot(Path(dot))
+        print_fl(f"Wrote '{dot}'")
+    if json_file is not None:
+        job_graph.write_json(Path(json_file))
+        print_fl(f"Wrote '{json_file}'")
+    
+    analysis = job_graph.get_analysis()
+    print_task_header("Critical path:")
+    for name in analysis['critical_path']:
+        print_fl(f"\t{name}")
+    print_fl(f"Total work (serial): {analysis['total_work']:.2f}s")
+    print_fl(f"Critical path length: {analysis['critical_path_length']:.2f}s")
+    print_fl(f"Theoretical speedup from parallel execution: {analysis['theoretical_speedup']:.2f}x")
+    print_fl(f"Max useful concurrent jobs: {analysis['max_useful_workers']}")
+    if len(analysis['jobs_without_history']) > 0:
+        print_warning(f"{len(analysis['jobs_without_history'])} job(s) have no timing history yet. Run them at least once for a complete analysis.")
+
+
 @task
 def clean(c: Context):
     """
@@ -330,7 +515,7 @@ def clean(c: Context):
             os.remove(path)
             print_fl(f"Deleted {path}")
         elif path.is_dir():
-            shutil.rmtree(path)
+            remove_tree(path)
             print_fl(f"Deleted {path}")
         else:
             print_fl(f"Could not delete {path}")
@@ -349,6 +534,6 @@ def distclean(c: Context):
         if path.is_file():
             os.remove(path)
         elif path.is_dir():
-            shutil.rmtree(path)
+            remove_tree(path)
         else:
             print_fl(f"Could not delete {path}")